@@ -0,0 +1,129 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+
+import cv2
+import numpy as np
+
+from heatmap import ui_image_path
+
+try:
+    import fcntl
+except ImportError:  # Windows: updates are only serialized within one process
+    fcntl = None
+
+AGGREGATE_DIR = Path(os.getenv("AGGREGATE_DIR", "output/aggregates"))
+# Add every gaze upload (and heatmap upload naming its ui_image_id) to its image's aggregate
+AGGREGATE_UPLOADS = os.getenv("AGGREGATE_UPLOADS", "1") == "1"
+
+
+class HeatmapAggregator:
+    """Running sum of participants' attention maps, one per static UI image.
+
+    Each image's sum is a float32 array memory-mapped from AGGREGATE_DIR, so
+    large studies don't live in RAM and every worker process sees the same
+    totals. Every participant's map is scaled to a total of 1 before it is
+    added, so each one carries equal weight however long they looked; adding
+    one is a single O(pixels) pass and earlier participants are never revisited.
+    """
+
+    def __init__(self, directory: Path = AGGREGATE_DIR):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+
+    def _paths(self, image_id: str):
+        stem = ui_image_path(image_id).name
+        return self.directory / f"{stem}.f32", self.directory / f"{stem}.json"
+
+    @contextmanager
+    def _locked(self, image_id: str):
+        """Serialize updates to one image across threads and (where supported) processes."""
+        lock_path = self._paths(image_id)[1].with_suffix(".lock")
+        with self._lock, open(lock_path, "a") as lock_file:
+            if fcntl:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _meta(self, image_id: str) -> Optional[dict]:
+        meta_path = self._paths(image_id)[1]
+        if not meta_path.exists():
+            return None
+        return json.loads(meta_path.read_text(encoding="utf-8"))
+
+    def add_density(self, image_id: str, density: np.ndarray) -> int:
+        """Add one participant's attention map (any non-negative float map); returns the participant count.
+
+        A map without attention (e.g. a gaze upload with no points) is skipped
+        and doesn't count as a participant.
+        """
+        total = float(density.sum())
+        data_path, meta_path = self._paths(image_id)
+        with self._locked(image_id):
+            meta = self._meta(image_id)
+            if not total > 0:
+                return meta["participants"] if meta else 0
+            shape = tuple(meta["shape"]) if meta else density.shape[:2]
+            if density.shape[:2] != shape:
+                density = cv2.resize(density, (shape[1], shape[0]), interpolation=cv2.INTER_AREA)
+
+            mode = "r+" if meta else "w+"
+            accumulator = np.memmap(data_path, dtype=np.float32, mode=mode, shape=shape)
+            accumulator += density.astype(np.float32, copy=False) * np.float32(1.0 / total)
+            accumulator.flush()
+            del accumulator
+
+            participants = (meta["participants"] if meta else 0) + 1
+            # Replace the sidecar atomically: stats() reads it without taking the lock
+            tmp = meta_path.with_suffix(f".{os.getpid()}.tmp")
+            tmp.write_text(json.dumps({
+                "image_id": image_id, "shape": list(shape), "participants": participants, "updated": time.time(),
+            }), encoding="utf-8")
+            os.replace(tmp, meta_path)
+        return participants
+
+    def add_heatmap(self, image_id: str, heatmap_np: np.ndarray) -> int:
+        """Add an RGBA heatmap overlay, using its alpha channel as the attention map."""
+        return self.add_density(image_id, heatmap_np[..., 3].astype(np.float32))
+
+    def stats(self, image_id: str) -> Optional[dict]:
+        """Participant count, shape and last update of an image's aggregate, or None if it has none."""
+        return self._meta(image_id)
+
+    def aggregate(self, image_id: str, percentile: float = None) -> Optional[np.ndarray]:
+        """The aggregate attention map normalized to 0-1, or None if nothing was added yet.
+
+        With a percentile, only the hottest pixels are kept: attended pixels
+        below that percentile of the attended values are zeroed.
+        """
+        data_path = self._paths(image_id)[0]
+        with self._locked(image_id):
+            meta = self._meta(image_id)
+            if not meta:
+                return None
+            accumulator = np.memmap(data_path, dtype=np.float32, mode="r", shape=tuple(meta["shape"]))
+            result = np.array(accumulator)
+            del accumulator
+
+        peak = float(result.max())
+        if peak <= 0:
+            return result
+        result /= peak
+        if percentile:
+            attended = result[result > 0]
+            result[result < np.percentile(attended, percentile)] = 0
+        return result
+
+    def reset(self, image_id: str):
+        """Drop an image's aggregate, e.g. at the start of a new study."""
+        with self._locked(image_id):
+            for path in self._paths(image_id):
+                path.unlink(missing_ok=True)
@@ -0,0 +1,129 @@
+import os
+from typing import Dict
+
+import cv2
+import numpy as np
+
+from cache import ImageMemo
+from fixations import AOIs, grid_aois
+
+# "detected": AOIs found in the screenshot; "grid": a fixed 3x3 grid
+AOI_MODE = os.getenv("AOI_MODE", "detected")
+
+# Gap (w, h in px) bridged when grouping edges into one element; wider joins words, taller joins lines
+ELEMENT_GAP = (19, 15)
+# Elements outside these bounds (fraction of the image area) are noise or page background
+MIN_AOI_AREA, MAX_AOI_AREA = 0.0004, 0.5
+# Thinner elements are separator rules and borders
+MIN_AOI_SIDE = 6
+MAX_AOIS = 24
+
+
+def _position(x: float, y: float, width: float, height: float) -> str:
+    row = ["top", "middle", "bottom"][min(int(3 * y / height), 2)]
+    col = ["left", "center", "right"][min(int(3 * x / width), 2)]
+    return "center" if (row, col) == ("middle", "center") else f"{row}-{col}"
+
+
+def detect_aois(rgb: np.ndarray, max_aois: int = MAX_AOIS) -> AOIs:
+    """Areas of interest (UI elements and text blocks) in a screenshot, in image pixels.
+
+    Canny edges are dilated by ELEMENT_GAP so an element's outline, icon and
+    label merge into one blob; each outer contour's box, shrunk back by the
+    dilation, is an AOI. AOIs are numbered in reading order and named with
+    their position, e.g. 'A3 (top-right)'.
+    """
+    gray = cv2.cvtColor(np.ascontiguousarray(rgb[..., :3]), cv2.COLOR_RGB2GRAY)
+    height, width = gray.shape
+    edges = cv2.Canny(gray, 40, 120)
+    blobs = cv2.dilate(edges, cv2.getStructuringElement(cv2.MORPH_RECT, ELEMENT_GAP))
+    contours, _ = cv2.findContours(blobs, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return {}
+
+    boxes = np.array([cv2.boundingRect(contour) for contour in contours])
+    # Undo the dilation's growth
+    gx, gy = ELEMENT_GAP[0] // 2, ELEMENT_GAP[1] // 2
+    boxes[:, 0] = np.minimum(boxes[:, 0] + gx, width - 1)
+    boxes[:, 1] = np.minimum(boxes[:, 1] + gy, height - 1)
+    boxes[:, 2] = np.maximum(boxes[:, 2] - 2 * gx, 1)
+    boxes[:, 3] = np.maximum(boxes[:, 3] - 2 * gy, 1)
+
+    area = boxes[:, 2] * boxes[:, 3]
+    keep = (
+        (area >= MIN_AOI_AREA * width * height) & (area <= MAX_AOI_AREA * width * height)
+        & (boxes[:, 2] >= MIN_AOI_SIDE) & (boxes[:, 3] >= MIN_AOI_SIDE)
+    )
+    boxes = boxes[keep]
+    boxes = boxes[np.argsort(boxes[:, 2] * boxes[:, 3])[::-1][:max_aois]]
+    # Reading order: by row band, then left to right
+    boxes = boxes[np.lexsort((boxes[:, 0], boxes[:, 1] // max(height // 20, 1)))]
+
+    aois = {}
+    for n, (x, y, w, h) in enumerate(boxes, 1):
+        aois[f"A{n} ({_position(x + w / 2, y + h / 2, width, height)})"] = (int(x), int(y), int(w), int(h))
+    return aois
+
+
+detect_aois_cached = ImageMemo(detect_aois)
+
+
+def screen_aois(rgb: np.ndarray, width: float = None, height: float = None, mode: str = AOI_MODE) -> AOIs:
+    """AOIs of a screenshot scaled to the (width, height) it was displayed at (default: its own size)."""
+    image_height, image_width = rgb.shape[:2]
+    width, height = width or image_width, height or image_height
+    if mode == "grid":
+        return grid_aois(width, height)
+
+    aois = detect_aois_cached(rgb)
+    if not aois:
+        return grid_aois(width, height)
+    sx, sy = width / image_width, height / image_height
+    return {name: (x * sx, y * sy, w * sx, h * sy) for name, (x, y, w, h) in aois.items()}
+
+
+def aoi_attention(attention: np.ndarray, aois: AOIs) -> Dict[str, dict]:
+    """Share of the total attention and attention density (vs the image mean) inside each AOI.
+
+    attention is any non-negative map (a heatmap's alpha, a gaze density) in
+    the AOIs' coordinates. Box sums come from one integral image, so the
+    cost does not grow with AOI size.
+    """
+    names = list(aois)
+    if not names:
+        return {}
+
+    attention = np.ascontiguousarray(attention, dtype=np.float64)
+    height, width = attention.shape
+    integral = cv2.integral(attention)
+    boxes = np.array([aois[name] for name in names], dtype=np.float64)
+    x0 = np.clip(np.round(boxes[:, 0]), 0, width).astype(np.intp)
+    y0 = np.clip(np.round(boxes[:, 1]), 0, height).astype(np.intp)
+    x1 = np.clip(np.round(boxes[:, 0] + boxes[:, 2]), 0, width).astype(np.intp)
+    y1 = np.clip(np.round(boxes[:, 1] + boxes[:, 3]), 0, height).astype(np.intp)
+
+    mass = integral[y1, x1] - integral[y0, x1] - integral[y1, x0] + integral[y0, x0]
+    pixels = np.maximum((x1 - x0) * (y1 - y0), 1)
+    total = integral[-1, -1]
+    mean = total / (width * height)
+
+    share = mass / total if total > 0 else np.zeros(len(names))
+    lift = (mass / pixels) / mean if mean > 0 else np.zeros(len(names))
+    return {
+        name: {"box": [round(float(v)) for v in aois[name]], "share": round(float(share[a]), 4),
+               "density": round(float(lift[a]), 2)}
+        for a, name in enumerate(names)
+    }
+
+
+def format_aoi_attention(attention: Dict[str, dict]) -> str:
+    """Compact text table of aoi_attention() output for an LLM prompt."""
+    lines = [
+        "Detected areas of interest (box x,y,w,h in image px) with their share of the heatmap's attention "
+        "and attention density relative to the page average. Refer to UI elements by these boxes.",
+        "AOI | box | attention share | density",
+    ]
+    ranked = sorted(attention.items(), key=lambda item: item[1]["share"], reverse=True)
+    for name, aoi in ranked:
+        lines.append(f"{name} | {','.join(str(v) for v in aoi['box'])} | {aoi['share']:.1%} | {aoi['density']}x")
+    return "\n".join(lines)
@@ -1,43 +1,96 @@
+import time
+IMPORT_STARTED = time.perf_counter()
+
+import io
 import json
-from flask import Flask, request, jsonify, render_template
+import threading
+from flask import Flask, Response, request, jsonify, render_template, send_from_directory, stream_with_context
 from flask_cors import CORS
-import io
 import os
-from PIL import Image
-import base64
+import re
+import sqlite3
+import uuid
 import cv2
 import numpy as np
-from crewai import Agent, Task, Crew, LLM, Process
-from crewai.project import CrewBase, agent, crew, task
 from dotenv import load_dotenv
 from pathlib import Path
-from datetime import datetime
-from crew import UIEvalCrew
-from openai import OpenAI
+from aggregate import AGGREGATE_UPLOADS, HeatmapAggregator
+from artifacts import get_artifact_store
+from aoi import AOI_MODE, aoi_attention, detect_aois_cached, format_aoi_attention, screen_aois
+from cache import AnalysisCache, schema_version
+from contrast import CONTRAST_ANALYSIS, analyze_contrast_cached, format_contrast_findings
+from fixations import format_gaze_metrics, gaze_metrics
+from heatmap import blend_heatmap, colorize_density, decode_image, encode_png, gaze_density, load_ui_image, ui_image_path
+from jobs import JobQueue, QueueFullError
+from live import MAX_FRAME_BYTES, LiveGaze, LiveSession, upscale
+from metrics import (HTTP_IN_FLIGHT, HTTP_REQUESTS, HTTP_SECONDS, JOBS_PENDING, LIVE_SAMPLES, LIVE_SESSIONS, REGISTRY,
+                     end_trace, note, span, start_trace)
+from preprocess import VISION_DETAIL, VISION_MODE, prepare_vision_images
+from prompts import PROMPT_MODE, prompt_tokens_report, response_model, vision_messages
+from report_stream import ReportStreams, format_sse
+from store import get_store
+from study import DEFAULT_STUDY, Study, get_study, load_studies, synthesize
+from warehouse import FINDING_FILTERS, get_warehouse
 from pydantic import Field, BaseModel
 from typing import List
 
+try:
+    from flask_sock import Sock
+except ImportError:  # no /live/ws; live gaze frames can still be POSTed to /live/<session_id>/gaze
+    Sock = None
+
 app = Flask(__name__)
 CORS(app)
 
 load_dotenv()
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 
-# Global variable to store analysis data for all images
-analysis_data = {"reports": [], "images": []}
+# crewai (~2.5s) and openai (~0.6s) are imported on first use rather than here.
+# "lazy": import them when the first analysis needs them
+# "background": as lazy, but import and build a crew on a thread right after startup
+# "preload": import and build a crew while loading this module; use with
+#            `gunicorn --preload app:app` so forked workers share them
+STARTUP_MODE = os.getenv("STARTUP_MODE", "lazy")
 
-# Create heatmaps directory
-HEATMAPS_DIR = Path("output/heatmaps")
-HEATMAPS_DIR.mkdir(parents=True, exist_ok=True)
+# Per-session analysis data, shared by all threads and worker processes
+analysis_store = get_store()
 
-OUTPUT_DIR = Path("output")
-OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+# Live crew output per session, pushed to analysis.html over SSE
+report_streams = ReportStreams()
 
-def save_markdown_report(report: str, images: List[str]) -> str:
-    """Save the final report as a markdown file with a unique timestamp and embedded images."""
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    filename = OUTPUT_DIR / f"ui_analysis_{timestamp}.md"
-    
+# Vision analysis and crew synthesis run here instead of in the request
+job_queue = JobQueue(analysis_store)
+JOBS_PENDING.set_function(job_queue.pending)
+
+# Running attention totals over all participants, per static UI image
+heatmap_aggregator = HeatmapAggregator()
+
+# Structured, queryable copy of every analysis and crew result (None when WAREHOUSE=0)
+warehouse = get_warehouse()
+
+# Gaze streamed live from participants' pages, with a rolling heatmap per session
+live_gaze = LiveGaze()
+LIVE_SESSIONS.set_function(lambda: len(live_gaze.sessions()))
+
+SESSION_ID_PATTERN = re.compile(r"[A-Za-z0-9_-]{1,64}")
+
+# Fixation detection for timestamped gaze uploads: "ivt" or "idt"
+FIXATION_METHOD = os.getenv("FIXATION_METHOD", "ivt")
+
+# Upper bound on points accepted by a single gaze-mode upload
+MAX_GAZE_POINTS = 200_000
+# Read size when copying multipart uploads into their buffer
+UPLOAD_CHUNK_SIZE = 1 << 20
+
+# Heatmaps and reports, named by content hash and written in the background; eviction
+# (if enabled) keeps those the warehouse still refers to
+artifact_store = get_artifact_store(warehouse.referenced if warehouse else None)
+
+OUTPUT_DIR = artifact_store.directory
+HEATMAPS_DIR = OUTPUT_DIR / "heatmaps"
+
+def save_markdown_report(report: str, images: List[str], session_id: str = "") -> str:
+    """Save the final report as a markdown file with embedded images; returns its absolute path."""
     # Split the report into sections for each image
     sections = report.split("---")
     
@@ -50,19 +103,14 @@ def save_markdown_report(report: str, images: List[str]) -> str:
             image_path = f"heatmaps/{Path(images[i]).name}"
             markdown_content += f"![Image {i+1}]({image_path})\n\n"
     
-    # Write the markdown content to the file
-    with open(filename, "w", encoding="utf-8") as file:
-        file.write(markdown_content)
-    
-    return str(filename.absolute())
+    # Queue the markdown content for writing
+    path = artifact_store.put("report", markdown_content.encode("utf-8"), session_id)
+    return str((OUTPUT_DIR / path).absolute())
 
 
-def save_heatmap(image: Image.Image) -> str:
-    """Save blended image to heatmaps directory with timestamp"""
-    timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-    filename = HEATMAPS_DIR / f"heatmap_{timestamp}.png"
-    image.save(filename)
-    return str(filename.relative_to(HEATMAPS_DIR.parent))
+def save_heatmap(png: bytes, session_id: str = "") -> str:
+    """Queue an already-encoded blended PNG for the heatmaps directory; returns its path relative to output."""
+    return artifact_store.put("heatmap", png, session_id)
 
 
 # Define nested models for each dictionary field
@@ -143,6 +191,7 @@ class AccessibilityIssue(BaseModel):
         description="""
         The specific issue (e.g., 'Text contrast ratio for some elements is 3:1, which does not meet the required 4.5:1 for normal text').
         Include how it deviates from WCAG 2.1 standards.
+        When measured contrast ratios are provided, quote those instead of estimating.
         """
     )
     location: str = Field(
@@ -254,91 +303,875 @@ class APIAnalysis(BaseModel):
         default_factory=list
     )
 
+ANALYSIS_PROMPT = "Analyze this UI heatmap showing user gaze data for its visual clarity and whether it meets WCAG standards. Identify areas of high and low attention. All points should be explained in detail and justified by standard UI/UX principles, practices, heuristics and existing research."
+ANALYSIS_PROMPT_COMPACT = "Analyze this UI gaze heatmap for visual clarity and WCAG conformance. Identify high- and low-attention areas. Justify each point with UI/UX principles and heuristics; be specific and concise."
+
+# Sent as the system message and response schema; identical on every call, so they form the cacheable prefix
+ANALYSIS_INSTRUCTIONS = ANALYSIS_PROMPT_COMPACT if PROMPT_MODE == "compact" else ANALYSIS_PROMPT
+ANALYSIS_RESPONSE_MODEL = response_model(APIAnalysis)
+
+# Rough per-call budget charged against the TPM limiter before the real usage is known
+ESTIMATED_IMAGE_TOKENS = 1100
+ESTIMATED_COMPLETION_TOKENS = 1500
+
+# Repeat analyses of the same blend and prompt are served from here
+analysis_cache = AnalysisCache()
+ANALYSIS_SCHEMA_VERSION = schema_version(ANALYSIS_RESPONSE_MODEL)
+# Different image preprocessing can change the answer, so it is part of the cache scope
+ANALYSIS_CACHE_VERSION = f"{ANALYSIS_SCHEMA_VERSION}:{VISION_MODE}:{VISION_DETAIL}"
+
 @app.route("/")
 def home():
     return render_template("index.html")
 
+def analyze_image(image_parts: List[dict], context: str = None, image_tokens: int = ESTIMATED_IMAGE_TOKENS,
+                  usage: dict = None) -> str:
+    """Ask GPT-4o for an APIAnalysis of the prepared heatmap image parts; returns the JSON text.
+
+    context is the per-call measured data sent with the images. If a usage
+    dict is passed it is filled with the call's token counts.
+    """
+    # Analyze the image using OpenAI's GPT-4 through the shared, rate-limited client
+    from llm_client import cached_tokens, get_client
+
+    tokens = prompt_tokens_report(ANALYSIS_INSTRUCTIONS, ANALYSIS_RESPONSE_MODEL, context, image_tokens)
+    with span("vision_call"):
+        completion = get_client().parse(
+            estimated_tokens=tokens["fixed_tokens"] + tokens["variable_tokens"] + ESTIMATED_COMPLETION_TOKENS,
+            model="gpt-4o",
+            messages=vision_messages(ANALYSIS_INSTRUCTIONS, context, image_parts),
+            response_format=ANALYSIS_RESPONSE_MODEL,
+            # Routes calls with the same prefix to the same cache
+            prompt_cache_key=f"ui-eval-analysis-{PROMPT_MODE}",
+        )
+
+    if completion.usage:
+        tokens["cached_tokens"] = cached_tokens(completion.usage)
+        note(prompt_tokens=completion.usage.prompt_tokens, completion_tokens=completion.usage.completion_tokens,
+             **tokens)
+
+    if usage is not None and completion.usage:
+        usage["prompt_tokens"] = completion.usage.prompt_tokens
+        usage["completion_tokens"] = completion.usage.completion_tokens
+        usage["total_tokens"] = completion.usage.total_tokens
+        usage.update(tokens)
+
+    return completion.choices[0].message.content
+
+
+def vision_analysis(blended: np.ndarray, heatmap_np: np.ndarray, context: str = None, source_png: bytes = None,
+                    usage: dict = None):
+    """Cached GPT-4o analysis of a blend; returns (analysis JSON, cached, vision input report).
+
+    On a cache miss the blend is downscaled, optionally cropped to the
+    attended regions of heatmap_np, and re-encoded before the call (reusing
+    source_png, the saved encoding, when nothing needs resizing); the
+    report describes the bytes and tokens saved and the call's fixed vs
+    variable prompt tokens (None on a cache hit).
+    """
+    report = {}
+
+    def compute():
+        attention = heatmap_np[..., 3]
+        if attention.shape != blended.shape[:2]:
+            attention = cv2.resize(attention, (blended.shape[1], blended.shape[0]))
+        with span("vision_prepare"):
+            parts, vision_report = prepare_vision_images(blended, attention, source_png=source_png)
+        report.update(vision_report)
+        report.update(prompt_tokens_report(ANALYSIS_INSTRUCTIONS, ANALYSIS_RESPONSE_MODEL, context,
+                                           vision_report["estimated_tokens"]))
+        return analyze_image(parts, context, vision_report["estimated_tokens"], usage)
+
+    prompt = ANALYSIS_INSTRUCTIONS + ("\n\n" + context if context else "")
+    analysis, cached = analysis_cache.get_or_compute(blended, prompt, ANALYSIS_CACHE_VERSION, compute)
+    return analysis, cached, report or None
+
+
+def crew_report(analysis: str, context: str = None) -> str:
+    """An image's analysis as handed to the crew, followed by the measured data it was based on."""
+    return f"{analysis}\n\nMeasured data:\n{context}" if context else analysis
+
+
+def process_heatmap(session_id: str, ui_bytes: bytearray, heatmap_bytes: bytearray, image_id: str = None,
+                    study_id: str = None, progress=lambda stage: None) -> dict:
+    """Blend, analyze and (once the session completes a batch of its study) synthesize one uploaded heatmap.
+
+    image_id names the static UI image the heatmap was recorded on, if any; the
+    heatmap is then added to that image's aggregate.
+    """
+    # Decode straight from the upload buffers into RGBA arrays
+    progress("blending")
+    with span("decode"):
+        ui_np = decode_image(ui_bytes)
+        heatmap_np = decode_image(heatmap_bytes)
+    del ui_bytes, heatmap_bytes
+
+    if image_id and AGGREGATE_UPLOADS:
+        with span("aggregate"):
+            heatmap_aggregator.add_heatmap(image_id, heatmap_np)
+
+    # The decoded UI image is ours, so the blend can be written over it
+    return analyze_heatmap(session_id, ui_np, heatmap_np, progress, blend_in_place=True, study=get_study(study_id),
+                           image_id=image_id)
+
+
+def process_gaze(session_id: str, image_id: str, points: np.ndarray, display_size, study_id: str = None,
+                 progress=lambda stage: None) -> dict:
+    """Render raw gaze points over a static UI image, then analyze it like an uploaded heatmap.
+
+    points holds x, y, value and optionally t (ms) columns; with timestamps the
+    measured fixation/AOI metrics are added to the vision prompt.
+    """
+    progress("rendering")
+    with span("render"):
+        ui_np = load_ui_image(image_id)
+        density = gaze_density(points[:, :3], ui_np.shape[:2], display_size)
+        heatmap_np = colorize_density(density)
+    if AGGREGATE_UPLOADS:
+        with span("aggregate"):
+            heatmap_aggregator.add_density(image_id, density)
+
+    metrics = None
+    if points.shape[1] == 4:
+        progress("detecting fixations")
+        width, height = display_size or (ui_np.shape[1], ui_np.shape[0])
+        with span("fixations"):
+            metrics = gaze_metrics(points[:, [0, 1, 3]], screen_aois(ui_np, width, height), FIXATION_METHOD)
+
+    result = analyze_heatmap(
+        session_id, ui_np, heatmap_np, progress,
+        context=format_gaze_metrics(metrics) if metrics else None, study=get_study(study_id),
+        image_id=image_id, source="gaze",
+    )
+    if metrics:
+        result["gaze_metrics"] = metrics
+    return result
+
+
+def process_aggregate(session_id: str, image_id: str, percentile: float = None, progress=lambda stage: None) -> dict:
+    """Analyze the aggregate attention of all participants on a static UI image as one heatmap."""
+    progress("rendering")
+    with span("render"):
+        density = heatmap_aggregator.aggregate(image_id, percentile)
+        if density is None:
+            raise ValueError(f"No gaze data aggregated for {image_id}")
+        ui_np = load_ui_image(image_id)
+        heatmap_np = colorize_density(density)
+
+    participants = heatmap_aggregator.stats(image_id)["participants"]
+    context = f"This heatmap is the combined attention of {participants} participants, each weighted equally."
+    if percentile:
+        context += f" Only attention above the {percentile:g}th percentile is shown."
+    result = analyze_heatmap(session_id, ui_np, heatmap_np, progress, context=context, image_id=image_id,
+                             source="aggregate")
+    result["participants"] = participants
+    return result
+
+
+def analyze_heatmap(session_id: str, ui_np: np.ndarray, heatmap_np: np.ndarray, progress=lambda stage: None,
+                    context: str = None, blend_in_place: bool = False, study: Study = None, image_id: str = None,
+                    source: str = "upload") -> dict:
+    """Analyze a UI image with its RGBA heatmap overlay and store the result for the session.
+
+    context is extra measured data (e.g. fixation metrics) appended to the prompt.
+    blend_in_place lets the blend overwrite ui_np instead of allocating a new array.
+    study sets how many analyses make a crew run and how they are synthesized
+    (default: the DEFAULT_STUDY). image_id (the static UI image, if known) and
+    source (upload, gaze, aggregate) are recorded with it in the warehouse.
+    """
+    study = study or get_study()
+    # Measured on the UI image itself, so it has to happen before an in-place blend
+    measured = [context] if context else []
+    aois = None
+    if AOI_MODE == "detected":
+        progress("detecting areas of interest")
+        with span("aois"):
+            attention = heatmap_np[..., 3]
+            if attention.shape != ui_np.shape[:2]:
+                attention = cv2.resize(attention, (ui_np.shape[1], ui_np.shape[0]))
+            aois = aoi_attention(attention, detect_aois_cached(ui_np))
+        measured.append(format_aoi_attention(aois))
+    contrast = None
+    if CONTRAST_ANALYSIS:
+        progress("measuring contrast")
+        with span("contrast"):
+            contrast = analyze_contrast_cached(ui_np)
+        measured.append(format_contrast_findings(contrast))
+    context = "\n\n".join(measured) or None
+
+    progress("blending")
+    # The heatmap's alpha is still needed for cropping, so only the UI buffer can be reused
+    in_place = blend_in_place and ui_np.flags.writeable
+    with span("blend"):
+        blended = blend_heatmap(ui_np, heatmap_np, out=ui_np if in_place else None)
+
+    # Encode once; the same PNG bytes go to disk and to the vision call
+    with span("encode_png"):
+        png = encode_png(blended)
+    with span("save_heatmap"):
+        heatmap_path = save_heatmap(png, session_id)
+
+    # Analyze the image, reusing a cached analysis of the same blend and prompt
+    progress("analyzing")
+    with span("vision_analysis"):
+        analysis_result, cached, vision_report = vision_analysis(blended, heatmap_np, context, png)
+    note(cached=cached)
+    record_analysis(session_id, analysis_result, image_id, study.id, heatmap_path, source, aois, contrast)
+
+    # Store the analysis result and image for this session. The store hands back
+    # the session's reports (and resets them) once a batch of the study is in.
+    with span("store"):
+        batch = analysis_store.add_analysis(session_id, crew_report(analysis_result, context), heatmap_path,
+                                            study.size)
+
+    result = {"session_id": session_id, "heatmap": heatmap_path, "analysis": analysis_result, "cached": cached,
+              "vision_input": vision_report}
+    if aois:
+        result["aois"] = aois
+    if contrast:
+        result["contrast"] = contrast
+
+    # If the batch is complete, pass the results to the crew
+    if batch:
+        result["report"] = synthesize_report(session_id, batch, study, progress)
+
+    return result
+
+
+def synthesize_report(session_id: str, batch: dict, study: Study, progress=lambda stage: None,
+                      partial: bool = False) -> str:
+    """Run the crew over a batch of the session's analyses, stream and store its report; returns the report path.
+
+    partial marks a report made from fewer analyses than a full batch, when a
+    participant finished early.
+    """
+    progress("synthesizing")
+    report_streams.open(session_id)
+    report_streams.publish(session_id, "status", {"stage": "synthesizing"})
+    recommendations = []
+    try:
+        # One recommendation task per image, run concurrently, then the compiled report(s);
+        # the crew records its own crew_build/crew_kickoff/crew_task spans
+        final_report = synthesize(
+            batch["reports"], study,
+            lambda agent, text: report_streams.publish(session_id, "chunk", {"agent": agent, "text": text}),
+            recommendations,
+        )
+    except Exception as e:
+        report_streams.publish(session_id, "error", {"error": str(e) or type(e).__name__}, done=True)
+        raise
+    if partial:
+        final_report = (f"_Partial report: the session ended after {len(batch['reports'])} of "
+                        f"{study.size} images._\n\n{final_report}")
+
+    # Save the final report as a markdown file
+    with span("save_report"):
+        report_path = save_markdown_report(final_report, batch["images"], session_id)
+        analysis_store.set_final_report(session_id, final_report)
+    report_streams.publish(session_id, "report", {"report": final_report}, done=True)
+    record_recommendations(session_id, recommendations, batch["images"], study.id, report_path)
+    return report_path
+
+
+def record_analysis(session_id: str, analysis: str, image_id: str = None, study_id: str = None, heatmap: str = None,
+                    source: str = "upload", aois: dict = None, contrast: dict = None):
+    """Add an analysis to the warehouse; a failure there is logged and doesn't fail the analysis."""
+    if warehouse is None:
+        return
+    try:
+        with span("warehouse"):
+            warehouse.add_analysis(session_id, analysis, image_id, study_id, heatmap, source, aois, contrast)
+    except Exception as e:
+        print("Error recording analysis in warehouse:", str(e))
+
+
+def record_recommendations(session_id: str, recommendations: list, heatmaps: List[str], study_id: str = None,
+                           report: str = None):
+    """Add a report's per-image crew results to the warehouse; failures are logged only."""
+    if warehouse is None or not recommendations:
+        return
+    try:
+        with span("warehouse"):
+            warehouse.add_recommendations(session_id, recommendations, heatmaps, study_id, report)
+    except Exception as e:
+        print("Error recording recommendations in warehouse:", str(e))
+
+
+def process_finish(session_id: str, study_id: str = None, progress=lambda stage: None) -> dict:
+    """Synthesize a partial report from the session's analyses that haven't made a full batch.
+
+    Analyses still running when this is called aren't included.
+    """
+    batch = analysis_store.take_analyses(session_id)
+    if not batch:
+        return {"session_id": session_id, "images": 0, "report": None}
+    report_path = synthesize_report(session_id, batch, get_study(study_id), progress, partial=True)
+    return {"session_id": session_id, "images": len(batch["reports"]), "report": report_path}
+
+
 @app.route("/upload_heatmap", methods=["POST"])
 def upload_heatmap():
-    global analysis_data
+    # Gaze mode: a JSON body of raw gaze points plus the ID of a static UI image
+    if request.is_json:
+        payload = request.get_json(silent=True)
+        if not isinstance(payload, dict):
+            return jsonify(error="Invalid gaze data", details="The body must be a JSON object"), 400
+        return upload_gaze(payload)
 
     if "heatmap" not in request.files or "ui_image" not in request.files:
         return jsonify(error="No files uploaded"), 400
 
+    session_id = request.form.get("session_id") or uuid.uuid4().hex
+    if not SESSION_ID_PATTERN.fullmatch(session_id):
+        return jsonify(error="Invalid session_id"), 400
+
+    # Optional: the static UI image the heatmap was recorded on, for the per-image aggregate
+    image_id = request.form.get("ui_image_id") or None
+    if image_id:
+        try:
+            ui_image_path(image_id)
+        except FileNotFoundError as e:
+            return jsonify(error=str(e)), 400
+
+    study_id = request.form.get("study_id") or None
     try:
-        # Process images
-        ui_img = Image.open(request.files["ui_image"]).convert("RGBA")
-        heatmap_img = Image.open(request.files["heatmap"]).convert("RGBA")
+        get_study(study_id)
+    except KeyError as e:
+        return jsonify(error=e.args[0]), 400
 
-        # Image processing
-        ui_np = np.array(ui_img)
-        heatmap_np = np.array(heatmap_img)
+    # Read the uploads now; the request files are closed once we return
+    with span("read_upload"):
+        ui_bytes = read_upload(request.files["ui_image"])
+        heatmap_bytes = read_upload(request.files["heatmap"])
 
-        if ui_np.shape[:2] != heatmap_np.shape[:2]:
-            heatmap_np = cv2.resize(heatmap_np, (ui_np.shape[1], ui_np.shape[0]))
+    return submit_job(session_id, process_heatmap, session_id, ui_bytes, heatmap_bytes, image_id, study_id)
 
-        alpha = heatmap_np[..., 3] / 255.0
-        alpha = np.expand_dims(alpha, axis=-1)
 
-        ui_float = ui_np.astype(np.float32) / 255.0
-        heatmap_float = heatmap_np.astype(np.float32) / 255.0
+def read_upload(file) -> bytearray:
+    """Read an uploaded file chunk by chunk into a single growable buffer.
 
-        blended = ui_float * (1 - alpha) + heatmap_float * alpha
-        blended = (blended * 255).astype(np.uint8)
-        combined_img = Image.fromarray(blended)
+    Avoids the intermediate bytes copies of file.read(); the decoder reads
+    the buffer in place.
+    """
+    buffer = bytearray()
+    while True:
+        chunk = file.stream.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            return buffer
+        buffer += chunk
 
-        # Save image and convert to base64
-        heatmap_path = save_heatmap(combined_img)
-        analysis_data["images"].append(heatmap_path)
-        buffered = io.BytesIO()
-        combined_img.save(buffered, format="PNG")
-        combined_base64 = base64.b64encode(buffered.getvalue()).decode("utf-8")
 
-        # Analyze the image using OpenAI's GPT-4
-        client = OpenAI()
-        completion = client.beta.chat.completions.parse(
-            model="gpt-4o",
-            messages=[{
-                "role": "user",
-                "content": [
-                    {"type": "text", "text": "Analyze this UI heatmap showing user gaze data for its visual clarity and whether it meets WCAG standards. Identify areas of high and low attention. All points should be explained in detail and justified by standard UI/UX principles, practices, heuristics and existing research."},
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/png;base64,{combined_base64}",
-                        },
-                    },
-                ]
-            }],
-            response_format=APIAnalysis
-        )
+def upload_gaze(payload: dict):
+    """Queue analysis of {"ui_image_id", "gaze": [[x, y, value, t], ...], "display": [w, h]}."""
+    session_id = payload.get("session_id") or uuid.uuid4().hex
+    if not isinstance(session_id, str) or not SESSION_ID_PATTERN.fullmatch(session_id):
+        return jsonify(error="Invalid session_id"), 400
 
-        analysis_result = completion.choices[0].message.content
+    image_id = payload.get("ui_image_id")
+    try:
+        ui_image_path(str(image_id))
+    except FileNotFoundError as e:
+        return jsonify(error=str(e)), 400
 
-        # Store the analysis result and image for this heatmap
-        analysis_data["reports"].append(analysis_result)
+    study_id = str(payload.get("study_id") or "") or None
+    try:
+        get_study(study_id)
+    except KeyError as e:
+        return jsonify(error=e.args[0]), 400
 
-        # If all 3 images have been processed, pass the results to the crew
-        if len(analysis_data["reports"]) == 3:
-            inputs = {
-                "analysis_result": analysis_data["reports"]
-            }
-            results = UIEvalCrew().crew().kickoff(inputs=inputs)
-            final_report = results.raw
+    try:
+        points = np.asarray(payload.get("gaze") or [], dtype=np.float64)
+        if points.size == 0:
+            points = np.empty((0, 3))
+        if points.ndim != 2 or points.shape[1] not in (3, 4):
+            raise ValueError("gaze must be a list of [x, y, value] or [x, y, value, t] points")
+        if not np.isfinite(points).all():
+            raise ValueError("gaze contains non-finite values")
+        display_size = payload.get("display")
+        if display_size is not None:
+            display_size = tuple(float(v) for v in display_size)
+            if len(display_size) != 2 or not np.isfinite(display_size).all() or min(display_size) <= 0:
+                raise ValueError("display must be [width, height]")
+    except (TypeError, ValueError) as e:
+        return jsonify(error="Invalid gaze data", details=str(e)), 400
 
-            # Save the final report as a markdown file
-            report_path = save_markdown_report(final_report, analysis_data["images"])
-            analysis_data["final_report"] = final_report
+    if len(points) > MAX_GAZE_POINTS:
+        return jsonify(error=f"Too many gaze points (max {MAX_GAZE_POINTS})"), 413
 
-            # Reset the analysis data for the next set of images
-            analysis_data["reports"] = []
-            analysis_data["images"] = []
+    return submit_job(session_id, process_gaze, session_id, image_id, points, display_size, study_id)
 
-        return jsonify(message="Heatmap analyzed successfully")
 
-    except Exception as e:
-        print("Error processing heatmap:", str(e))
-        return jsonify(error="Failed to analyze heatmap", details=str(e)), 500
+def submit_job(session_id: str, fn, *args, message: str = "Heatmap queued for analysis"):
+    try:
+        job_id = job_queue.submit(fn, *args)
+    except QueueFullError as e:
+        return jsonify(error=str(e)), 503
+
+    return jsonify(message=message, job_id=job_id, session_id=session_id), 202
+
+
+@app.route("/studies")
+def list_studies():
+    """All study definitions and the ID of the default one."""
+    return jsonify(default=DEFAULT_STUDY,
+                   studies=[dict(study.model_dump(), size=study.size) for study in load_studies().values()])
+
+
+@app.route("/studies/<study_id>")
+def study_definition(study_id):
+    """A study's images and settings, for the participant page."""
+    try:
+        study = get_study(study_id)
+    except KeyError as e:
+        return jsonify(error=e.args[0]), 404
+    return jsonify(dict(study.model_dump(), size=study.size))
+
+
+@app.route("/sessions/<session_id>/finish", methods=["POST"])
+def finish_session(session_id):
+    """Queue a partial report for a participant who stops before completing a batch.
+
+    Optional JSON body (or form): {"study_id": ...}.
+    """
+    if not SESSION_ID_PATTERN.fullmatch(session_id):
+        return jsonify(error="Invalid session_id"), 400
+    payload = request.get_json(silent=True) or request.form
+    if not isinstance(payload, dict):
+        return jsonify(error="The body must be a JSON object"), 400
+    study_id = str(payload.get("study_id") or "") or None
+    try:
+        get_study(study_id)
+    except KeyError as e:
+        return jsonify(error=e.args[0]), 400
+    return submit_job(session_id, process_finish, session_id, study_id, message="Partial report queued")
+
+
+@app.route("/analysis")
+def analysis_page():
+    return render_template("analysis.html")
+
+
+@app.route("/heatmaps/<path:filename>")
+def heatmap_file(filename):
+    # Still queued for writing: serve it from memory
+    png = artifact_store.pending(f"heatmaps/{filename}")
+    if png is not None:
+        return Response(png, mimetype="image/png")
+    response = send_from_directory(HEATMAPS_DIR.absolute(), filename)
+    try:
+        artifact_store.touch(f"heatmaps/{filename}")
+    except sqlite3.Error as e:
+        print("Error recording artifact use:", str(e))
+    return response
+
+
+@app.route("/artifacts")
+def list_artifacts():
+    """Indexed heatmaps and reports, newest first; filter with ?session_id=, ?kind=heatmap|report, ?limit=."""
+    limit = min(request.args.get("limit", 100, type=int), 1000)
+    return jsonify(artifacts=artifact_store.find(request.args.get("session_id"), request.args.get("kind"), limit))
+
+
+@app.route("/get_analysis")
+def get_analysis():
+    session_id = request.args.get("session_id", "")
+    report = analysis_store.get_final_report(session_id)
+    if report is None:
+        return jsonify(error="No report for this session yet"), 404
+    return jsonify(session_id=session_id, analysis=report)
+
+
+@app.route("/stream_report")
+def stream_report():
+    """Server-sent events for a session's crew run: status, chunk, report, then done.
+
+    If the crew runs in another worker process, only the final report is
+    delivered, picked up from the shared store.
+    """
+    session_id = request.args.get("session_id", "")
+    if not SESSION_ID_PATTERN.fullmatch(session_id):
+        return jsonify(error="Invalid session_id"), 400
+
+    def events():
+        existing = analysis_store.get_final_report(session_id)
+        if existing is not None and not report_streams.active(session_id):
+            yield format_sse("report", {"report": existing})
+            yield format_sse("done", {})
+            return
+
+        for item in report_streams.subscribe(session_id):
+            if item is None:
+                # Idle: the run may be happening in another worker process
+                report = analysis_store.get_final_report(session_id)
+                if report is not None and report != existing and not report_streams.active(session_id):
+                    yield format_sse("report", {"report": report})
+                    break
+                yield ": keep-alive\n\n"
+                continue
+            yield format_sse(*item)
+        yield format_sse("done", {})
+
+    return Response(stream_with_context(events()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+
+@app.route("/llm/stats")
+def llm_stats():
+    from llm_client import get_client
+
+    return jsonify(get_client().stats())
+
+
+@app.route("/cache/stats")
+def cache_stats():
+    return jsonify(analysis_cache.stats())
+
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify(error="Unknown job"), 404
+
+    return jsonify(
+        id=job["id"],
+        status=job["status"],
+        stage=job["stage"],
+        created=job["created"],
+        updated=job["updated"],
+        error=job["error"],
+    )
+
+
+@app.route("/jobs/<job_id>/result")
+def job_result(job_id):
+    job = job_queue.get(job_id)
+    if job is None:
+        return jsonify(error="Unknown job"), 404
+    if job["status"] == "failed":
+        return jsonify(error="Failed to analyze heatmap", details=job["error"]), 500
+    if job["status"] != "done":
+        return jsonify(status=job["status"], stage=job["stage"]), 202
+
+    return jsonify(status="done", **job["result"])
+
+@app.route("/aggregates/<image_id>")
+def aggregate_stats(image_id):
+    """Participant count and shape of a UI image's aggregate heatmap."""
+    try:
+        stats = heatmap_aggregator.stats(image_id)
+    except FileNotFoundError as e:
+        return jsonify(error=str(e)), 404
+    if stats is None:
+        return jsonify(error="No gaze data aggregated for this image"), 404
+    return jsonify(stats)
+
+
+@app.route("/aggregates/<image_id>/heatmap")
+def aggregate_heatmap(image_id):
+    """The aggregate as a heatmap PNG overlay, or with ?format=npy the normalized float32 map.
+
+    ?percentile=90 keeps only attention above that percentile.
+    """
+    percentile = request.args.get("percentile", type=float)
+    if percentile is not None and not 0 <= percentile < 100:
+        return jsonify(error="percentile must be in [0, 100)"), 400
+    try:
+        density = heatmap_aggregator.aggregate(image_id, percentile)
+    except FileNotFoundError as e:
+        return jsonify(error=str(e)), 404
+    if density is None:
+        return jsonify(error="No gaze data aggregated for this image"), 404
+
+    if request.args.get("format") == "npy":
+        buffer = io.BytesIO()
+        np.save(buffer, density)
+        return Response(buffer.getvalue(), mimetype="application/octet-stream")
+    return Response(encode_png(colorize_density(density)), mimetype="image/png")
+
+
+@app.route("/aggregates/<image_id>/analyze", methods=["POST"])
+def analyze_aggregate(image_id):
+    """Queue one analysis of the aggregate heatmap instead of one per participant.
+
+    JSON body: {"session_id": ..., "percentile": 90}, both optional.
+    """
+    payload = request.get_json(silent=True) or {}
+    if not isinstance(payload, dict):
+        return jsonify(error="The body must be a JSON object"), 400
+    session_id = payload.get("session_id") or uuid.uuid4().hex
+    if not isinstance(session_id, str) or not SESSION_ID_PATTERN.fullmatch(session_id):
+        return jsonify(error="Invalid session_id"), 400
+    percentile = payload.get("percentile")
+    if percentile is not None and (not isinstance(percentile, (int, float)) or not 0 <= percentile < 100):
+        return jsonify(error="percentile must be in [0, 100)"), 400
+    try:
+        stats = heatmap_aggregator.stats(image_id)
+    except FileNotFoundError as e:
+        return jsonify(error=str(e)), 404
+    if stats is None:
+        return jsonify(error="No gaze data aggregated for this image"), 404
+
+    return submit_job(session_id, process_aggregate, session_id, image_id, percentile)
+
+
+def start_live_session(session_id: str, payload: dict) -> LiveSession:
+    """Start a live gaze session from {"ui_image_id", "display": [w, h], "study_id"}; ValueError if invalid."""
+    if not isinstance(session_id, str) or not SESSION_ID_PATTERN.fullmatch(session_id):
+        raise ValueError("Invalid session_id")
+    image_id = str(payload.get("ui_image_id"))
+    study_id = str(payload.get("study_id") or "") or None
+    try:
+        ui_np = load_ui_image(image_id)
+        get_study(study_id)
+    except (FileNotFoundError, KeyError) as e:
+        raise ValueError(e.args[0])
+
+    display_size = payload.get("display")
+    if display_size is not None:
+        try:
+            display_size = tuple(float(v) for v in display_size)
+        except (TypeError, ValueError):
+            display_size = ()
+        if len(display_size) != 2 or not np.isfinite(display_size).all() or min(display_size) <= 0:
+            raise ValueError("display must be [width, height]")
+    return live_gaze.start(session_id, image_id, ui_np.shape[:2], display_size, study_id)
+
+
+def live_analysis_args(session: LiveSession) -> tuple:
+    """process_gaze arguments analyzing a live session's buffer as if its points had been uploaded."""
+    if not session.ring.size:
+        raise ValueError("No gaze samples received yet")
+    return session.session_id, session.image_id, session.gaze_points(), session.display_size, session.study_id
+
+
+if Sock:
+    sock = Sock(app)
+
+    @sock.route("/live/ws")
+    def live_socket(ws):
+        """Live gaze stream for one participant.
+
+        Text messages are JSON commands: {"type": "start", "session_id",
+        "ui_image_id", "display", "study_id"} (again on every image change) and
+        {"type": "analyze"}, answered with {"type": "started"|"queued"|"error", ...}.
+        Binary messages are gaze frames (see live.decode_frame) and get no reply
+        unless they are rejected. The session's buffer is dropped when the
+        socket closes.
+        """
+        session_id = None
+        try:
+            while True:
+                message = ws.receive()
+                if message is None:
+                    break
+                try:
+                    if isinstance(message, (bytes, bytearray)):
+                        if session_id is None:
+                            raise ValueError("Send a start message before gaze frames")
+                        LIVE_SAMPLES.inc(live_gaze.add(session_id, message), transport="ws")
+                        continue
+
+                    command = json.loads(message)
+                    if not isinstance(command, dict):
+                        raise ValueError("Commands must be JSON objects")
+                    if command.get("type") == "start":
+                        session = start_live_session(command.get("session_id"), command)
+                        if session_id is not None and session_id != session.session_id:
+                            live_gaze.end(session_id)
+                        session_id = session.session_id
+                        ws.send(json.dumps({"type": "started", **session.info()}))
+                    elif command.get("type") == "analyze":
+                        session = live_gaze.get(session_id) if session_id else None
+                        if session is None:
+                            raise ValueError("Send a start message first")
+                        job_id = job_queue.submit(process_gaze, *live_analysis_args(session))
+                        ws.send(json.dumps({"type": "queued", "job_id": job_id, "session_id": session_id}))
+                    else:
+                        raise ValueError(f"Unknown message type: {command.get('type')}")
+                except (KeyError, ValueError, QueueFullError) as e:
+                    ws.send(json.dumps({"type": "error", "error": str(e.args[0]) if e.args else type(e).__name__}))
+        finally:
+            if session_id is not None:
+                live_gaze.end(session_id)
+
+
+@app.route("/live/<session_id>/start", methods=["POST"])
+def live_start(session_id):
+    """HTTP equivalent of the WebSocket start message; JSON body {"ui_image_id", "display", "study_id"}."""
+    payload = request.get_json(silent=True) or {}
+    if not isinstance(payload, dict):
+        return jsonify(error="The body must be a JSON object"), 400
+    try:
+        session = start_live_session(session_id, payload)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    return jsonify(session.info())
+
+
+@app.route("/live/<session_id>/gaze", methods=["POST"])
+def live_frame(session_id):
+    """HTTP equivalent of a WebSocket gaze frame: the packed float32 x, y, t samples as the request body."""
+    if (request.content_length or 0) > MAX_FRAME_BYTES:
+        return jsonify(error=f"Frame too large (max {MAX_FRAME_BYTES} bytes)"), 413
+    try:
+        samples = live_gaze.add(session_id, request.get_data())
+    except KeyError as e:
+        return jsonify(error=e.args[0]), 404
+    except ValueError as e:
+        return jsonify(error="Invalid gaze frame", details=str(e)), 400
+    LIVE_SAMPLES.inc(samples, transport="http")
+    return jsonify(samples=samples)
+
+
+@app.route("/live/<session_id>/analyze", methods=["POST"])
+def live_analyze(session_id):
+    """Queue an analysis of the session's buffered gaze on its current image; nothing has to be uploaded."""
+    session = live_gaze.get(session_id)
+    if session is None:
+        return jsonify(error=f"No live session {session_id}"), 404
+    try:
+        args = live_analysis_args(session)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    return submit_job(session_id, process_gaze, *args, message="Live gaze queued for analysis")
+
+
+@app.route("/live")
+def live_sessions():
+    """Live sessions of this process, optionally only those on ?image_id=."""
+    return jsonify(sessions=[session.info() for session in live_gaze.sessions(request.args.get("image_id"))])
+
+
+@app.route("/live/<session_id>/heatmap")
+def live_session_heatmap(session_id):
+    """A session's live heatmap as a PNG overlay for its UI image, or with ?format=npy the cell-resolution map."""
+    session = live_gaze.get(session_id)
+    if session is None:
+        return jsonify(error=f"No live session {session_id}"), 404
+    return live_heatmap_response(session.density(), session.image_shape)
+
+
+@app.route("/live/images/<image_id>/heatmap")
+def live_image_heatmap(image_id):
+    """Combined live attention of every participant now on a UI image, each weighted equally."""
+    try:
+        image_shape = load_ui_image(image_id).shape[:2]
+    except FileNotFoundError as e:
+        return jsonify(error=str(e)), 404
+    density = live_gaze.image_density(image_id)
+    if density is None:
+        return jsonify(error="No live gaze on this image"), 404
+    return live_heatmap_response(density, image_shape)
+
+
+def live_heatmap_response(density: np.ndarray, image_shape) -> Response:
+    if request.args.get("format") == "npy":
+        buffer = io.BytesIO()
+        np.save(buffer, density)
+        return Response(buffer.getvalue(), mimetype="application/octet-stream")
+    return Response(encode_png(colorize_density(upscale(density, image_shape))), mimetype="image/png")
+
+
+def warehouse_filters() -> dict:
+    """Finding filters from the query string: FINDING_FILTERS columns, q (FTS5 query) and since (Unix time)."""
+    filters = {column: request.args.get(column) for column in FINDING_FILTERS}
+    return dict(filters, text=request.args.get("q"), since=request.args.get("since", type=float))
+
+
+@app.route("/warehouse/findings")
+def warehouse_findings():
+    """Recorded findings, newest first, e.g. ?image_id=image2.png&severity=high&q=contrast&limit=50."""
+    if warehouse is None:
+        return jsonify(error="The warehouse is disabled (WAREHOUSE=0)"), 404
+    limit = min(request.args.get("limit", 100, type=int), 10_000)
+    try:
+        findings = warehouse.findings(limit=limit, **warehouse_filters())
+    except sqlite3.OperationalError as e:
+        return jsonify(error="Invalid query", details=str(e)), 400
+    return jsonify(findings=findings)
+
+
+@app.route("/warehouse/counts")
+def warehouse_counts():
+    """Finding counts per group, e.g. ?by=image_id,severity&kind=accessibility."""
+    if warehouse is None:
+        return jsonify(error="The warehouse is disabled (WAREHOUSE=0)"), 404
+    try:
+        counts = warehouse.counts(request.args.get("by", "image_id,severity").split(","), **warehouse_filters())
+    except (ValueError, sqlite3.OperationalError) as e:
+        return jsonify(error="Invalid query", details=str(e)), 400
+    return jsonify(counts=counts)
+
+
+@app.route("/warehouse/aois/<image_id>")
+def warehouse_aois(image_id):
+    """Mean attention share and density per AOI of a UI image over all recorded analyses."""
+    if warehouse is None:
+        return jsonify(error="The warehouse is disabled (WAREHOUSE=0)"), 404
+    return jsonify(image_id=image_id, aois=warehouse.aoi_attention(image_id))
+
+
+@app.route("/metrics")
+def metrics_endpoint():
+    """Prometheus text exposition of this process's stage timings, token counts, queue and in-flight gauges."""
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+
+def warm_up():
+    """Import crewai and openai and build one crew, so the first analysis doesn't pay for it."""
+    started = time.perf_counter()
+    import llm_client  # noqa: F401
+    from crew import prewarm
+    prewarm()
+    print(f"Warm-up done in {time.perf_counter() - started:.2f}s")
+
+
+_first_request_lock = threading.Lock()
+_first_request_logged = False
+
+
+@app.before_request
+def start_request_timer():
+    request.environ["app.started"] = time.perf_counter()
+    request.environ["app.trace"] = start_trace("request", method=request.method, path=request.path)
+    HTTP_IN_FLIGHT.inc()
+
+
+@app.teardown_request
+def record_request(error=None):
+    record = request.environ.pop("app.trace", None)
+    if record is None:
+        return
+    HTTP_IN_FLIGHT.dec()
+    # The URL rule, not the path, so job IDs and filenames don't each get a series
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    record["status"] = request.environ.get("app.status", 500 if error else None)
+    end_trace(record)
+    HTTP_REQUESTS.inc(endpoint=endpoint, method=request.method, status=record["status"])
+    HTTP_SECONDS.observe(record["duration_ms"] / 1000, endpoint=endpoint)
+
+
+@app.after_request
+def log_first_request(response):
+    global _first_request_logged
+    request.environ["app.status"] = response.status_code
+    if not _first_request_logged:
+        with _first_request_lock:
+            if not _first_request_logged:
+                _first_request_logged = True
+                elapsed = time.perf_counter() - request.environ.get("app.started", time.perf_counter())
+                print(f"First request ({request.path}) served in {elapsed * 1000:.1f} ms, "
+                      f"{time.perf_counter() - IMPORT_STARTED:.2f}s after import started")
+    return response
+
+
+if STARTUP_MODE == "preload":
+    warm_up()
+elif STARTUP_MODE == "background":
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+print(f"app imported in {time.perf_counter() - IMPORT_STARTED:.2f}s (startup mode: {STARTUP_MODE})")
 
 if __name__ == "__main__":
     app.run(port=5000, debug=True)
@@ -0,0 +1,205 @@
+import atexit
+import hashlib
+import os
+import queue
+import threading
+import time
+from contextlib import closing
+from pathlib import Path
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+from db import connect, create
+
+ARTIFACTS_DIR = Path(os.getenv("ARTIFACTS_DIR", "output"))
+ARTIFACTS_DB = Path(os.getenv("ARTIFACTS_DB", "output/artifacts.db"))
+# Opt-in eviction. Artifacts not written, reused or served for this many days are deleted (0 = keep forever)
+ARTIFACT_RETENTION_DAYS = float(os.getenv("ARTIFACT_RETENTION_DAYS", "0"))
+# Total size cap; the least recently used artifacts go first (0 = no cap)
+ARTIFACT_MAX_MB = int(os.getenv("ARTIFACT_MAX_MB", "0"))
+# Writes between retention passes
+EVICT_EVERY = 50
+# Serving an artifact refreshes its last use at most this often (seconds)
+TOUCH_INTERVAL = 600
+
+# kind -> (subdirectory, file name prefix, extension)
+KINDS = {
+    "heatmap": ("heatmaps", "heatmap", "png"),
+    "report": ("", "ui_analysis", "md"),
+}
+
+
+class ArtifactStore:
+    """Content-addressed store for heatmaps and reports, with a SQLite index.
+
+    Files are named by the SHA-256 of their content, so identical blends are
+    stored once and concurrent uploads can't overwrite each other; the index
+    records which sessions produced each artifact. Writes go through a
+    background thread: put() returns the final path straight away, and
+    pending() serves the bytes until they are on disk.
+
+    Eviction is off unless a retention period or size cap is set. referenced,
+    if given, maps candidate paths to those still referenced elsewhere (e.g.
+    by warehouse rows); eviction never deletes those.
+    """
+
+    def __init__(self, directory: Path = ARTIFACTS_DIR, db_path: Path = ARTIFACTS_DB,
+                 retention_days: float = ARTIFACT_RETENTION_DAYS, max_bytes: int = ARTIFACT_MAX_MB * 1024 * 1024,
+                 referenced: Callable[[Iterable[str]], Set[str]] = None):
+        self.directory = Path(directory)
+        self.db_path = Path(db_path)
+        self.retention = retention_days * 24 * 3600
+        self.max_bytes = max_bytes
+        self.referenced = referenced
+        for subdirectory, _, _ in KINDS.values():
+            (self.directory / subdirectory).mkdir(parents=True, exist_ok=True)
+        create(self.db_path, """
+            CREATE TABLE IF NOT EXISTS artifacts (
+                hash TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                path TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_used REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_artifacts_last_used ON artifacts (last_used);
+            CREATE INDEX IF NOT EXISTS idx_artifacts_path ON artifacts (path);
+            CREATE TABLE IF NOT EXISTS artifact_sessions (
+                session_id TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                created REAL NOT NULL,
+                PRIMARY KEY (session_id, hash)
+            );
+            CREATE INDEX IF NOT EXISTS idx_artifact_sessions_hash ON artifact_sessions (hash);
+        """)
+
+        self._queue: "queue.Queue[tuple]" = queue.Queue()
+        self._pending: Dict[str, bytes] = {}
+        self._lock = threading.Lock()
+        self._writer = None
+        self._writes = 0
+
+    def put(self, kind: str, data: bytes, session_id: str = "") -> str:
+        """Queue data for writing and return its path relative to the store directory (with / separators)."""
+        subdirectory, prefix, extension = KINDS[kind]
+        digest = hashlib.sha256(data).hexdigest()
+        path = (Path(subdirectory) / f"{prefix}_{digest[:20]}.{extension}").as_posix()
+
+        with self._lock:
+            # An identical artifact already queued is served from there; on disk it isn't written again
+            self._pending.setdefault(path, data)
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run, name="artifact-writer", daemon=True)
+                self._writer.start()
+        self._queue.put((kind, path, digest, data, session_id, time.time()))
+        return path
+
+    def pending(self, path: str) -> Optional[bytes]:
+        """The bytes of an artifact that is still waiting to be written, if any."""
+        with self._lock:
+            return self._pending.get(path)
+
+    def flush(self):
+        """Wait until every queued artifact is written and indexed."""
+        self._queue.join()
+
+    def touch(self, path: str, now: float = None):
+        """Record a read of an artifact, so eviction treats it as recently used."""
+        now = time.time() if now is None else now
+        with closing(connect(self.db_path)) as conn:
+            conn.execute("UPDATE artifacts SET last_used = ? WHERE path = ? AND last_used < ?",
+                         (now, path, now - TOUCH_INTERVAL))
+
+    def find(self, session_id: str = None, kind: str = None, limit: int = 100) -> List[dict]:
+        """Indexed artifacts, newest first, optionally for one session and/or kind."""
+        query = "SELECT a.hash, a.kind, a.path, a.size, a.created, a.last_used"
+        params = []
+        if session_id:
+            query += ", s.session_id FROM artifacts a JOIN artifact_sessions s ON s.hash = a.hash WHERE s.session_id = ?"
+            params.append(session_id)
+        else:
+            query += ", NULL FROM artifacts a WHERE 1 = 1"
+        if kind:
+            query += " AND a.kind = ?"
+            params.append(kind)
+        query += " ORDER BY a.last_used DESC LIMIT ?"
+        params.append(limit)
+
+        with closing(connect(self.db_path)) as conn:
+            rows = conn.execute(query, params).fetchall()
+        columns = ("hash", "kind", "path", "size", "created", "last_used", "session_id")
+        return [{name: value for name, value in zip(columns, row) if value is not None} for row in rows]
+
+    def evict(self, now: float = None) -> int:
+        """Delete expired artifacts, then the least recently used ones while over the size cap.
+
+        Referenced artifacts are kept (and count towards the cap).
+        """
+        now = time.time() if now is None else now
+        if self.retention <= 0 and self.max_bytes <= 0:
+            return 0
+        with closing(connect(self.db_path)) as conn:
+            rows = conn.execute("SELECT hash, path, size, last_used FROM artifacts ORDER BY last_used").fetchall()
+            kept = self.referenced([path for _, path, _, _ in rows]) if self.referenced and rows else set()
+            doomed = []
+            total = 0
+            for digest, path, size, last_used in rows:
+                if self.retention > 0 and last_used < now - self.retention and path not in kept:
+                    doomed.append((digest, path))
+                else:
+                    total += size
+            if 0 < self.max_bytes < total:
+                expired = {digest for digest, _ in doomed}
+                for digest, path, size, _ in rows:
+                    if total <= self.max_bytes:
+                        break
+                    if digest not in expired and path not in kept:
+                        doomed.append((digest, path))
+                        total -= size
+
+            for digest, path in doomed:
+                (self.directory / path).unlink(missing_ok=True)
+                conn.execute("DELETE FROM artifacts WHERE hash = ?", (digest,))
+                conn.execute("DELETE FROM artifact_sessions WHERE hash = ?", (digest,))
+        return len(doomed)
+
+    def _run(self):
+        while True:
+            kind, path, digest, data, session_id, now = self._queue.get()
+            try:
+                self._write(kind, path, digest, data, session_id, now)
+                self._writes += 1
+                if self._writes % EVICT_EVERY == 0:
+                    self.evict()
+            except Exception as e:
+                print("Error writing artifact", path, str(e))
+            finally:
+                with self._lock:
+                    self._pending.pop(path, None)
+                self._queue.task_done()
+
+    def _write(self, kind: str, path: str, digest: str, data: bytes, session_id: str, now: float):
+        target = self.directory / path
+        if not target.exists():
+            # Write atomically so readers (and other worker processes) never see a partial file
+            tmp = target.with_suffix(f".{os.getpid()}.tmp")
+            tmp.write_bytes(data)
+            os.replace(tmp, target)
+
+        with closing(connect(self.db_path)) as conn:
+            conn.execute(
+                "INSERT INTO artifacts (hash, kind, path, size, created, last_used) VALUES (?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (hash) DO UPDATE SET last_used = excluded.last_used",
+                (digest, kind, path, len(data), now, now),
+            )
+            if session_id:
+                conn.execute(
+                    "INSERT OR IGNORE INTO artifact_sessions (session_id, hash, created) VALUES (?, ?, ?)",
+                    (session_id, digest, now),
+                )
+
+
+def get_artifact_store(referenced: Callable[[Iterable[str]], Set[str]] = None) -> ArtifactStore:
+    store = ArtifactStore(referenced=referenced)
+    # Don't lose queued writes when the process exits normally
+    atexit.register(store.flush)
+    return store
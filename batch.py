@@ -0,0 +1,313 @@
+"""Offline batch analysis of recorded study sessions.
+
+Usage:
+    python batch.py SESSIONS_DIR_OR_MANIFEST [--concurrency 4] [--processes N]
+
+A manifest is a CSV (columns: session, ui_image, heatmap) or a JSON list of
+objects with the same keys. `heatmap` is either a heatmap PNG or a gaze JSON
+file in the /upload_heatmap gaze format ({"ui_image_id", "gaze", "display"}).
+
+A directory holds one subdirectory per session; inside it every
+`<name>.heatmap.png` or `<name>.gaze.json` is paired with `<name>.png` from the
+same directory, falling back to static/ui_images/<name>.png.
+
+Finished analyses and reports are appended to a JSONL checkpoint, so an
+interrupted run picks up where it stopped.
+"""
+import argparse
+import csv
+import json
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import List
+
+import cv2
+import numpy as np
+
+from aoi import AOI_MODE, aoi_attention, detect_aois_cached, format_aoi_attention, screen_aois
+from contrast import CONTRAST_ANALYSIS, analyze_contrast_cached, format_contrast_findings
+from fixations import format_gaze_metrics, gaze_metrics
+from heatmap import UI_IMAGES_DIR, blend_heatmap, colorize_density, encode_png, gaze_density, load_ui_image, to_rgba
+from study import DEFAULT_STUDY, Study, get_study, synthesize
+
+BATCH_DIR = Path("output/batch")
+
+
+def load_items(source: Path) -> List[dict]:
+    """Read (session, ui_image, heatmap) items from a manifest file or a sessions directory."""
+    if source.is_file():
+        if source.suffix.lower() == ".json":
+            rows = json.loads(source.read_text(encoding="utf-8"))
+        else:
+            with open(source, newline="", encoding="utf-8") as file:
+                rows = list(csv.DictReader(file))
+        base = source.parent
+        items = [
+            {
+                "session": str(row["session"]),
+                "ui_image": str(base / row["ui_image"]) if row.get("ui_image") else None,
+                "heatmap": str(base / row["heatmap"]),
+            }
+            for row in rows
+        ]
+    else:
+        items = []
+        for session_dir in sorted(p for p in source.iterdir() if p.is_dir()):
+            for path in sorted(session_dir.iterdir()):
+                if path.name.endswith(".heatmap.png"):
+                    name = path.name[:-len(".heatmap.png")]
+                elif path.name.endswith(".gaze.json"):
+                    name = path.name[:-len(".gaze.json")]
+                else:
+                    continue
+                ui_image = session_dir / f"{name}.png"
+                if not ui_image.is_file():
+                    ui_image = UI_IMAGES_DIR / f"{name}.png"
+                items.append({"session": session_dir.name, "ui_image": str(ui_image), "heatmap": str(path)})
+
+    for item in items:
+        item["id"] = f"{item['session']}/{Path(item['heatmap']).name}"
+    return items
+
+
+def _read_rgba(path: str) -> np.ndarray:
+    image = cv2.imread(path, cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise ValueError(f"Could not read image: {path}")
+    return to_rgba(image)
+
+
+def _measured_context(context, ui_np: np.ndarray, heatmap_np: np.ndarray):
+    """Append the AOI attention table and contrast findings to context, as app.analyze_heatmap does.
+
+    Returns (context, AOI attention or None, contrast summary or None).
+    """
+    measured = [context] if context else []
+    aois = contrast = None
+    if AOI_MODE == "detected":
+        attention = heatmap_np[..., 3]
+        if attention.shape != ui_np.shape[:2]:
+            attention = cv2.resize(attention, (ui_np.shape[1], ui_np.shape[0]))
+        aois = aoi_attention(attention, detect_aois_cached(ui_np))
+        measured.append(format_aoi_attention(aois))
+    if CONTRAST_ANALYSIS:
+        report = analyze_contrast_cached(ui_np)
+        measured.append(format_contrast_findings(report))
+        # The per-region findings are already in the prompt; the warehouse keeps the summary
+        contrast = {key: value for key, value in report.items() if key != "findings"}
+    return "\n\n".join(measured) or None, aois, contrast
+
+
+def prepare_item(item: dict, fixation_method: str):
+    """Blend one item's heatmap over its UI image. Runs in a worker process.
+
+    Returns (item, blended RGBA array, its PNG encoding, RGBA heatmap, extra prompt context or None,
+    AOI attention or None, contrast summary or None).
+    """
+    context = None
+    if item["heatmap"].endswith(".json"):
+        payload = json.loads(Path(item["heatmap"]).read_text(encoding="utf-8"))
+        if item.get("ui_image") and Path(item["ui_image"]).is_file():
+            ui_np = _read_rgba(item["ui_image"])
+        else:
+            ui_np = load_ui_image(payload["ui_image_id"])
+        item["image_id"] = payload["ui_image_id"]
+        points = np.asarray(payload.get("gaze") or [], dtype=np.float64)
+        if points.size == 0:
+            points = np.empty((0, 3))
+        display_size = tuple(payload["display"]) if payload.get("display") else None
+        heatmap_np = colorize_density(gaze_density(points[:, :3], ui_np.shape[:2], display_size))
+
+        if points.shape[1] == 4 and len(points):
+            width, height = display_size or (ui_np.shape[1], ui_np.shape[0])
+            context = format_gaze_metrics(gaze_metrics(points[:, [0, 1, 3]], screen_aois(ui_np, width, height), fixation_method))
+        context, aois, contrast = _measured_context(context, ui_np, heatmap_np)
+        blended = blend_heatmap(ui_np, heatmap_np)
+    else:
+        # Both arrays are freshly decoded, so the blend can overwrite the UI image
+        ui_np = _read_rgba(item["ui_image"])
+        heatmap_np = _read_rgba(item["heatmap"])
+        item["image_id"] = Path(item["ui_image"]).name
+        context, aois, contrast = _measured_context(context, ui_np, heatmap_np)
+        blended = blend_heatmap(ui_np, heatmap_np, out=ui_np)
+
+    return item, blended, encode_png(blended), heatmap_np, context, aois, contrast
+
+
+class Checkpoint:
+    """Append-only JSONL log of finished analyses and reports."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.analyses = {}
+        self.reports = {}
+        if path.exists():
+            with open(path, encoding="utf-8") as file:
+                for line in file:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A crash mid-write can leave a truncated last line
+                        continue
+                    target = self.analyses if record["type"] == "analysis" else self.reports
+                    target[record["id"]] = record
+
+    def add(self, record: dict):
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write(json.dumps(record) + "\n")
+            file.flush()
+            os.fsync(file.fileno())
+        target = self.analyses if record["type"] == "analysis" else self.reports
+        target[record["id"]] = record
+
+
+def run(items: List[dict], checkpoint: Checkpoint, concurrency: int, processes: int,
+        study: Study, fixation_method: str, run_crew: bool) -> dict:
+    # Imported here so blend worker processes don't load Flask, OpenAI and crewai
+    import app
+
+    started = time.time()
+    stats = {"analyzed": 0, "cached": 0, "failed": 0, "tokens": 0, "fixed_tokens": 0, "cached_tokens": 0, "reports": 0,
+             "partial_reports": 0}
+    pending = [item for item in items if item["id"] not in checkpoint.analyses]
+    print(f"{len(items)} items, {len(items) - len(pending)} already analyzed")
+
+    def analyze(item, blended, png, heatmap_np, context, aois, contrast):
+        heatmap_path = app.save_heatmap(png, item["session"])
+
+        usage = {}
+        analysis, cached, _ = app.vision_analysis(blended, heatmap_np, context, png, usage)
+        app.record_analysis(item["session"], analysis, item.get("image_id"), study.id, heatmap_path, "batch",
+                            aois, contrast)
+        return {
+            "type": "analysis",
+            "id": item["id"],
+            "session": item["session"],
+            "image_id": item.get("image_id"),
+            "heatmap": heatmap_path,
+            "analysis": analysis,
+            "cached": cached,
+            "tokens": usage.get("total_tokens", 0),
+            "fixed_tokens": usage.get("fixed_tokens", 0),
+            "cached_tokens": usage.get("cached_tokens", 0),
+            "context": context,
+            "aois": aois,
+            "contrast": contrast,
+        }
+
+    # Blend in a process pool and hand each blend to a bounded pool of vision requests. A blend
+    # holds full-size RGBA arrays and PNG bytes until its analysis is done, so only a window
+    # of items is blended or analyzed at a time and each future is dropped once handled.
+    window = 2 * (processes + concurrency)
+    queued = iter(pending)
+    blending, analyzing = set(), set()
+    with ProcessPoolExecutor(max_workers=processes) as blenders, ThreadPoolExecutor(max_workers=concurrency) as requests:
+        while True:
+            while len(blending) + len(analyzing) < window:
+                item = next(queued, None)
+                if item is None:
+                    break
+                blending.add(blenders.submit(prepare_item, item, fixation_method))
+            if not blending and not analyzing:
+                break
+
+            done, _ = wait(blending | analyzing, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future in blending:
+                    blending.remove(future)
+                    try:
+                        analyzing.add(requests.submit(analyze, *future.result()))
+                    except Exception as e:
+                        stats["failed"] += 1
+                        print("Error blending item:", str(e))
+                    continue
+
+                analyzing.remove(future)
+                try:
+                    record = future.result()
+                except Exception as e:
+                    stats["failed"] += 1
+                    print("Error analyzing item:", str(e))
+                    continue
+                checkpoint.add(record)
+                stats["analyzed"] += 1
+                stats["cached"] += record["cached"]
+                stats["tokens"] += record["tokens"]
+                stats["fixed_tokens"] += record.get("fixed_tokens", 0)
+                stats["cached_tokens"] += record.get("cached_tokens", 0)
+                print(f"[{stats['analyzed']}/{len(pending)}] {record['id']}{' (cached)' if record['cached'] else ''}")
+            del done
+
+    analysis_elapsed = time.time() - started
+
+    # Group each session's analyses, in item order, into crew runs of the study's batch size;
+    # trailing analyses that don't fill a group get a partial report, like a session finished early
+    if run_crew:
+        group_size = study.size
+        for session in dict.fromkeys(item["session"] for item in items):
+            records = [checkpoint.analyses[i["id"]] for i in items if i["session"] == session and i["id"] in checkpoint.analyses]
+            for start in range(0, len(records), group_size):
+                group = records[start:start + group_size]
+                group_id = f"{session}#{start // group_size}"
+                # A partial group's report is redone once later items have been added to it
+                done = checkpoint.reports.get(group_id)
+                if done and done["items"] == [r["id"] for r in group]:
+                    continue
+                partial = len(group) < group_size
+                recommendations = []
+                try:
+                    reports = [app.crew_report(r["analysis"], r.get("context")) for r in group]
+                    report = synthesize(reports, study, recommendations=recommendations)
+                    if partial:
+                        report = f"_Partial report: the session has {len(group)} of {group_size} images._\n\n{report}"
+                    report_path = app.save_markdown_report(report, [r["heatmap"] for r in group], session)
+                except Exception as e:
+                    stats["failed"] += 1
+                    print(f"Error running crew for {group_id}:", str(e))
+                    continue
+                app.record_recommendations(session, recommendations, [r["heatmap"] for r in group], study.id, report_path)
+                checkpoint.add({"type": "report", "id": group_id, "path": report_path, "items": [r["id"] for r in group]})
+                stats["reports"] += 1
+                stats["partial_reports"] += partial
+                print(f"{'Partial report' if partial else 'Report'} for {group_id} ({len(group)} images): {report_path}")
+
+    # Heatmaps and reports are written in the background
+    app.artifact_store.flush()
+    elapsed = time.time() - started
+    stats.update({
+        "elapsed_s": round(elapsed, 2),
+        "images_per_s": round(stats["analyzed"] / analysis_elapsed, 3) if analysis_elapsed else 0.0,
+        "tokens_per_s": round(stats["tokens"] / analysis_elapsed, 1) if analysis_elapsed else 0.0,
+        "prompt_mode": app.PROMPT_MODE,
+        "cache": app.analysis_cache.stats(),
+    })
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Analyze a directory or manifest of recorded sessions.")
+    parser.add_argument("source", type=Path, help="Sessions directory, or a .csv/.json manifest")
+    parser.add_argument("--concurrency", type=int, default=4, help="Concurrent vision requests")
+    parser.add_argument("--processes", type=int, default=os.cpu_count(), help="Blend worker processes")
+    parser.add_argument("--study", default=DEFAULT_STUDY, help="Study in config/studies.yaml setting the synthesis")
+    parser.add_argument("--group-size", type=int, help="Analyses per crew report (default: the study's batch size)")
+    parser.add_argument("--checkpoint", type=Path, default=BATCH_DIR / "checkpoint.jsonl")
+    parser.add_argument("--fixation-method", choices=["ivt", "idt"], default=os.getenv("FIXATION_METHOD", "ivt"))
+    parser.add_argument("--no-crew", action="store_true", help="Only run the per-image vision analyses")
+    args = parser.parse_args()
+
+    study = get_study(args.study)
+    if args.group_size:
+        study = study.model_copy(update={"batch_size": args.group_size})
+
+    items = load_items(args.source)
+    stats = run(items, Checkpoint(args.checkpoint), args.concurrency, args.processes,
+                study, args.fixation_method, not args.no_crew)
+    print(json.dumps(stats, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,438 @@
+"""Benchmarks and load tests for the upload -> analysis -> report pipeline.
+
+Usage:
+    python benchmark.py micro [--repeat 20]
+    python benchmark.py e2e [--sessions 8] [--concurrency 4] [--openai-latency 0.2]
+    python benchmark.py load [--url http://127.0.0.1:5000] [--requests 60] [--concurrency 8]
+    python benchmark.py all --save output/benchmark/baseline.json
+    python benchmark.py all --compare output/benchmark/baseline.json
+
+Fixtures are the UI images in static/ui_images, each paired with a synthetic
+gaze heatmap. `micro` times the image steps of /upload_heatmap (decode, blend,
+PNG encode, vision downscale/encode) plus save_heatmap and save_markdown_report.
+`e2e` drives whole sessions of three uploads through the app in-process and
+`load` replays concurrent multipart uploads like uploadHeatmap in
+static/script.js over HTTP. Without --url both run the app against
+stub_openai.py and a stubbed crew kickoff (--real-crew runs the actual crew
+against the stub), so no network access or API key is needed.
+
+Results are printed as JSON; --save writes them as a baseline and --compare
+prints the change of every latency, throughput and memory figure against one.
+"""
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from heatmap import UI_IMAGES_DIR, blend_heatmap, colorize_density, decode_image, encode_png, gaze_density, load_ui_image
+from preprocess import prepare_vision_images
+
+BENCHMARK_DIR = Path("output/benchmark")
+# Seconds between /jobs/<id> polls
+POLL_INTERVAL = 0.02
+# Figures that --compare reports
+COMPARED_SUFFIXES = ("_ms", "_per_s", "_mb")
+
+
+def summarize(samples: List[float]) -> dict:
+    """Latency summary in milliseconds of a list of durations in seconds."""
+    if not samples:
+        return {"n": 0}
+    ms = np.asarray(samples) * 1000.0
+    return {
+        "n": int(len(ms)),
+        "mean_ms": round(float(ms.mean()), 2),
+        "p50_ms": round(float(np.percentile(ms, 50)), 2),
+        "p95_ms": round(float(np.percentile(ms, 95)), 2),
+        "p99_ms": round(float(np.percentile(ms, 99)), 2),
+        "max_ms": round(float(ms.max()), 2),
+    }
+
+
+def peak_rss_mb(pid: Optional[int] = None) -> Optional[float]:
+    """Peak resident set size of this process, or of pid (Linux only) for an external server."""
+    if pid is None:
+        return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    try:
+        with open(f"/proc/{pid}/status", encoding="utf-8") as file:
+            for line in file:
+                if line.startswith("VmHWM:"):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def synthetic_heatmap(ui_np: np.ndarray, seed: int) -> np.ndarray:
+    """RGBA heatmap of a few random gaze clusters over the image."""
+    rng = np.random.default_rng(seed)
+    height, width = ui_np.shape[:2]
+    centers = rng.uniform((0, 0), (width, height), size=(6, 2))
+    points = centers[rng.integers(0, len(centers), 400)] + rng.normal(0, 25, (400, 2))
+    values = rng.uniform(0.2, 1.0, (400, 1))
+    return colorize_density(gaze_density(np.hstack([points, values]), (height, width)))
+
+
+def fixtures() -> List[dict]:
+    """UI images from static/ui_images with their PNG bytes and a synthetic heatmap each."""
+    items = []
+    for n, path in enumerate(sorted(UI_IMAGES_DIR.glob("*.png"))):
+        ui_np = load_ui_image(path.name)
+        heatmap_np = synthetic_heatmap(ui_np, n)
+        items.append({
+            "name": path.name,
+            "ui_np": ui_np,
+            "ui_png": path.read_bytes(),
+            "heatmap_np": heatmap_np,
+            "heatmap_png": encode_png(heatmap_np),
+        })
+    if not items:
+        raise SystemExit(f"No fixture images in {UI_IMAGES_DIR}")
+    return items
+
+
+def _time(fn, repeat: int) -> List[float]:
+    fn()  # warm-up: first-call allocations, lazy imports
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    return samples
+
+
+def _configure():
+    """Keep benchmark state (store, cache, artifacts, aggregates, warehouse) out of the app's own; lift the quota
+    so the limiter isn't measured."""
+    os.environ.setdefault("OPENAI_API_KEY", "stub")
+    os.environ.setdefault("OPENAI_RPM", "1000000")
+    os.environ.setdefault("OPENAI_TPM", "1000000000")
+    os.environ.setdefault("ANALYSIS_DB", str(BENCHMARK_DIR / "analysis.db"))
+    os.environ.setdefault("ANALYSIS_CACHE_DIR", str(BENCHMARK_DIR / "cache"))
+    os.environ.setdefault("ARTIFACTS_DIR", str(BENCHMARK_DIR / "artifacts"))
+    os.environ.setdefault("ARTIFACTS_DB", str(BENCHMARK_DIR / "artifacts" / "artifacts.db"))
+    os.environ.setdefault("AGGREGATE_DIR", str(BENCHMARK_DIR / "aggregates"))
+    os.environ.setdefault("WAREHOUSE_DB", str(BENCHMARK_DIR / "warehouse.db"))
+
+
+def run_micro(repeat: int) -> dict:
+    """Per-step timings of the image path, over every fixture."""
+    _configure()
+    import app
+
+    items = fixtures()
+    steps: Dict[str, List[float]] = {}
+
+    def record(step, fn):
+        steps.setdefault(step, []).extend(_time(fn, repeat))
+
+    for item in items:
+        ui_np, heatmap_np = item["ui_np"], item["heatmap_np"]
+        blended = blend_heatmap(ui_np, heatmap_np)
+        png = encode_png(blended)
+
+        record("decode", lambda: (decode_image(item["ui_png"]), decode_image(item["heatmap_png"])))
+        record("blend", lambda: blend_heatmap(ui_np, heatmap_np))
+        record("encode_png", lambda: encode_png(blended))
+        record("vision_prepare", lambda: prepare_vision_images(blended, heatmap_np[..., 3], source_png=png))
+        record("save_heatmap", lambda: app.save_heatmap(png))
+
+    report = "\n\n---\n\n".join(f"## Image {n}\n\n" + "- Recommendation\n" * 40 for n in range(1, 4))
+    record("save_markdown_report", lambda: app.save_markdown_report(report, ["heatmaps/benchmark.png"] * 3))
+
+    return {
+        "fixtures": [f"{item['name']} {item['ui_np'].shape[1]}x{item['ui_np'].shape[0]}" for item in items],
+        "steps": {step: summarize(samples) for step, samples in steps.items()},
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+_app = None
+
+
+def start_app(openai_latency: float, crew_delay: float, real_crew: bool):
+    """Import the app against a local OpenAI stub, with the crew kickoff stubbed unless real_crew."""
+    global _app
+    if _app is not None:
+        return _app
+
+    import stub_openai
+
+    port = _free_port()
+    stub_openai.serve(port, openai_latency)
+    # Must be set before llm_client is imported (app imports it on first use)
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{port}/v1"
+    _configure()
+
+    import app
+
+    if not real_crew:
+        import crew
+
+        # Same signatures as UIEvalCrew's, which study.synthesize calls positionally
+        def kickoff_reports(self, reports, on_chunk=None, first_image=1):
+            time.sleep(crew_delay)
+            report = "\n\n---\n\n".join(f"## Image {n}\n\nStub recommendations."
+                                           for n in range(first_image, first_image + len(reports)))
+            if on_chunk:
+                on_chunk("Report Generation Specialist", report)
+            return SimpleNamespace(raw=report)
+
+        def kickoff_summary(self, reports, on_chunk=None):
+            time.sleep(crew_delay)
+            summary = f"## Summary\n\nStub summary of {len(reports)} groups."
+            if on_chunk:
+                on_chunk("Report Generation Specialist", summary)
+            return SimpleNamespace(raw=summary)
+
+        crew.UIEvalCrew.kickoff_reports = kickoff_reports
+        crew.UIEvalCrew.kickoff_summary = kickoff_summary
+
+    _app = app
+    return app
+
+
+def _sessions(count: int, items: List[dict]) -> List[List[dict]]:
+    """count sessions of three uploads, each with its own heatmap so nothing is served from the cache."""
+    sessions = []
+    for s in range(count):
+        uploads = []
+        for n in range(3):
+            item = items[n % len(items)]
+            heatmap = synthetic_heatmap(item["ui_np"], 1000 + s * 3 + n)
+            uploads.append({"ui_png": item["ui_png"], "name": item["name"], "heatmap_png": encode_png(heatmap)})
+        sessions.append(uploads)
+    return sessions
+
+
+def _wait_for_job(get, job_id: str, timeout: float = 300.0) -> dict:
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        job = get(f"/jobs/{job_id}")
+        if job.get("status") in ("done", "failed"):
+            return job
+        time.sleep(POLL_INTERVAL)
+    return {"status": "timeout"}
+
+
+def run_e2e(sessions: int, concurrency: int, openai_latency: float, crew_delay: float, real_crew: bool) -> dict:
+    """Whole sessions (three uploads, then the report) through the Flask app in-process."""
+    app = start_app(openai_latency, crew_delay, real_crew)
+    work = _sessions(sessions, fixtures())
+    job_latency, session_latency = [], []
+    statuses: Dict[str, int] = {}
+    lock = threading.Lock()
+
+    def run_session(uploads):
+        client = app.app.test_client()
+        session_id = uuid.uuid4().hex
+        session_started = time.perf_counter()
+        submitted = []
+        for upload in uploads:
+            started = time.perf_counter()
+            response = client.post("/upload_heatmap", content_type="multipart/form-data", data={
+                "heatmap": (io.BytesIO(upload["heatmap_png"]), "heatmap.png"),
+                "ui_image": (io.BytesIO(upload["ui_png"]), upload["name"]),
+                "session_id": session_id,
+            })
+            if response.status_code != 202:
+                with lock:
+                    statuses[str(response.status_code)] = statuses.get(str(response.status_code), 0) + 1
+                continue
+            submitted.append((started, response.get_json()["job_id"]))
+
+        for started, job_id in submitted:
+            job = _wait_for_job(lambda path: client.get(path).get_json(), job_id)
+            with lock:
+                statuses[job["status"]] = statuses.get(job["status"], 0) + 1
+                job_latency.append(time.perf_counter() - started)
+        with lock:
+            session_latency.append(time.perf_counter() - session_started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(run_session, work))
+    elapsed = time.perf_counter() - started
+
+    return {
+        "sessions": sessions,
+        "concurrency": concurrency,
+        "openai_latency_s": openai_latency,
+        "crew": "real" if real_crew else f"stub ({crew_delay}s)",
+        "statuses": statuses,
+        "job_latency": summarize(job_latency),
+        "session_latency": summarize(session_latency),
+        "images_per_s": round(len(job_latency) / elapsed, 2),
+        "sessions_per_s": round(len(session_latency) / elapsed, 3),
+        "elapsed_s": round(elapsed, 2),
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def _serve_in_process(openai_latency: float, crew_delay: float, real_crew: bool) -> str:
+    """Run the app on a threaded local server, as `python app.py` would, and return its URL."""
+    from werkzeug.serving import WSGIRequestHandler, make_server
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    app = start_app(openai_latency, crew_delay, real_crew)
+    port = _free_port()
+    server = make_server("127.0.0.1", port, app.app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{port}"
+
+
+def run_load(url: Optional[str], requests: int, concurrency: int, wait: bool, pid: Optional[int],
+             openai_latency: float, crew_delay: float, real_crew: bool) -> dict:
+    """Concurrent multipart uploads against a running server (or an in-process one)."""
+    import httpx
+
+    target = url or _serve_in_process(openai_latency, crew_delay, real_crew)
+    items = fixtures()
+    # Pre-render the bodies so the generator measures the server, not itself
+    uploads = [upload for session in _sessions(-(-requests // 3), items) for upload in session][:requests]
+    session_ids = [uuid.uuid4().hex for _ in range(-(-requests // 3))]
+
+    upload_latency, job_latency = [], []
+    statuses: Dict[str, int] = {}
+    lock = threading.Lock()
+    client = httpx.Client(base_url=target, timeout=300.0,
+                          limits=httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency))
+
+    def send(index: int):
+        upload = uploads[index]
+        started = time.perf_counter()
+        try:
+            response = client.post("/upload_heatmap", files={
+                "heatmap": ("heatmap.png", upload["heatmap_png"], "image/png"),
+                "ui_image": (upload["name"], upload["ui_png"], "image/png"),
+            }, data={"session_id": session_ids[index // 3]})
+            status = str(response.status_code)
+        except httpx.HTTPError as e:
+            response, status = None, type(e).__name__
+        finished = time.perf_counter()
+        with lock:
+            statuses[status] = statuses.get(status, 0) + 1
+            upload_latency.append(finished - started)
+        if response is not None and response.status_code == 202:
+            return started, response.json()["job_id"]
+        return None
+
+    def finish(submitted):
+        started, job_id = submitted
+        job = _wait_for_job(lambda path: client.get(path).json(), job_id)
+        with lock:
+            statuses[f"job {job['status']}"] = statuses.get(f"job {job['status']}", 0) + 1
+            job_latency.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        submitted = [job for job in pool.map(send, range(len(uploads))) if job]
+    elapsed = time.perf_counter() - started
+    # Jobs are awaited after the upload phase so polling doesn't hold back uploads
+    if wait:
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(finish, submitted))
+    total = time.perf_counter() - started
+    client.close()
+
+    result = {
+        "target": url or "in-process",
+        "requests": len(uploads),
+        "concurrency": concurrency,
+        "statuses": statuses,
+        "upload_latency": summarize(upload_latency),
+        "requests_per_s": round(len(upload_latency) / elapsed, 2),
+        "elapsed_s": round(elapsed, 2),
+        "peak_rss_mb": peak_rss_mb(pid) if url else peak_rss_mb(),
+    }
+    if wait:
+        result["job_latency"] = summarize(job_latency)
+        result["jobs_per_s"] = round(len(job_latency) / total, 2)
+    return result
+
+
+def _flatten(results: dict, prefix: str = "") -> Dict[str, float]:
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}{key}"
+        if isinstance(value, dict):
+            flat.update(_flatten(value, name + "."))
+        elif isinstance(value, (int, float)) and not isinstance(value, bool) and key.endswith(COMPARED_SUFFIXES):
+            flat[name] = value
+    return flat
+
+
+def compare(results: dict, baseline: dict):
+    """Print every compared figure next to its baseline value."""
+    current, previous = _flatten(results), _flatten(baseline)
+    for name, value in current.items():
+        if name not in previous:
+            continue
+        before = previous[name]
+        change = f"{(value - before) / before * 100:+.1f}%" if before else "n/a"
+        print(f"{name:55} {before:>10} -> {value:>10}  {change}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the upload -> analysis -> report pipeline.")
+    parser.add_argument("suite", choices=["micro", "e2e", "load", "all"])
+    parser.add_argument("--repeat", type=int, default=20, help="Timed runs per micro step and fixture")
+    parser.add_argument("--sessions", type=int, default=8, help="e2e sessions of three uploads")
+    parser.add_argument("--requests", type=int, default=60, help="Uploads sent by the load generator")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--url", help="Load-test a running server instead of an in-process one")
+    parser.add_argument("--pid", type=int, help="Server process to read peak RSS from (with --url)")
+    parser.add_argument("--wait", action="store_true", help="Load test: also wait for every job to finish")
+    parser.add_argument("--openai-latency", type=float, default=0.2, help="Seconds the OpenAI stub takes per reply")
+    parser.add_argument("--crew-delay", type=float, default=0.5, help="Seconds the stubbed crew kickoff takes")
+    parser.add_argument("--real-crew", action="store_true", help="Run the actual crew against the OpenAI stub")
+    parser.add_argument("--save", type=Path, help="Write the results here as a baseline")
+    parser.add_argument("--compare", type=Path, help="Baseline to compare the results with")
+    args = parser.parse_args()
+
+    results = {"meta": {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+    }}
+    if args.suite in ("micro", "all"):
+        results["micro"] = run_micro(args.repeat)
+    if args.suite in ("e2e", "all"):
+        results["e2e"] = run_e2e(args.sessions, args.concurrency, args.openai_latency, args.crew_delay, args.real_crew)
+    if args.suite in ("load", "all"):
+        results["load"] = run_load(args.url, args.requests, args.concurrency, args.wait, args.pid,
+                                   args.openai_latency, args.crew_delay, args.real_crew)
+
+    print(json.dumps(results, indent=2))
+    if args.compare:
+        compare(results, json.loads(args.compare.read_text(encoding="utf-8")))
+    if args.save:
+        args.save.parent.mkdir(parents=True, exist_ok=True)
+        args.save.write_text(json.dumps(results, indent=2), encoding="utf-8")
+        print(f"Saved baseline to {args.save}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import closing
+from pathlib import Path
+from typing import Callable, List, Optional
+
+import cv2
+import numpy as np
+
+from db import connect, create
+
+ANALYSIS_CACHE_DIR = Path(os.getenv("ANALYSIS_CACHE_DIR", "output/cache"))
+# Entries kept in memory / on disk
+ANALYSIS_CACHE_SIZE = int(os.getenv("ANALYSIS_CACHE_SIZE", "256"))
+ANALYSIS_CACHE_DISK_SIZE = int(os.getenv("ANALYSIS_CACHE_DISK_SIZE", "5000"))
+# Seconds before a cached analysis is considered stale
+ANALYSIS_CACHE_TTL = int(os.getenv("ANALYSIS_CACHE_TTL", str(7 * 24 * 3600)))
+# Max Hamming distance between perceptual hashes to reuse an analysis, from memory or disk; 0 = exact matches only
+ANALYSIS_CACHE_PHASH_DISTANCE = int(os.getenv("ANALYSIS_CACHE_PHASH_DISTANCE", "0"))
+
+
+def schema_version(model) -> str:
+    """Short hash of a Pydantic model's JSON schema, so schema edits invalidate the cache."""
+    schema = json.dumps(model.model_json_schema(), sort_keys=True)
+    return hashlib.sha256(schema.encode("utf-8")).hexdigest()[:12]
+
+
+def perceptual_hash(image: np.ndarray) -> int:
+    """64-bit difference hash (dHash) of an RGB(A) image."""
+    gray = cv2.cvtColor(np.ascontiguousarray(image[..., :3]), cv2.COLOR_RGB2GRAY)
+    small = cv2.resize(gray, (9, 8), interpolation=cv2.INTER_AREA)
+    bits = (small[:, 1:] > small[:, :-1]).flatten()
+    return int(np.packbits(bits).view(">u8")[0])
+
+
+def image_digest(image: np.ndarray) -> str:
+    """SHA-256 of an image's shape and pixels."""
+    digest = hashlib.sha256()
+    digest.update(str(image.shape).encode("ascii"))
+    digest.update(np.ascontiguousarray(image).data)
+    return digest.hexdigest()
+
+
+class ImageMemo:
+    """In-memory LRU of fn(image) keyed by the image's pixels.
+
+    For local measurements of UI screenshots (contrast, AOIs): the same few
+    static images come back for every participant, so each is measured once.
+    """
+
+    def __init__(self, fn: Callable[[np.ndarray], object], max_entries: int = 64):
+        self.fn = fn
+        self.max_entries = max_entries
+        self._memory: "OrderedDict[str, object]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __call__(self, image: np.ndarray):
+        key = image_digest(image)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+
+        value = self.fn(image)
+        with self._lock:
+            self._memory[key] = value
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+        return value
+
+
+class AnalysisCache:
+    """Two-level (memory LRU + disk) cache for vision analyses.
+
+    Entries are keyed by the blended pixels plus a scope (prompt text and
+    schema version). With a non-zero phash_distance, an analysis of a
+    near-identical image under the same scope is reused as well; a SQLite
+    index of the disk entries' hashes finds those after a restart or once
+    they have left the memory LRU.
+    """
+
+    def __init__(self, directory: Path = ANALYSIS_CACHE_DIR, max_entries: int = ANALYSIS_CACHE_SIZE,
+                 max_disk_entries: int = ANALYSIS_CACHE_DISK_SIZE, ttl: int = ANALYSIS_CACHE_TTL,
+                 phash_distance: int = ANALYSIS_CACHE_PHASH_DISTANCE):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl
+        self.phash_distance = phash_distance
+        self.index_path = self.directory / "phash.db"
+        if phash_distance:
+            create(self.index_path, """
+                CREATE TABLE IF NOT EXISTS phashes (
+                    key TEXT PRIMARY KEY,
+                    scope TEXT NOT NULL,
+                    phash TEXT NOT NULL,
+                    created REAL NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_phashes_scope ON phashes (scope, created);
+            """)
+
+        self._memory: "OrderedDict[str, dict]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get_or_compute(self, image: np.ndarray, prompt: str, version: str, compute: Callable[[], str]):
+        """Return (analysis, cached) for the image, calling compute() on a miss."""
+        scope = hashlib.sha256(f"{version}\0{prompt}".encode("utf-8")).hexdigest()
+        key = hashlib.sha256(f"{scope}\0{image_digest(image)}".encode("ascii")).hexdigest()
+        phash = perceptual_hash(image) if self.phash_distance else None
+
+        value = self._get(key, scope, phash)
+        if value is not None:
+            with self._lock:
+                self.hits += 1
+            return value, True
+
+        with self._lock:
+            self.misses += 1
+        value = compute()
+        self._put({"key": key, "scope": scope, "phash": phash, "created": time.time(), "value": value})
+        return value, False
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 3) if total else 0.0,
+                "memory_entries": len(self._memory),
+            }
+
+    def _fresh(self, entry: dict) -> bool:
+        return time.time() - entry["created"] < self.ttl
+
+    def _get(self, key: str, scope: str, phash: Optional[int]) -> Optional[str]:
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry and self._fresh(entry):
+                self._memory.move_to_end(key)
+                return entry["value"]
+
+            if phash is not None:
+                for other in reversed(self._memory.values()):
+                    if (other["scope"] == scope and other["phash"] is not None and self._fresh(other)
+                            and bin(other["phash"] ^ phash).count("1") <= self.phash_distance):
+                        return other["value"]
+
+        entry = self._load(key)
+        if entry is None and phash is not None:
+            entry = self._load_similar(scope, phash)
+        if entry is None:
+            return None
+
+        self._remember(entry)
+        return entry["value"]
+
+    def _load(self, key: str) -> Optional[dict]:
+        path = self.directory / f"{key}.json"
+        try:
+            entry = json.loads(path.read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return None
+        if not self._fresh(entry):
+            path.unlink(missing_ok=True)
+            self._unindex([key])
+            return None
+        return entry
+
+    def _load_similar(self, scope: str, phash: int) -> Optional[dict]:
+        """The newest fresh disk entry under scope within phash_distance of phash."""
+        if not self.phash_distance:
+            return None
+        with closing(connect(self.index_path)) as conn:
+            rows = conn.execute(
+                "SELECT key, phash FROM phashes WHERE scope = ? AND created > ? ORDER BY created DESC",
+                (scope, time.time() - self.ttl),
+            ).fetchall()
+        for key, other in rows:
+            if bin(int(other, 16) ^ phash).count("1") > self.phash_distance:
+                continue
+            entry = self._load(key)
+            if entry is not None:
+                return entry
+            # Evicted or unreadable; drop it from the index
+            self._unindex([key])
+        return None
+
+    def _put(self, entry: dict):
+        self._remember(entry)
+
+        # Write atomically so other worker processes never read a partial file
+        path = self.directory / f"{entry['key']}.json"
+        tmp = path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        tmp.write_text(json.dumps(entry), encoding="utf-8")
+        os.replace(tmp, path)
+        if entry["phash"] is not None and self.phash_distance:
+            with closing(connect(self.index_path)) as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO phashes (key, scope, phash, created) VALUES (?, ?, ?, ?)",
+                    (entry["key"], entry["scope"], f"{entry['phash']:016x}", entry["created"]),
+                )
+        self._evict_disk()
+
+    def _remember(self, entry: dict):
+        with self._lock:
+            self._memory[entry["key"]] = entry
+            self._memory.move_to_end(entry["key"])
+            while len(self._memory) > self.max_entries:
+                self._memory.popitem(last=False)
+
+    def _evict_disk(self):
+        files = list(self.directory.glob("*.json"))
+        if len(files) <= self.max_disk_entries:
+            return
+        files.sort(key=_mtime)
+        evicted = files[:len(files) - self.max_disk_entries]
+        for old in evicted:
+            old.unlink(missing_ok=True)
+        self._unindex([old.stem for old in evicted])
+
+    def _unindex(self, keys: List[str]):
+        if not self.phash_distance or not keys:
+            return
+        with closing(connect(self.index_path)) as conn:
+            conn.executemany("DELETE FROM phashes WHERE key = ?", [(key,) for key in keys])
+
+
+def _mtime(path: Path) -> float:
+    try:
+        return path.stat().st_mtime
+    except OSError:
+        # Already removed by another worker
+        return 0.0
@@ -0,0 +1,152 @@
+import os
+from typing import List, Tuple
+
+import cv2
+import numpy as np
+
+from cache import ImageMemo
+
+# Measure text contrast locally and give the results to the vision model and the crew
+CONTRAST_ANALYSIS = os.getenv("CONTRAST_ANALYSIS", "1") == "1"
+
+# WCAG 2.1 minimum contrast ratios (1.4.3 AA, 1.4.6 AAA)
+AA_NORMAL, AA_LARGE = 4.5, 3.0
+AAA_NORMAL, AAA_LARGE = 7.0, 4.5
+# Text lines at least this tall (px, assuming 1 image px per CSS px) count as large
+# text: 18pt is 24px; 14pt bold (18.7px) can't be told apart from regular text here
+LARGE_TEXT_PX = 24
+
+# Candidate text line boxes outside these bounds are discarded
+MIN_TEXT_HEIGHT, MAX_TEXT_HEIGHT = 8, 80
+MIN_TEXT_WIDTH = 12
+MAX_TEXT_REGIONS = 300
+# Regions whose foreground and background barely differ are flat areas, not text
+MIN_LUMINANCE_GAP = 0.01
+# Findings listed individually in the prompt
+MAX_REPORTED_REGIONS = 8
+
+# sRGB channel value (0-255) -> linear-light value, per WCAG 2.1 relative luminance
+_LINEAR = np.array([c / 12.92 if c <= 0.04045 else ((c + 0.055) / 1.055) ** 2.4
+                    for c in np.arange(256) / 255.0], dtype=np.float64)
+_WEIGHTS = np.array([0.2126, 0.7152, 0.0722])
+
+Box = Tuple[int, int, int, int]
+
+
+def relative_luminance(rgb: np.ndarray) -> np.ndarray:
+    """WCAG relative luminance of uint8 RGB colors, shape (..., 3) -> (...)."""
+    return _LINEAR[rgb[..., :3]] @ _WEIGHTS
+
+
+def contrast_ratio(l1: np.ndarray, l2: np.ndarray) -> np.ndarray:
+    """WCAG contrast ratio (1-21) between two arrays of relative luminances."""
+    lighter, darker = np.maximum(l1, l2), np.minimum(l1, l2)
+    return (lighter + 0.05) / (darker + 0.05)
+
+
+def text_regions(rgb: np.ndarray) -> List[Box]:
+    """Bounding boxes (x, y, w, h) of likely text lines.
+
+    Character edges (morphological gradient, Otsu threshold) are smeared
+    horizontally so the letters of a line merge into one component.
+    """
+    gray = cv2.cvtColor(np.ascontiguousarray(rgb[..., :3]), cv2.COLOR_RGB2GRAY)
+    gradient = cv2.morphologyEx(gray, cv2.MORPH_GRADIENT, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)))
+    _, edges = cv2.threshold(gradient, 0, 255, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    lines = cv2.morphologyEx(edges, cv2.MORPH_CLOSE, cv2.getStructuringElement(cv2.MORPH_RECT, (9, 1)))
+
+    count, _, stats, _ = cv2.connectedComponentsWithStats(lines, connectivity=8)
+    stats = stats[1:count]
+    x, y, w, h, area = stats.T
+    keep = (
+        (h >= MIN_TEXT_HEIGHT) & (h <= MAX_TEXT_HEIGHT) & (w >= MIN_TEXT_WIDTH) & (w >= h)
+        # Text lines are partly filled; solid blocks and thin rules are not text
+        & (area > 0.2 * w * h) & (area < 0.95 * w * h)
+    )
+    stats = stats[keep]
+    stats = stats[np.argsort(stats[:, 4])[::-1][:MAX_TEXT_REGIONS]]
+    return [tuple(int(v) for v in row[:4]) for row in stats]
+
+
+def _region_colors(rgb: np.ndarray, gray: np.ndarray, box: Box) -> Tuple[np.ndarray, np.ndarray]:
+    """Median text (minority) and background (majority) colors of a box, split by Otsu."""
+    x, y, w, h = box
+    crop = rgb[y:y + h, x:x + w, :3].reshape(-1, 3)
+    values = gray[y:y + h, x:x + w]
+    threshold, mask = cv2.threshold(values, 0, 1, cv2.THRESH_BINARY | cv2.THRESH_OTSU)
+    mask = mask.reshape(-1).astype(bool)
+    if mask.sum() > mask.size / 2:
+        mask = ~mask
+    if not mask.any() or mask.all():
+        color = np.median(crop, axis=0)
+        return color, color
+    return np.median(crop[mask], axis=0), np.median(crop[~mask], axis=0)
+
+
+def analyze_contrast(rgb: np.ndarray) -> dict:
+    """Measured WCAG 2.1 text contrast of a UI screenshot.
+
+    Returns a summary and one finding per text region, worst first: box,
+    ratio, foreground/background colors, large_text, and pass flags for AA/AAA.
+    """
+    rgb = np.ascontiguousarray(rgb[..., :3])
+    gray = cv2.cvtColor(rgb, cv2.COLOR_RGB2GRAY)
+    boxes = text_regions(rgb)
+    if not boxes:
+        return {"regions": 0, "fails_aa": 0, "fails_aaa": 0, "min_ratio": None, "findings": []}
+
+    colors = np.array([_region_colors(rgb, gray, box) for box in boxes])  # (N, 2, 3)
+    colors = np.clip(np.rint(colors), 0, 255).astype(np.uint8)
+    luminance = relative_luminance(colors)  # (N, 2)
+    distinct = np.abs(luminance[:, 0] - luminance[:, 1]) >= MIN_LUMINANCE_GAP
+    boxes = [box for box, keep in zip(boxes, distinct) if keep]
+    colors, luminance = colors[distinct], luminance[distinct]
+
+    ratios = contrast_ratio(luminance[:, 0], luminance[:, 1])
+    heights = np.array([box[3] for box in boxes])
+    large = heights >= LARGE_TEXT_PX
+    passes_aa = ratios >= np.where(large, AA_LARGE, AA_NORMAL)
+    passes_aaa = ratios >= np.where(large, AAA_LARGE, AAA_NORMAL)
+
+    findings = []
+    for i in np.argsort(ratios):
+        findings.append({
+            "box": list(boxes[i]),
+            "ratio": round(float(ratios[i]), 2),
+            "foreground": "#%02x%02x%02x" % tuple(colors[i, 0]),
+            "background": "#%02x%02x%02x" % tuple(colors[i, 1]),
+            "large_text": bool(large[i]),
+            "aa": bool(passes_aa[i]),
+            "aaa": bool(passes_aaa[i]),
+        })
+    return {
+        "regions": len(findings),
+        "fails_aa": int((~passes_aa).sum()),
+        "fails_aaa": int((~passes_aaa).sum()),
+        "min_ratio": round(float(ratios.min()), 2) if len(ratios) else None,
+        "findings": findings,
+    }
+
+
+analyze_contrast_cached = ImageMemo(analyze_contrast)
+
+
+def format_contrast_findings(report: dict, limit: int = MAX_REPORTED_REGIONS) -> str:
+    """Compact text summary of analyze_contrast() output for an LLM prompt."""
+    if not report["regions"]:
+        return "Measured WCAG 2.1 text contrast: no text regions detected."
+
+    lines = [
+        f"Measured WCAG 2.1 text contrast ({report['regions']} text regions, lowest {report['min_ratio']}:1): "
+        f"{report['fails_aa']} fail AA, {report['fails_aaa']} fail AAA. "
+        "Use these measured ratios for contrast findings instead of estimating them.",
+        "box x,y,w,h | ratio | text on background | size | AA | AAA",
+    ]
+    for finding in report["findings"][:limit]:
+        x, y, w, h = finding["box"]
+        lines.append(
+            f"{x},{y},{w},{h} | {finding['ratio']}:1 | {finding['foreground']} on {finding['background']} | "
+            f"{'large' if finding['large_text'] else 'normal'} | {'pass' if finding['aa'] else 'fail'} | "
+            f"{'pass' if finding['aaa'] else 'fail'}"
+        )
+    return "\n".join(lines)
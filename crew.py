@@ -1,4 +1,4 @@
-from crewai import Agent, Crew, Process, Task
+from crewai import Agent, Crew, LLM, Process, Task
 from crewai.project import CrewBase, agent, crew, task
 from pydantic import Field, BaseModel
 from typing import Dict, List
@@ -6,6 +6,76 @@ import yaml
 import os
 from openai import OpenAI
 import base64
+import copy
+import threading
+import time
+from functools import lru_cache
+
+from llm_client import OPENAI_RPM, crew_llm_settings
+from metrics import OPENAI_REQUESTS, STAGE_SECONDS, note, record_tokens, span
+from prompts import PROMPT_MODE, estimate_tokens, response_model, schema_tokens
+
+try:
+    from crewai.events import LLMStreamChunkEvent, TaskCompletedEvent, TaskFailedEvent, TaskStartedEvent, crewai_event_bus
+except ImportError:  # older crewai without the event bus; reports arrive only when finished
+    LLMStreamChunkEvent = TaskCompletedEvent = TaskFailedEvent = TaskStartedEvent = crewai_event_bus = None
+
+# Agent ID -> (chunk callback, agent label) for crews currently running with kickoff_reports()
+_stream_routes = {}
+_stream_lock = threading.Lock()
+_event_handlers_registered = False
+# Task ID -> perf_counter() at TaskStartedEvent, for per-task stage timings
+_task_started = {}
+
+
+def _on_stream_chunk(source, event):
+    route = _stream_routes.get(str(event.agent_id))
+    if route and event.chunk:
+        callback, label = route
+        callback(label, event.chunk)
+
+
+@lru_cache(maxsize=None)
+def _parse_yaml(path: str, mtime: float) -> dict:
+    with open(path, encoding="utf-8") as file:
+        content = yaml.safe_load(file)
+    return content if isinstance(content, dict) else {}
+
+
+def load_yaml_cached(config_path) -> dict:
+    """crewai's load_yaml, parsing each config file once per modification.
+
+    CrewBase rewrites the returned dicts (agent names become Agent objects),
+    so every caller gets its own copy.
+    """
+    return copy.deepcopy(_parse_yaml(str(config_path), os.path.getmtime(config_path)))
+
+
+@lru_cache(maxsize=1)
+def shared_llm() -> LLM:
+    """One crewai LLM for every agent; building one costs two OpenAI clients and their SSL contexts."""
+    return LLM(**crew_llm_settings())
+
+
+def _on_task_started(source, event):
+    _task_started[str(event.task_id)] = time.perf_counter()
+
+
+def _on_task_finished(source, event):
+    started = _task_started.pop(str(event.task_id), None)
+    if started is not None:
+        STAGE_SECONDS.observe(time.perf_counter() - started, stage=f"crew_task:{event.task_name}")
+
+
+def _register_event_handlers():
+    global _event_handlers_registered
+    with _stream_lock:
+        if crewai_event_bus and not _event_handlers_registered:
+            crewai_event_bus.on(LLMStreamChunkEvent)(_on_stream_chunk)
+            crewai_event_bus.on(TaskStartedEvent)(_on_task_started)
+            crewai_event_bus.on(TaskCompletedEvent)(_on_task_finished)
+            crewai_event_bus.on(TaskFailedEvent)(_on_task_finished)
+            _event_handlers_registered = True
 
 from pydantic import BaseModel, Field
 from typing import List
@@ -143,8 +213,11 @@ class ImageRecommendations(BaseModel):
 
 @CrewBase
 class UIEvalCrew():
-    agents_config_path = 'config/agents.yaml'
-    tasks_config_path = 'config/tasks.yaml'
+    agents_config_path = 'config/agents_compact.yaml' if PROMPT_MODE == 'compact' else 'config/agents.yaml'
+    tasks_config_path = 'config/tasks_compact.yaml' if PROMPT_MODE == 'compact' else 'config/tasks.yaml'
+    # Read by CrewBase
+    agents_config = agents_config_path
+    tasks_config = tasks_config_path
 
     os.environ["OPENAI_MODEL_NAME"] = "gpt-4o"
 
@@ -169,13 +242,23 @@ class UIEvalCrew():
         return Agent(
             config=self.agents_config['ui_recommender'],
             tools=[],
+            llm=shared_llm(),
+        )
+
+    def image_recommender(self) -> Agent:
+        """A separate ui_recommender per image, so the per-image tasks don't share an executor."""
+        return Agent(
+            config=self.agents_config['ui_recommender'],
+            tools=[],
+            llm=shared_llm(),
         )
 
     @agent
     def report_compiler(self) -> Agent:
         return Agent(
             config=self.agents_config['report_compiler'],
-            tools=[]
+            tools=[],
+            llm=shared_llm(),
         )
 
 
@@ -186,12 +269,18 @@ class UIEvalCrew():
     #         tools=[]
     #     )
 
-    @task
-    def generate_ui_recommendations(self) -> Task:
+    def generate_ui_recommendations(self, image_number: int) -> Task:
+        """Recommendations for one image, reading its analysis from the analysis_result_<n> input."""
+        config = dict(self.tasks_config['generate_ui_recommendations'])
+        config['description'] = config['description'].replace('{image_number}', str(image_number)) \
+            .replace('{image_analysis}', f'{{analysis_result_{image_number}}}')
+        config['expected_output'] = config['expected_output'].replace('{image_number}', str(image_number))
         return Task(
-            config=self.tasks_config['generate_ui_recommendations'],
+            config=config,
+            name='generate_ui_recommendations',
+            agent=self.image_recommender(),
             tools=[],
-            output_pydantic = ImageRecommendations
+            output_pydantic = response_model(ImageRecommendations)
         )
 
     @task
@@ -204,10 +293,104 @@ class UIEvalCrew():
 
 
     @crew
-    def crew(self) -> Crew:
+    def crew(self, image_count: int = 3, first_image: int = 1) -> Crew:
+        # One async recommendation task per image; they run concurrently and
+        # the (synchronous) compile_report waits for all of them
+        recommendations = [self.generate_ui_recommendations(n) for n in range(first_image, first_image + image_count)]
+        report = self.compile_report()
+        report.context = recommendations
         return Crew(
-            agents=self.agents, # Automatically created by the @agent decorator
-            tasks=self.tasks, # Automatically created by the @task decorator
+            agents=[t.agent for t in recommendations] + [report.agent],
+            tasks=recommendations + [report],
             process=Process.sequential,
             verbose=True,
+            max_rpm=OPENAI_RPM,
+        )
+
+    def summary_crew(self) -> Crew:
+        """A one-task crew merging several group reports into a study summary."""
+        summary = Task(
+            config=self.tasks_config['summarize_reports'],
+            name='summarize_reports',
+            tools=[]
         )
+        return Crew(
+            agents=[summary.agent],
+            tasks=[summary],
+            process=Process.sequential,
+            verbose=True,
+            max_rpm=OPENAI_RPM,
+        )
+
+    @staticmethod
+    def report_inputs(reports: List[str], first_image: int = 1) -> dict:
+        """Crew inputs for a list of per-image analyses: analysis_result plus analysis_result_<n> per image."""
+        inputs = {"analysis_result": reports}
+        inputs.update({f"analysis_result_{n}": report for n, report in enumerate(reports, first_image)})
+        return inputs
+
+    def prompt_tokens(self, reports: List[str]) -> dict:
+        """Estimated fixed (agent and task text, schema) vs variable (analyses) prompt tokens of the per-image tasks."""
+        task = self.tasks_config['generate_ui_recommendations']
+        agent = self.agents_config['ui_recommender']
+        per_task = estimate_tokens(" ".join(
+            str(text) for text in (agent['role'], agent['goal'], agent['backstory'], task['description'], task['expected_output'])
+        )) + schema_tokens(response_model(ImageRecommendations))
+        return {"fixed_tokens": per_task * len(reports), "variable_tokens": sum(estimate_tokens(r) for r in reports)}
+
+    def kickoff_reports(self, reports: List[str], on_chunk=None, first_image: int = 1):
+        """Run the crew over the analyses, one image per recommendation task.
+
+        on_chunk(agent, text) is called for every streamed LLM token chunk; the
+        per-image agents are labelled with their image number, counted from
+        first_image.
+        """
+        _register_event_handlers()
+        with span("crew_build"):
+            crew = self.crew(len(reports), first_image)
+        tokens = self.prompt_tokens(reports)
+        note(crew_fixed_tokens=tokens["fixed_tokens"], crew_variable_tokens=tokens["variable_tokens"])
+
+        routes = {}
+        if on_chunk is not None:
+            routes = {str(t.agent.id): (on_chunk, f"{t.agent.role} (image {n})")
+                      for n, t in enumerate(crew.tasks[:-1], first_image)}
+            routes[str(crew.tasks[-1].agent.id)] = (on_chunk, crew.tasks[-1].agent.role)
+        return self._kickoff(crew, self.report_inputs(reports, first_image), routes)
+
+    def kickoff_summary(self, reports: List[str], on_chunk=None):
+        """Merge group reports into one study summary; on_chunk as in kickoff_reports."""
+        _register_event_handlers()
+        with span("crew_build"):
+            crew = self.summary_crew()
+        routes = {}
+        if on_chunk is not None:
+            agent = crew.tasks[0].agent
+            routes[str(agent.id)] = (on_chunk, f"{agent.role} (summary)")
+        return self._kickoff(crew, {"reports": "\n\n---\n\n".join(reports)}, routes)
+
+    def _kickoff(self, crew: Crew, inputs: dict, routes: dict):
+        with _stream_lock:
+            _stream_routes.update(routes)
+        try:
+            with span("crew_kickoff"):
+                result = crew.kickoff(inputs=inputs)
+        finally:
+            with _stream_lock:
+                for agent_id in routes:
+                    _stream_routes.pop(agent_id, None)
+
+        usage = getattr(result, "token_usage", None)
+        if usage:
+            record_tokens("crew", usage.prompt_tokens, usage.completion_tokens, usage.cached_prompt_tokens or 0)
+            OPENAI_REQUESTS.inc(usage.successful_requests, source="crew", outcome="ok")
+        return result
+
+
+# Parse the YAML configs once per change instead of on every UIEvalCrew()
+UIEvalCrew.load_yaml = staticmethod(load_yaml_cached)
+
+
+def prewarm():
+    """Build and discard one crew, so the shared LLM, parsed configs and crewai's lazy imports are ready."""
+    UIEvalCrew().crew()
@@ -0,0 +1,41 @@
+import sqlite3
+from contextlib import closing, contextmanager
+from pathlib import Path
+from typing import Iterator
+
+
+def connect(path: Path) -> sqlite3.Connection:
+    """An autocommit connection to path.
+
+    Callers open one short-lived connection per call, which keeps the SQLite
+    stores thread- and fork-safe; the timeout waits out other workers' writes.
+    """
+    return sqlite3.connect(path, timeout=30, isolation_level=None)
+
+
+def create(path: Path, schema: str):
+    """Create the database at path (and its directory) in WAL mode and run its schema script."""
+    path.parent.mkdir(parents=True, exist_ok=True)
+    with closing(connect(path)) as conn:
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executescript(schema)
+
+
+@contextmanager
+def transaction(path: Path) -> Iterator[sqlite3.Connection]:
+    """A connection inside a write transaction, committed on exit and rolled back on error.
+
+    BEGIN IMMEDIATE takes the write lock up front, so concurrent workers
+    can't interleave a read-check-write sequence.
+    """
+    conn = connect(path)
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+    finally:
+        conn.close()
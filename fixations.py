@@ -0,0 +1,247 @@
+from typing import Dict, Tuple
+
+import numpy as np
+
+# I-VT: samples slower than this (pixels per second) belong to a fixation
+VELOCITY_THRESHOLD = 1000.0
+# I-DT: maximum (x range + y range) in pixels for a window to count as a fixation
+DISPERSION_THRESHOLD = 50.0
+# Fixations shorter than this (milliseconds) are discarded
+MIN_FIXATION_MS = 100.0
+
+# Axis-aligned areas of interest: name -> (x, y, width, height)
+AOIs = Dict[str, Tuple[float, float, float, float]]
+
+
+def _runs(mask: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Start and end (exclusive) indices of each run of True values in mask."""
+    edges = np.diff(np.concatenate(([False], mask, [False])).astype(np.int8))
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def _fixations_from_runs(x, y, t, starts, ends, min_duration) -> np.ndarray:
+    """Collapse sample runs into (x, y, start, end, duration) fixation rows."""
+    if len(starts) == 0:
+        return np.empty((0, 5), dtype=np.float64)
+
+    # Prefix sums give each run's sum over [start, end) without the samples between runs
+    counts = ends - starts
+    sum_x = np.concatenate(([0.0], np.cumsum(x)))
+    sum_y = np.concatenate(([0.0], np.cumsum(y)))
+    cx = (sum_x[ends] - sum_x[starts]) / counts
+    cy = (sum_y[ends] - sum_y[starts]) / counts
+    start_t = t[starts]
+    end_t = t[ends - 1]
+    fixations = np.column_stack([cx, cy, start_t, end_t, end_t - start_t])
+    return fixations[fixations[:, 4] >= min_duration]
+
+
+def detect_fixations_ivt(samples: np.ndarray, velocity_threshold: float = VELOCITY_THRESHOLD,
+                         min_duration: float = MIN_FIXATION_MS) -> np.ndarray:
+    """Velocity-threshold (I-VT) fixation detection.
+
+    samples is an (N, 3) array of x, y, t with t in milliseconds. Returns an
+    (F, 5) array of fixation centroid x, y, start, end and duration.
+    """
+    samples = _sorted_samples(samples)
+    x, y, t = samples[:, 0], samples[:, 1], samples[:, 2]
+    if len(samples) < 2:
+        return np.empty((0, 5), dtype=np.float64)
+
+    dt = np.diff(t)
+    dist = np.hypot(np.diff(x), np.diff(y))
+    velocity = np.divide(dist, dt, out=np.full_like(dist, np.inf), where=dt > 0) * 1000.0
+
+    # A sample is a fixation sample if the step into it is slow; the first
+    # sample takes the label of the second
+    slow = velocity < velocity_threshold
+    slow = np.concatenate((slow[:1], slow))
+
+    starts, ends = _runs(slow)
+    return _fixations_from_runs(x, y, t, starts, ends, min_duration)
+
+
+def _range_extremes(values: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Min and max of values over each inclusive window [starts[k], ends[k]].
+
+    Doubling tables: level L holds the extremes of every 2**L-sample span, and
+    each window is the union of two (overlapping) spans of the largest level
+    that fits. Only one level is kept at a time.
+    """
+    lengths = ends - starts + 1
+    levels = np.floor(np.log2(lengths)).astype(np.intp)
+    lo, hi = np.empty(len(starts)), np.empty(len(starts))
+    level_lo = level_hi = values
+    for level in range(int(levels.max()) + 1 if len(starts) else 0):
+        span = 1 << level
+        if level:
+            half = span >> 1
+            level_lo = np.minimum(level_lo[:-half], level_lo[half:])
+            level_hi = np.maximum(level_hi[:-half], level_hi[half:])
+        at = np.flatnonzero(levels == level)
+        left, right = starts[at], ends[at] - span + 1
+        lo[at] = np.minimum(level_lo[left], level_lo[right])
+        hi[at] = np.maximum(level_hi[left], level_hi[right])
+    return lo, hi
+
+
+def _grow_window(x, y, start, end, dispersion_threshold) -> int:
+    """First index past end at which the window from start exceeds the dispersion threshold (or len(x)).
+
+    Scans ahead in doubling chunks with running extremes, so a long fixation
+    costs a few numpy calls rather than one Python step per sample.
+    """
+    min_x, max_x = x[start:end + 1].min(), x[start:end + 1].max()
+    min_y, max_y = y[start:end + 1].min(), y[start:end + 1].max()
+    position, chunk = end + 1, 64
+    while position < len(x):
+        cx, cy = x[position:position + chunk], y[position:position + chunk]
+        chunk_min_x = np.minimum.accumulate(np.minimum(cx, min_x))
+        chunk_max_x = np.maximum.accumulate(np.maximum(cx, max_x))
+        chunk_min_y = np.minimum.accumulate(np.minimum(cy, min_y))
+        chunk_max_y = np.maximum.accumulate(np.maximum(cy, max_y))
+        over = np.flatnonzero((chunk_max_x - chunk_min_x) + (chunk_max_y - chunk_min_y) > dispersion_threshold)
+        if len(over):
+            return position + int(over[0])
+        min_x, max_x, min_y, max_y = chunk_min_x[-1], chunk_max_x[-1], chunk_min_y[-1], chunk_max_y[-1]
+        position += len(cx)
+        chunk *= 2
+    return len(x)
+
+
+def detect_fixations_idt(samples: np.ndarray, dispersion_threshold: float = DISPERSION_THRESHOLD,
+                         min_duration: float = MIN_FIXATION_MS) -> np.ndarray:
+    """Dispersion-threshold (I-DT) fixation detection, same input and output as I-VT."""
+    samples = _sorted_samples(samples)
+    x, y, t = samples[:, 0], samples[:, 1], samples[:, 2]
+    n = len(samples)
+
+    # For every sample, the first index at which its window spans min_duration
+    # (never before the sample itself, which repeated timestamps could allow)
+    window_end = np.maximum(np.searchsorted(t, t + min_duration, side="left"), np.arange(n))
+
+    # Samples whose initial window fits under the threshold, all checked at once;
+    # a fixation can only start at one of these
+    complete = np.flatnonzero(window_end < n)
+    min_x, max_x = _range_extremes(x, complete, window_end[complete])
+    min_y, max_y = _range_extremes(y, complete, window_end[complete])
+    candidates = complete[(max_x - min_x) + (max_y - min_y) <= dispersion_threshold]
+
+    # Each fixation starts at the first candidate after the previous one ends
+    starts, ends = [], []
+    i = 0
+    while True:
+        next_candidate = np.searchsorted(candidates, i)
+        if next_candidate == len(candidates):
+            break
+        i = candidates[next_candidate]
+        end = _grow_window(x, y, i, window_end[i], dispersion_threshold)
+        starts.append(i)
+        ends.append(end)
+        i = end
+
+    return _fixations_from_runs(x, y, t, np.array(starts, dtype=np.intp), np.array(ends, dtype=np.intp), min_duration)
+
+
+def detect_saccades(fixations: np.ndarray) -> np.ndarray:
+    """Saccades between consecutive fixations as (amplitude px, duration ms) rows."""
+    if len(fixations) < 2:
+        return np.empty((0, 2), dtype=np.float64)
+
+    amplitude = np.hypot(np.diff(fixations[:, 0]), np.diff(fixations[:, 1]))
+    duration = fixations[1:, 2] - fixations[:-1, 3]
+    return np.column_stack([amplitude, duration])
+
+
+def grid_aois(width: float, height: float) -> AOIs:
+    """Split the screen into a named 3x3 grid ('top-left' ... 'bottom-right')."""
+    rows = ["top", "middle", "bottom"]
+    cols = ["left", "center", "right"]
+    w, h = width / 3, height / 3
+    aois = {}
+    for r, row in enumerate(rows):
+        for c, col in enumerate(cols):
+            name = "center" if (row, col) == ("middle", "center") else f"{row}-{col}"
+            aois[name] = (c * w, r * h, w, h)
+    return aois
+
+
+def aoi_metrics(fixations: np.ndarray, aois: AOIs, session_start: float = None) -> Dict[str, dict]:
+    """Per-AOI dwell time, time to first fixation and revisit count.
+
+    Times are in milliseconds; time_to_first_fixation is measured from
+    session_start (default: the first fixation's start) and is None if the
+    AOI was never fixated.
+    """
+    names = list(aois)
+    if not names:
+        return {}
+    if not len(fixations):
+        return {name: {"dwell_ms": 0.0, "fixations": 0, "time_to_first_fixation_ms": None, "revisits": 0}
+                for name in names}
+
+    boxes = np.array([aois[name] for name in names], dtype=np.float64)
+    fx, fy = fixations[:, 0:1], fixations[:, 1:2]
+    # (F, A) membership matrix
+    inside = (
+        (fx >= boxes[:, 0]) & (fx < boxes[:, 0] + boxes[:, 2]) &
+        (fy >= boxes[:, 1]) & (fy < boxes[:, 1] + boxes[:, 3])
+    )
+
+    if session_start is None:
+        session_start = fixations[0, 2]
+
+    dwell = (inside * fixations[:, 4:5]).sum(axis=0)
+    fixation_count = inside.sum(axis=0)
+    first = np.where(inside.any(axis=0), inside.argmax(axis=0), -1)
+    # A visit starts at every fixation inside the AOI whose predecessor was not
+    visits = (inside & ~np.vstack([np.zeros((1, len(names)), dtype=bool), inside[:-1]])).sum(axis=0)
+
+    metrics = {}
+    for a, name in enumerate(names):
+        metrics[name] = {
+            "dwell_ms": round(float(dwell[a]), 1),
+            "fixations": int(fixation_count[a]),
+            "time_to_first_fixation_ms": round(float(fixations[first[a], 2] - session_start), 1) if first[a] >= 0 else None,
+            "revisits": int(max(visits[a] - 1, 0)),
+        }
+    return metrics
+
+
+def gaze_metrics(samples: np.ndarray, aois: AOIs, method: str = "ivt") -> dict:
+    """Fixations, saccades and per-AOI metrics for one participant's gaze samples."""
+    detect = detect_fixations_idt if method == "idt" else detect_fixations_ivt
+    samples = _sorted_samples(samples)
+    fixations = detect(samples)
+    saccades = detect_saccades(fixations)
+    session_start = float(samples[0, 2]) if len(samples) else 0.0
+
+    return {
+        "method": method,
+        "samples": int(len(samples)),
+        "fixation_count": int(len(fixations)),
+        "mean_fixation_ms": round(float(fixations[:, 4].mean()), 1) if len(fixations) else 0.0,
+        "saccade_count": int(len(saccades)),
+        "mean_saccade_amplitude_px": round(float(saccades[:, 0].mean()), 1) if len(saccades) else 0.0,
+        "aois": aoi_metrics(fixations, aois, session_start),
+    }
+
+
+def format_gaze_metrics(metrics: dict) -> str:
+    """Compact text summary of gaze_metrics() output for an LLM prompt."""
+    lines = [
+        f"Measured eye-tracking metrics ({metrics['method'].upper()}, {metrics['samples']} samples): "
+        f"{metrics['fixation_count']} fixations (mean {metrics['mean_fixation_ms']} ms), "
+        f"{metrics['saccade_count']} saccades (mean amplitude {metrics['mean_saccade_amplitude_px']} px).",
+        "AOI | dwell ms | fixations | time to first fixation ms | revisits",
+    ]
+    ranked = sorted(metrics["aois"].items(), key=lambda item: item[1]["dwell_ms"], reverse=True)
+    for name, aoi in ranked:
+        ttff = "never" if aoi["time_to_first_fixation_ms"] is None else aoi["time_to_first_fixation_ms"]
+        lines.append(f"{name} | {aoi['dwell_ms']} | {aoi['fixations']} | {ttff} | {aoi['revisits']}")
+    return "\n".join(lines)
+
+
+def _sorted_samples(samples: np.ndarray) -> np.ndarray:
+    samples = np.asarray(samples, dtype=np.float64).reshape(-1, 3)
+    return samples[np.argsort(samples[:, 2], kind="stable")]
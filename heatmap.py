@@ -0,0 +1,137 @@
+from functools import lru_cache
+from pathlib import Path
+from typing import Tuple
+
+import cv2
+import numpy as np
+
+UI_IMAGES_DIR = Path("static/ui_images")
+
+# Defaults matching the heatmap.js instance in static/script.js
+HEATMAP_RADIUS = 30
+MAX_OPACITY = 0.6
+MIN_OPACITY = 0.1
+
+
+def ui_image_path(image_id: str) -> Path:
+    """Resolve a UI image ID (e.g. 'image1.png') to a file in static/ui_images."""
+    path = UI_IMAGES_DIR / Path(image_id).name
+    if not path.is_file():
+        raise FileNotFoundError(f"Unknown UI image: {image_id}")
+    return path
+
+
+# Rows composited per pass in blend_heatmap; bounds the uint16 scratch buffers
+BLEND_STRIP_ROWS = 256
+
+
+def to_rgba(image: np.ndarray) -> np.ndarray:
+    """Convert an OpenCV-decoded (gray, BGR or BGRA) uint8 image to RGBA."""
+    if image.dtype != np.uint8:
+        image = cv2.convertScaleAbs(image, alpha=255.0 / np.iinfo(image.dtype).max)
+    if image.ndim == 2:
+        return cv2.cvtColor(image, cv2.COLOR_GRAY2RGBA)
+    if image.shape[2] == 3:
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGBA)
+    return cv2.cvtColor(image, cv2.COLOR_BGRA2RGBA)
+
+
+def decode_image(buffer) -> np.ndarray:
+    """Decode encoded image bytes (any buffer) straight to an RGBA array, without PIL."""
+    image = cv2.imdecode(np.frombuffer(buffer, dtype=np.uint8), cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise ValueError("Could not decode image")
+    return to_rgba(image)
+
+
+def encode_png(rgba: np.ndarray) -> bytes:
+    """PNG-encode an RGBA array once; the bytes are reused for disk and the vision call."""
+    ok, buffer = cv2.imencode(".png", cv2.cvtColor(rgba, cv2.COLOR_RGBA2BGRA))
+    if not ok:
+        raise ValueError("Could not encode image")
+    return buffer.tobytes()
+
+
+@lru_cache(maxsize=16)
+def load_ui_image(image_id: str) -> np.ndarray:
+    """Decode a static UI image once as a read-only RGBA array."""
+    image = cv2.imread(str(ui_image_path(image_id)), cv2.IMREAD_UNCHANGED)
+    if image is None:
+        raise ValueError(f"Could not decode UI image: {image_id}")
+    rgba = to_rgba(image)
+    rgba.setflags(write=False)
+    return rgba
+
+
+def gaze_density(points: np.ndarray, shape: Tuple[int, int], display_size: Tuple[float, float] = None,
+                 radius: float = HEATMAP_RADIUS) -> np.ndarray:
+    """Splat weighted gaze points into a float32 density map of the given (height, width).
+
+    points is an (N, 3) array of x, y, value in display coordinates; display_size
+    is the (width, height) the image was shown at, used to scale points and the
+    radius to the image's native resolution.
+    """
+    height, width = shape
+    density = np.zeros((height, width), dtype=np.float32)
+    if len(points) == 0:
+        return density
+
+    points = np.asarray(points, dtype=np.float32)
+    sx = sy = 1.0
+    if display_size:
+        sx = width / display_size[0]
+        sy = height / display_size[1]
+
+    xs = np.clip((points[:, 0] * sx).astype(np.intp), 0, width - 1)
+    ys = np.clip((points[:, 1] * sy).astype(np.intp), 0, height - 1)
+    np.add.at(density, (ys, xs), points[:, 2])
+
+    # One Gaussian blur replaces a per-point kernel splat
+    sigma = max(radius * (sx + sy) / 2, 1.0) / 2
+    return cv2.GaussianBlur(density, (0, 0), sigmaX=sigma, sigmaY=sigma)
+
+
+def colorize_density(density: np.ndarray, max_opacity: float = MAX_OPACITY,
+                     min_opacity: float = MIN_OPACITY) -> np.ndarray:
+    """Turn a density map into an RGBA heatmap overlay similar to heatmap.js output."""
+    peak = float(density.max())
+    if peak <= 0:
+        return np.zeros(density.shape + (4,), dtype=np.uint8)
+
+    norm = density / peak
+    levels = (norm * 255).astype(np.uint8)
+    rgb = cv2.cvtColor(cv2.applyColorMap(levels, cv2.COLORMAP_JET), cv2.COLOR_BGR2RGB)
+
+    alpha = min_opacity + norm * (max_opacity - min_opacity)
+    alpha[levels == 0] = 0
+    return np.dstack([rgb, (alpha * 255).astype(np.uint8)])
+
+
+def blend_heatmap(ui_np: np.ndarray, heatmap_np: np.ndarray, out: np.ndarray = None) -> np.ndarray:
+    """Alpha-composite an RGBA heatmap over an RGBA UI image, resizing the heatmap if needed.
+
+    Works in uint8/uint16 integer arithmetic over strips of rows, so the only
+    full-size allocation is the uint8 output. Pass out (shaped like ui_np) to
+    reuse a buffer instead; it may alias ui_np or heatmap_np, since each strip
+    is read before it is written, and that array is then overwritten with the
+    blend. Without out, neither input is modified.
+    """
+    if ui_np.shape[:2] != heatmap_np.shape[:2]:
+        heatmap_np = cv2.resize(heatmap_np, (ui_np.shape[1], ui_np.shape[0]))
+    if out is None:
+        out = np.empty_like(ui_np)
+
+    for top in range(0, ui_np.shape[0], BLEND_STRIP_ROWS):
+        rows = slice(top, top + BLEND_STRIP_ROWS)
+        ui = ui_np[rows].astype(np.uint16)
+        heat = heatmap_np[rows].astype(np.uint16)
+        alpha = heat[..., 3:4].copy()
+
+        # (ui * (255 - a) + heat * a) / 255, rounded; peaks at 65152, within uint16
+        ui *= 255 - alpha
+        heat *= alpha
+        ui += heat
+        ui += 127
+        ui //= 255
+        out[rows] = ui
+    return out
@@ -0,0 +1,103 @@
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional
+
+from metrics import JOB_SECONDS, JOBS, trace
+from store import AnalysisStore
+
+# Number of analyses (vision call + crew run) allowed to run at once
+ANALYSIS_WORKERS = int(os.getenv("ANALYSIS_WORKERS", "4"))
+# Jobs waiting or running before new uploads are rejected
+ANALYSIS_MAX_PENDING = int(os.getenv("ANALYSIS_MAX_PENDING", "32"))
+# Seconds a finished job is kept around for its result to be fetched
+JOB_TTL = int(os.getenv("JOB_TTL", "3600"))
+
+
+class QueueFullError(Exception):
+    """Raised when too many analysis jobs are already pending."""
+
+
+class JobQueue:
+    """Runs analysis jobs on a bounded worker pool and tracks their status.
+
+    Job records live in the shared AnalysisStore, so any worker process can
+    answer a status request for a job another process is running.
+    """
+
+    def __init__(self, store: AnalysisStore, max_workers: int = ANALYSIS_WORKERS, max_pending: int = ANALYSIS_MAX_PENDING):
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="analysis")
+        self._store = store
+        self._max_pending = max_pending
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def submit(self, fn: Callable, *args, **kwargs) -> str:
+        """Queue fn(*args, progress=..., **kwargs) and return the new job ID."""
+        with self._lock:
+            if self._pending >= self._max_pending:
+                raise QueueFullError("Too many analyses in progress, try again shortly")
+            self._pending += 1
+
+        # Release the slot if the job can't be recorded or queued (e.g. the store is locked)
+        try:
+            job_id = uuid.uuid4().hex
+            now = time.time()
+            self._store.delete_jobs_before(now - JOB_TTL)
+            self._store.save_job({
+                "id": job_id,
+                "status": "queued",
+                "stage": "queued",
+                "created": now,
+                "updated": now,
+                "result": None,
+                "error": None,
+            })
+
+            self._executor.submit(self._run, job_id, fn, args, kwargs)
+        except BaseException:
+            with self._lock:
+                self._pending -= 1
+            raise
+        return job_id
+
+    def get(self, job_id: str) -> Optional[dict]:
+        """Return a snapshot of the job, or None if it is unknown or expired."""
+        return self._store.load_job(job_id)
+
+    def pending(self) -> int:
+        """Jobs queued or running in this process."""
+        with self._lock:
+            return self._pending
+
+    def _update(self, job_id: str, **fields):
+        job = self._store.load_job(job_id)
+        if job:
+            job.update(fields, updated=time.time())
+            self._store.save_job(job)
+
+    def _run(self, job_id: str, fn: Callable, args: tuple, kwargs: dict):
+        def progress(stage: str):
+            self._update(job_id, stage=stage)
+
+        with trace("job", job_id=job_id) as record:
+            try:
+                self._update(job_id, status="running", stage="started")
+                result = fn(*args, progress=progress, **kwargs)
+                self._update(job_id, status="done", stage="done", result=result)
+                record["status"] = "done"
+            except Exception as e:
+                error = str(e) or type(e).__name__
+                print("Error processing job", job_id, error)
+                record.update(status="failed", error=error)
+                try:
+                    self._update(job_id, status="failed", stage="failed", error=error)
+                except Exception as store_error:
+                    print("Error recording failure of job", job_id, str(store_error))
+            finally:
+                with self._lock:
+                    self._pending -= 1
+        JOBS.inc(status=record["status"])
+        JOB_SECONDS.observe(record["duration_ms"] / 1000)
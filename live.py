@@ -0,0 +1,197 @@
+import math
+import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+from heatmap import HEATMAP_RADIUS
+
+# Samples kept per live session; older ones are overwritten (the same bound as a gaze upload)
+LIVE_BUFFER_POINTS = int(os.getenv("LIVE_BUFFER_POINTS", "200000"))
+# Side (UI image px) of a cell of the server-side live heatmap
+LIVE_CELL_PX = int(os.getenv("LIVE_CELL_PX", "8"))
+# Sessions without samples for this long are dropped
+LIVE_IDLE_SECONDS = float(os.getenv("LIVE_IDLE_SECONDS", "1800"))
+# Largest accepted binary frame
+MAX_FRAME_BYTES = 1 << 20
+
+# A binary frame is packed little-endian float32 x, y (display px) and t (ms) per sample.
+# float32 keeps t to the millisecond for the first 4.6 hours of a session.
+SAMPLE_FIELDS = 3
+SAMPLE_BYTES = SAMPLE_FIELDS * 4
+
+
+def decode_frame(data: bytes) -> np.ndarray:
+    """Parse a binary gaze frame into an (N, 3) float32 array of x, y, t."""
+    if len(data) > MAX_FRAME_BYTES:
+        raise ValueError(f"Frame too large (max {MAX_FRAME_BYTES} bytes)")
+    if len(data) % SAMPLE_BYTES:
+        raise ValueError(f"Frame length must be a multiple of {SAMPLE_BYTES} bytes (float32 x, y, t)")
+    samples = np.frombuffer(data, dtype="<f4").reshape(-1, SAMPLE_FIELDS)
+    if not np.isfinite(samples).all():
+        raise ValueError("Frame contains non-finite values")
+    return samples
+
+
+class GazeRing:
+    """Fixed-capacity buffer of x, y, value, t samples; once full, the oldest are overwritten."""
+
+    def __init__(self, capacity: int = LIVE_BUFFER_POINTS):
+        self._data = np.empty((capacity, 4), dtype=np.float32)
+        self._next = 0
+        self.size = 0
+
+    def append(self, samples: np.ndarray):
+        capacity = len(self._data)
+        samples = samples[-capacity:]
+        count = len(samples)
+        first = min(count, capacity - self._next)
+        self._data[self._next:self._next + first] = samples[:first]
+        self._data[:count - first] = samples[first:]
+        self._next = (self._next + count) % capacity
+        self.size = min(self.size + count, capacity)
+
+    def points(self) -> np.ndarray:
+        """A copy of the stored samples, oldest first."""
+        if self.size < len(self._data):
+            return self._data[:self.size].copy()
+        return np.concatenate((self._data[self._next:], self._data[:self._next]))
+
+
+class LiveSession:
+    """One participant's live gaze on one UI image: a ring buffer of samples plus a coarse heatmap.
+
+    Each sample is weighted by the time since the previous one (/100, as the
+    points script.js gives heatmap.js) and added to a grid of LIVE_CELL_PX
+    cells in UI image coordinates, so the heatmap is updated in O(frame) and
+    grids of every participant on an image line up.
+    """
+
+    def __init__(self, session_id: str, image_id: str, image_shape: Tuple[int, int],
+                 display_size: Tuple[float, float] = None, study_id: str = None):
+        self.session_id = session_id
+        self.image_id = image_id
+        self.study_id = study_id
+        height, width = image_shape
+        self.image_shape = (height, width)
+        self.display_size = display_size or (float(width), float(height))
+        self.ring = GazeRing()
+        self.grid = np.zeros((math.ceil(height / LIVE_CELL_PX), math.ceil(width / LIVE_CELL_PX)), dtype=np.float32)
+        self._scale = (width / self.display_size[0] / LIVE_CELL_PX, height / self.display_size[1] / LIVE_CELL_PX)
+        self._last_t = None
+        self.samples = 0
+        self.started = self.updated = time.time()
+        self.lock = threading.Lock()
+
+    def add(self, samples: np.ndarray):
+        """Append x, y, t samples (already decoded) to the buffer and the heatmap."""
+        if not len(samples):
+            return
+        t = samples[:, 2]
+        with self.lock:
+            previous = np.empty_like(t)
+            # A session's first sample has no duration yet
+            previous[0] = t[0] if self._last_t is None else self._last_t
+            previous[1:] = t[:-1]
+            values = np.maximum(t - previous, 0) / 100
+
+            self.ring.append(np.column_stack((samples[:, 0], samples[:, 1], values, t)))
+            rows, cols = self.grid.shape
+            xs = np.clip((samples[:, 0] * self._scale[0]).astype(np.intp), 0, cols - 1)
+            ys = np.clip((samples[:, 1] * self._scale[1]).astype(np.intp), 0, rows - 1)
+            np.add.at(self.grid, (ys, xs), values)
+            self._last_t = float(t[-1])
+            self.samples += len(samples)
+            self.updated = time.time()
+
+    def gaze_points(self) -> np.ndarray:
+        """The buffered samples as (N, 4) x, y, value, t points, in the /upload_heatmap gaze format."""
+        with self.lock:
+            return self.ring.points().astype(np.float64)
+
+    def density(self) -> np.ndarray:
+        """The live heatmap at cell resolution, blurred like a rendered gaze heatmap."""
+        with self.lock:
+            grid = self.grid.copy()
+        sigma = max(HEATMAP_RADIUS * (self._scale[0] + self._scale[1]) / 2, 0.5) / 2
+        return cv2.GaussianBlur(grid, (0, 0), sigmaX=sigma, sigmaY=sigma)
+
+    def info(self) -> dict:
+        return {
+            "session_id": self.session_id, "image_id": self.image_id, "study_id": self.study_id,
+            "samples": self.samples, "buffered": self.ring.size,
+            "started": self.started, "updated": self.updated,
+        }
+
+
+class LiveGaze:
+    """Live gaze sessions of this process, keyed by session ID; each follows the participant's current image.
+
+    Sessions live in the memory of the process that receives their frames,
+    so with several workers an observer or analysis request only sees the
+    sessions streaming to the worker it reaches.
+    """
+
+    def __init__(self, idle_seconds: float = LIVE_IDLE_SECONDS):
+        self.idle_seconds = idle_seconds
+        self._sessions: Dict[str, LiveSession] = {}
+        self._lock = threading.Lock()
+
+    def start(self, session_id: str, image_id: str, image_shape: Tuple[int, int],
+              display_size: Tuple[float, float] = None, study_id: str = None) -> LiveSession:
+        """Start (or, for a different image or display size, restart) a session's live buffer."""
+        with self._lock:
+            self._expire()
+            session = self._sessions.get(session_id)
+            if (session is None or session.image_id != image_id
+                    or (display_size and tuple(display_size) != session.display_size)):
+                session = LiveSession(session_id, image_id, image_shape, display_size, study_id)
+                self._sessions[session_id] = session
+            return session
+
+    def get(self, session_id: str) -> Optional[LiveSession]:
+        with self._lock:
+            return self._sessions.get(session_id)
+
+    def add(self, session_id: str, data: bytes) -> int:
+        """Decode a binary frame into the session's buffer; returns the number of samples. KeyError if not started."""
+        session = self.get(session_id)
+        if session is None:
+            raise KeyError(f"No live session {session_id}; send a start message first")
+        samples = decode_frame(data)
+        session.add(samples)
+        return len(samples)
+
+    def sessions(self, image_id: str = None) -> List[LiveSession]:
+        with self._lock:
+            self._expire()
+            return [s for s in self._sessions.values() if image_id is None or s.image_id == image_id]
+
+    def image_density(self, image_id: str) -> Optional[np.ndarray]:
+        """Live attention of every participant now on an image, each scaled to unit mass, or None if there are none."""
+        total = None
+        for session in self.sessions(image_id):
+            density = session.density()
+            mass = float(density.sum())
+            if mass <= 0:
+                continue
+            total = density / mass if total is None else total + density / mass
+        return total
+
+    def end(self, session_id: str):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def _expire(self):
+        cutoff = time.time() - self.idle_seconds
+        for session_id in [k for k, s in self._sessions.items() if s.updated < cutoff]:
+            del self._sessions[session_id]
+
+
+def upscale(density: np.ndarray, image_shape: Tuple[int, int]) -> np.ndarray:
+    """A cell-resolution live heatmap resized to the UI image's (height, width)."""
+    height, width = image_shape
+    return cv2.resize(density, (width, height), interpolation=cv2.INTER_LINEAR)
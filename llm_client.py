@@ -0,0 +1,211 @@
+import asyncio
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future
+
+import httpx
+import openai
+from openai import AsyncOpenAI
+
+from metrics import OPENAI_IN_FLIGHT, OPENAI_REQUESTS, OPENAI_SECONDS, record_tokens
+
+# Point at a local stub (see stub_openai.py) to run without network access
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")
+# Account quota; the limiter keeps us under both
+OPENAI_RPM = int(os.getenv("OPENAI_RPM", "500"))
+OPENAI_TPM = int(os.getenv("OPENAI_TPM", "30000"))
+# Stream crew LLM output so the report can be pushed to the browser as it is written
+CREW_STREAM = os.getenv("CREW_STREAM", "1") == "1"
+# Per-request deadline in seconds, including retries
+OPENAI_DEADLINE = float(os.getenv("OPENAI_DEADLINE", "120"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "5"))
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "20"))
+
+# Errors worth retrying; everything else (bad request, auth) fails straight away
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError,
+)
+
+
+class TokenBucket:
+    """Continuously refilling bucket; acquire() waits until enough capacity is available."""
+
+    def __init__(self, capacity: float, per_seconds: float = 60.0):
+        self.capacity = capacity
+        self.rate = capacity / per_seconds
+        self.level = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1.0):
+        # Requests larger than the whole bucket would otherwise wait forever
+        amount = min(amount, self.capacity)
+        while True:
+            self._refill()
+            if self.level >= amount:
+                self.level -= amount
+                return
+            await asyncio.sleep((amount - self.level) / self.rate)
+
+    def adjust(self, amount: float):
+        """Charge (or refund, if negative) the difference between estimated and actual use."""
+        self._refill()
+        # Never owe more than one full bucket, so one oversized call can't stall everyone
+        self.level = max(-self.capacity, min(self.capacity, self.level - amount))
+
+
+def cached_tokens(usage) -> int:
+    """Prompt tokens the provider served from its prompt cache (0 if not reported)."""
+    details = getattr(usage, "prompt_tokens_details", None)
+    return (getattr(details, "cached_tokens", None) or 0) if details else 0
+
+
+class LLMClient:
+    """One pooled AsyncOpenAI client shared by every request in the process.
+
+    Calls are rate limited against the RPM/TPM quota, retried with jittered
+    exponential backoff on 429s, timeouts and 5xx errors, and bounded by a
+    deadline. Synchronous callers (Flask handlers, job threads) go through
+    parse(), which runs the coroutine on a dedicated event loop thread.
+    """
+
+    def __init__(self, rpm: int = OPENAI_RPM, tpm: int = OPENAI_TPM, deadline: float = OPENAI_DEADLINE,
+                 max_retries: int = OPENAI_MAX_RETRIES, max_connections: int = OPENAI_MAX_CONNECTIONS):
+        self.deadline = deadline
+        self.max_retries = max_retries
+        self.max_connections = max_connections
+        self._requests = TokenBucket(rpm)
+        self._tokens = TokenBucket(tpm)
+        self._client = None
+        self._loop = None
+        self._lock = threading.Lock()
+
+        self.in_flight = 0
+        self.total_requests = 0
+        self.total_retries = 0
+        self.total_failures = 0
+        self.total_latency = 0.0
+
+    def _start(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="llm-client", daemon=True).start()
+
+    def _get_client(self) -> AsyncOpenAI:
+        # Created lazily on the loop thread so the connection pool belongs to that loop
+        if self._client is None:
+            self._client = AsyncOpenAI(
+                base_url=OPENAI_BASE_URL,
+                max_retries=0,  # retries are handled here, with the limiter in the loop
+                http_client=httpx.AsyncClient(
+                    limits=httpx.Limits(max_connections=self.max_connections,
+                                        max_keepalive_connections=self.max_connections),
+                    timeout=httpx.Timeout(self.deadline, connect=10.0),
+                ),
+            )
+        return self._client
+
+    async def aparse(self, estimated_tokens: int = 1000, **kwargs):
+        """Async beta.chat.completions.parse with rate limiting, retries and a deadline."""
+        return await asyncio.wait_for(self._parse_with_retries(estimated_tokens, kwargs), self.deadline)
+
+    async def _parse_with_retries(self, estimated_tokens: int, kwargs: dict):
+        client = self._get_client()
+        for attempt in range(self.max_retries + 1):
+            await self._requests.acquire()
+            await self._tokens.acquire(estimated_tokens)
+
+            self.in_flight += 1
+            OPENAI_IN_FLIGHT.inc()
+            started = time.monotonic()
+            try:
+                completion = await client.beta.chat.completions.parse(**kwargs)
+            except RETRYABLE_ERRORS as e:
+                self._tokens.adjust(-estimated_tokens)
+                if attempt == self.max_retries:
+                    self.total_failures += 1
+                    OPENAI_REQUESTS.inc(source="vision", outcome="failure")
+                    raise
+                self.total_retries += 1
+                OPENAI_REQUESTS.inc(source="vision", outcome="retry")
+                await asyncio.sleep(self._backoff(attempt, e))
+                continue
+            except Exception:
+                self.total_failures += 1
+                OPENAI_REQUESTS.inc(source="vision", outcome="failure")
+                raise
+            finally:
+                self.in_flight -= 1
+                OPENAI_IN_FLIGHT.dec()
+                elapsed = time.monotonic() - started
+                self.total_latency += elapsed
+                OPENAI_SECONDS.observe(elapsed)
+
+            self.total_requests += 1
+            OPENAI_REQUESTS.inc(source="vision", outcome="ok")
+            if completion.usage:
+                self._tokens.adjust(completion.usage.total_tokens - estimated_tokens)
+                record_tokens("vision", completion.usage.prompt_tokens, completion.usage.completion_tokens,
+                              cached_tokens(completion.usage))
+            return completion
+
+    @staticmethod
+    def _backoff(attempt: int, error: Exception) -> float:
+        """Full-jitter exponential backoff, honouring Retry-After when the server sends it."""
+        retry_after = None
+        response = getattr(error, "response", None)
+        if response is not None:
+            try:
+                retry_after = float(response.headers.get("retry-after"))
+            except (TypeError, ValueError):
+                pass
+        delay = random.uniform(0, min(30.0, 0.5 * 2 ** attempt))
+        return max(delay, retry_after or 0.0)
+
+    def parse(self, estimated_tokens: int = 1000, **kwargs):
+        """Blocking wrapper around aparse() for synchronous callers."""
+        self._start()
+        future: Future = asyncio.run_coroutine_threadsafe(self.aparse(estimated_tokens, **kwargs), self._loop)
+        return future.result()
+
+    def stats(self) -> dict:
+        completed = self.total_requests + self.total_failures
+        return {
+            "in_flight": self.in_flight,
+            "requests": self.total_requests,
+            "retries": self.total_retries,
+            "failures": self.total_failures,
+            "mean_latency_s": round(self.total_latency / completed, 3) if completed else 0.0,
+        }
+
+
+_shared_client = None
+_shared_lock = threading.Lock()
+
+
+def get_client() -> LLMClient:
+    """The process-wide LLMClient, created on first use (after any gunicorn fork)."""
+    global _shared_client
+    with _shared_lock:
+        if _shared_client is None:
+            _shared_client = LLMClient()
+        return _shared_client
+
+
+def crew_llm_settings() -> dict:
+    """Connection settings for crewai's LLM so crew calls share our endpoint, deadline and retries."""
+    settings = {"model": os.getenv("OPENAI_MODEL_NAME", "gpt-4o"), "timeout": OPENAI_DEADLINE,
+                "max_retries": OPENAI_MAX_RETRIES, "stream": CREW_STREAM}
+    if OPENAI_BASE_URL:
+        settings["base_url"] = OPENAI_BASE_URL
+    return settings
@@ -0,0 +1,241 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, Optional, Tuple
+
+# Print one JSON line per HTTP request and per analysis job, with its stage timings
+METRICS_LOG = os.getenv("METRICS_LOG", "0") == "1"
+
+# Histogram buckets: seconds for latencies, tokens for per-call token counts
+TIME_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+
+Labels = Tuple[Tuple[str, str], ...]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Labels, extra: Labels = ()) -> str:
+    pairs = labels + extra
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in pairs) + "}"
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class Metric:
+    """Base for the metric types: a name, help text and one series per label set."""
+
+    kind = ""
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._lock = threading.Lock()
+        self._series: Dict[Labels, object] = {}
+
+    @staticmethod
+    def _key(labels: dict) -> Labels:
+        return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            lines.extend(self._render_series())
+        return "\n".join(lines)
+
+    def _render_series(self):
+        for labels, value in sorted(self._series.items()):
+            yield f"{self.name}{_format_labels(labels)} {_format_value(value)}"
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0.0) + amount
+
+
+class Gauge(Metric):
+    """A value that goes up and down, or is read from a function at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str):
+        super().__init__(name, help)
+        self._function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._series[self._key(labels)] = value
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0.0) + amount
+
+    def dec(self, amount: float = 1.0, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function: Callable[[], float]):
+        self._function = function
+
+    def _render_series(self):
+        if self._function is not None:
+            self._series[()] = self._function()
+        yield from super()._render_series()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Tuple[float, ...] = TIME_BUCKETS):
+        super().__init__(name, help)
+        self.buckets = tuple(buckets) + (float("inf"),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series["counts"][i] += 1
+                    break
+            series["sum"] += value
+            series["count"] += 1
+
+    def _render_series(self):
+        for labels, series in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, series["counts"]):
+                cumulative += count
+                yield f"{self.name}_bucket{_format_labels(labels, (('le', _format_value(bound)),))} {cumulative}"
+            yield f"{self.name}_sum{_format_labels(labels)} {_format_value(series['sum'])}"
+            yield f"{self.name}_count{_format_labels(labels)} {series['count']}"
+
+
+class Registry:
+    """The process's metrics, rendered together in Prometheus text format.
+
+    Metrics are per process; with several gunicorn workers each one serves its own.
+    """
+
+    def __init__(self):
+        self._metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics.values()) + "\n"
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    "ui_eval_stage_seconds", "Time spent in each pipeline stage (decode, blend, vision_call, crew_kickoff, ...)"))
+HTTP_REQUESTS = REGISTRY.register(Counter(
+    "ui_eval_http_requests_total", "HTTP requests by endpoint and status"))
+HTTP_SECONDS = REGISTRY.register(Histogram(
+    "ui_eval_http_request_seconds", "HTTP request latency by endpoint"))
+HTTP_IN_FLIGHT = REGISTRY.register(Gauge(
+    "ui_eval_http_in_flight", "HTTP requests being handled"))
+JOBS = REGISTRY.register(Counter(
+    "ui_eval_jobs_total", "Finished analysis jobs by status"))
+JOBS_PENDING = REGISTRY.register(Gauge(
+    "ui_eval_jobs_pending", "Analysis jobs queued or running in this process"))
+JOB_SECONDS = REGISTRY.register(Histogram(
+    "ui_eval_job_seconds", "Analysis job run time, from start to done or failed"))
+OPENAI_REQUESTS = REGISTRY.register(Counter(
+    "ui_eval_openai_requests_total", "OpenAI API calls by source and outcome (ok, retry, failure)"))
+OPENAI_IN_FLIGHT = REGISTRY.register(Gauge(
+    "ui_eval_openai_in_flight", "OpenAI API calls in flight"))
+OPENAI_SECONDS = REGISTRY.register(Histogram(
+    "ui_eval_openai_request_seconds", "OpenAI API call latency, per attempt"))
+OPENAI_TOKENS = REGISTRY.register(Counter(
+    "ui_eval_openai_tokens_total",
+    "Tokens used by source (vision, crew) and kind (prompt, completion, cached_prompt: prompt tokens served from the provider's prompt cache)"))
+OPENAI_CALL_TOKENS = REGISTRY.register(Histogram(
+    "ui_eval_openai_call_tokens", "Total tokens per OpenAI call (per crew run for the crew)", TOKEN_BUCKETS))
+LIVE_SAMPLES = REGISTRY.register(Counter(
+    "ui_eval_live_gaze_samples_total", "Gaze samples received from live sessions, by transport (ws, http)"))
+LIVE_SESSIONS = REGISTRY.register(Gauge(
+    "ui_eval_live_sessions", "Live gaze sessions held by this process"))
+
+
+# Stage timings and notes of the request or job running in this context
+_trace: ContextVar[Optional[dict]] = ContextVar("trace", default=None)
+
+
+def start_trace(event: str, **fields) -> dict:
+    """Start collecting the spans of one request or job in this context."""
+    record = {"event": event, **fields, "spans": {}}
+    record["_token"] = _trace.set(record)
+    record["_started"] = time.perf_counter()
+    return record
+
+
+def end_trace(record: dict):
+    """Stop collecting; the record gets its duration and is logged as a JSON line if METRICS_LOG is set."""
+    token = record.pop("_token")
+    try:
+        _trace.reset(token)
+    except ValueError:
+        # Ended from another context (e.g. after a streamed response); nothing to restore
+        pass
+    record["duration_ms"] = round((time.perf_counter() - record.pop("_started")) * 1000, 1)
+    if METRICS_LOG:
+        print(json.dumps(record, default=str))
+
+
+@contextmanager
+def trace(event: str, **fields):
+    record = start_trace(event, **fields)
+    try:
+        yield record
+    finally:
+        end_trace(record)
+
+
+@contextmanager
+def span(stage: str):
+    """Time a pipeline stage into ui_eval_stage_seconds and the current trace."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, stage=stage)
+        record = _trace.get()
+        if record is not None:
+            spans = record["spans"]
+            spans[stage] = round(spans.get(stage, 0.0) + elapsed * 1000, 1)
+
+
+def note(**fields):
+    """Attach fields (e.g. token usage) to the current trace."""
+    record = _trace.get()
+    if record is not None:
+        record.update(fields)
+
+
+def record_tokens(source: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0):
+    OPENAI_TOKENS.inc(prompt_tokens, source=source, kind="prompt")
+    OPENAI_TOKENS.inc(completion_tokens, source=source, kind="completion")
+    OPENAI_TOKENS.inc(cached_tokens, source=source, kind="cached_prompt")
+    OPENAI_CALL_TOKENS.observe(prompt_tokens + completion_tokens, source=source)
@@ -0,0 +1,159 @@
+import base64
+import math
+import os
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+
+# "full" sends the whole blend; "crop" sends only the high-attention bounding box;
+# "tiles" sends a low-detail overview plus one high-detail crop per attention region;
+# "overview" sends only the low-detail overview, for when the prompt carries the AOI table
+VISION_MODE = os.getenv("VISION_MODE", "full")
+# "high" or "low" detail for the main image(s)
+VISION_DETAIL = os.getenv("VISION_DETAIL", "high")
+# Optional cap on the longest side after the model's own scaling (0 = no cap)
+VISION_MAX_SIDE = int(os.getenv("VISION_MAX_SIDE", "0"))
+# Candidate encodings; the smallest result is sent
+VISION_FORMATS = os.getenv("VISION_FORMATS", "webp,jpeg,png").split(",")
+VISION_QUALITY = int(os.getenv("VISION_QUALITY", "85"))
+
+# Heatmap alpha (0-255) above which a pixel counts as attended
+ATTENTION_THRESHOLD = 64
+MAX_TILES = 4
+
+_ENCODERS = {
+    "png": (".png", "image/png", [cv2.IMWRITE_PNG_COMPRESSION, 6]),
+    "jpeg": (".jpg", "image/jpeg", [cv2.IMWRITE_JPEG_QUALITY, VISION_QUALITY]),
+    "webp": (".webp", "image/webp", [cv2.IMWRITE_WEBP_QUALITY, VISION_QUALITY]),
+}
+
+
+def effective_size(width: int, height: int, detail: str = "high") -> Tuple[int, int]:
+    """Size GPT-4o actually looks at: fit in 2048x2048, then shortest side at most 768."""
+    if detail == "low":
+        scale = min(1.0, 512 / max(width, height))
+    else:
+        scale = min(1.0, 2048 / max(width, height))
+        shortest = min(width, height) * scale
+        if shortest > 768:
+            scale *= 768 / shortest
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def estimate_tokens(width: int, height: int, detail: str = "high") -> int:
+    """Vision token cost of one image: 85 base plus 170 per 512px tile in high detail."""
+    if detail == "low":
+        return 85
+    w, h = effective_size(width, height, detail)
+    return 85 + 170 * math.ceil(w / 512) * math.ceil(h / 512)
+
+
+def encode_smallest(rgb: np.ndarray, formats: List[str] = VISION_FORMATS, png: bytes = None) -> Tuple[str, bytes]:
+    """Encode an RGB image in each candidate format and return (mime type, bytes) of the smallest.
+
+    png is an existing PNG encoding of the same image, used instead of encoding it again.
+    """
+    bgr = cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+    best = None
+    for name in formats:
+        name = name.strip()
+        ext, mime, params = _ENCODERS[name]
+        if name == "png" and png is not None:
+            data = png
+        else:
+            ok, buffer = cv2.imencode(ext, bgr, params)
+            if not ok:
+                continue
+            data = buffer.tobytes()
+        if best is None or len(data) < len(best[1]):
+            best = (mime, data)
+    return best
+
+
+def _resize(rgb: np.ndarray, detail: str) -> np.ndarray:
+    height, width = rgb.shape[:2]
+    w, h = effective_size(width, height, detail)
+    if VISION_MAX_SIDE and max(w, h) > VISION_MAX_SIDE:
+        scale = VISION_MAX_SIDE / max(w, h)
+        w, h = max(1, round(w * scale)), max(1, round(h * scale))
+    if (w, h) == (width, height):
+        return rgb
+    return cv2.resize(rgb, (w, h), interpolation=cv2.INTER_AREA)
+
+
+def attention_regions(attention: np.ndarray, max_regions: int = MAX_TILES, pad: int = 32) -> List[Tuple[int, int, int, int]]:
+    """Bounding boxes (x, y, w, h) of the largest attended regions in a heatmap alpha mask."""
+    mask = (attention > ATTENTION_THRESHOLD).astype(np.uint8)
+    count, _, boxes, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    # Row 0 is the background; sort the rest by area
+    boxes = sorted(boxes[1:count], key=lambda box: box[4], reverse=True)[:max_regions]
+    height, width = attention.shape[:2]
+    regions = []
+    for x, y, w, h, _ in boxes:
+        x0, y0 = max(0, x - pad), max(0, y - pad)
+        x1, y1 = min(width, x + w + pad), min(height, y + h + pad)
+        regions.append((int(x0), int(y0), int(x1 - x0), int(y1 - y0)))
+    return regions
+
+
+def prepare_vision_images(blended: np.ndarray, attention: Optional[np.ndarray] = None, mode: str = VISION_MODE,
+                          detail: str = VISION_DETAIL, source_bytes: int = None,
+                          source_png: bytes = None) -> Tuple[List[dict], dict]:
+    """Downscale, crop/tile and encode a blended RGB(A) image for the vision call.
+
+    source_png is the blend's saved PNG; when the whole image is sent without
+    resizing those bytes are reused rather than encoding the PNG again.
+    Returns the image_url content parts and a report of bytes and estimated
+    tokens compared with sending the full-resolution image.
+    """
+    if source_bytes is None and source_png is not None:
+        source_bytes = len(source_png)
+    rgb = np.ascontiguousarray(blended[..., :3])
+    height, width = rgb.shape[:2]
+
+    views = []  # (rgb, detail)
+    regions = attention_regions(attention) if attention is not None and mode != "full" else []
+    if mode == "crop" and regions:
+        x0 = min(x for x, _, _, _ in regions)
+        y0 = min(y for _, y, _, _ in regions)
+        x1 = max(x + w for x, _, w, _ in regions)
+        y1 = max(y + h for _, y, _, h in regions)
+        views.append((rgb[y0:y1, x0:x1], detail))
+    elif mode == "tiles" and regions:
+        # The overview keeps ignored areas visible; the crops carry the detail
+        views.append((rgb, "low"))
+        views.extend((rgb[y:y + h, x:x + w], detail) for x, y, w, h in regions)
+    elif mode == "overview":
+        views.append((rgb, "low"))
+    else:
+        views.append((rgb, detail))
+
+    parts = []
+    sent_bytes = 0
+    sent_tokens = 0
+    for view, view_detail in views:
+        resized = _resize(np.ascontiguousarray(view), view_detail)
+        mime, data = encode_smallest(resized, png=source_png if resized is rgb else None)
+        sent_bytes += len(data)
+        sent_tokens += estimate_tokens(resized.shape[1], resized.shape[0], view_detail)
+        parts.append({
+            "type": "image_url",
+            "image_url": {
+                "url": f"data:{mime};base64,{base64.b64encode(data).decode('utf-8')}",
+                "detail": view_detail,
+            },
+        })
+
+    original_tokens = estimate_tokens(width, height, "high")
+    report = {
+        "mode": mode,
+        "images": len(parts),
+        "source_size": [width, height],
+        "source_bytes": source_bytes,
+        "sent_bytes": sent_bytes,
+        "bytes_saved": source_bytes - sent_bytes if source_bytes is not None else None,
+        "estimated_tokens": sent_tokens,
+        "tokens_saved": original_tokens - sent_tokens,
+    }
+    return parts, report
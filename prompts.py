@@ -0,0 +1,93 @@
+import json
+import os
+import re
+from functools import lru_cache
+from typing import List, Optional, Type, Union, get_args, get_origin
+
+from pydantic import BaseModel, ConfigDict, Field, create_model
+
+# "full" sends the models' long field descriptions and prompts as written;
+# "compact" sends one-sentence descriptions and the short prompt variants
+PROMPT_MODE = os.getenv("PROMPT_MODE", "full")
+
+# Rough characters per token for English prompt text and JSON (no tokenizer installed)
+CHARS_PER_TOKEN = 4
+
+
+def estimate_tokens(text: str) -> int:
+    return len(text) // CHARS_PER_TOKEN
+
+
+def first_sentence(text: str) -> str:
+    """The first sentence of a description, with its whitespace and '(e.g., ...)' examples removed."""
+    text = " ".join(re.sub(r"\s*\(e\.g\.,[^)]*\)", "", text).split())
+    match = re.match(r"(.+?[.!?])(\s|$)", text)
+    return match.group(1) if match else text
+
+
+def _drop_titles(schema: dict):
+    # Pydantic derives titles from the class and field names; they only repeat them
+    schema.pop("title", None)
+    for prop in schema.get("properties", {}).values():
+        prop.pop("title", None)
+
+
+def _compact_annotation(annotation):
+    if isinstance(annotation, type) and issubclass(annotation, BaseModel):
+        return compact_model(annotation)
+    origin = get_origin(annotation)
+    if origin in (list, List):
+        return List[_compact_annotation(get_args(annotation)[0])]
+    if origin is Union:
+        return Optional[_compact_annotation(next(arg for arg in get_args(annotation) if arg is not type(None)))]
+    return annotation
+
+
+@lru_cache(maxsize=None)
+def compact_model(model: Type[BaseModel]) -> Type[BaseModel]:
+    """A copy of model, nested models included, without titles and with one-sentence descriptions.
+
+    Field names, types and defaults are unchanged, so the structured output
+    parses into the same shape (and validates against the full model).
+    """
+    fields = {}
+    for name, info in model.model_fields.items():
+        kwargs = {"description": first_sentence(info.description)} if info.description else {}
+        if info.default_factory is not None:
+            kwargs["default_factory"] = info.default_factory
+        elif not info.is_required():
+            kwargs["default"] = info.default
+        fields[name] = (_compact_annotation(info.annotation), Field(**kwargs))
+    return create_model(model.__name__, __config__=ConfigDict(json_schema_extra=_drop_titles), **fields)
+
+
+def response_model(model: Type[BaseModel], mode: str = PROMPT_MODE) -> Type[BaseModel]:
+    """The model to send as the response format in the given prompt mode."""
+    return compact_model(model) if mode == "compact" else model
+
+
+@lru_cache(maxsize=None)
+def schema_tokens(model: Type[BaseModel]) -> int:
+    """Estimated tokens of a model's JSON schema as sent in response_format."""
+    return estimate_tokens(json.dumps(model.model_json_schema(), separators=(",", ":")))
+
+
+def vision_messages(instructions: str, context: Optional[str], image_parts: List[dict]) -> List[dict]:
+    """Chat messages for a vision call, ordered so the fixed part is a stable, cacheable prefix.
+
+    The response schema and the instructions (system message) are the same on
+    every call, so provider-side prompt caching can reuse them; per-call
+    measured context and the images follow in the user message.
+    """
+    content = [{"type": "text", "text": context}] if context else []
+    return [
+        {"role": "system", "content": instructions},
+        {"role": "user", "content": [*content, *image_parts]},
+    ]
+
+
+def prompt_tokens_report(instructions: str, model: Type[BaseModel], context: Optional[str], image_tokens: int) -> dict:
+    """Estimated fixed (schema + instructions) vs variable (context + images) prompt tokens of one call."""
+    fixed = schema_tokens(model) + estimate_tokens(instructions)
+    variable = estimate_tokens(context or "") + image_tokens
+    return {"fixed_tokens": fixed, "variable_tokens": variable}
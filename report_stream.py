@@ -0,0 +1,89 @@
+import json
+import threading
+import time
+from typing import Dict, Iterator, Optional, Tuple
+
+# Seconds a finished stream is kept so late subscribers can replay it
+STREAM_TTL = 600
+# Seconds between keep-alive comments on an idle SSE connection
+KEEPALIVE_INTERVAL = 15
+
+
+class ReportStreams:
+    """Per-session event logs that server-sent-event subscribers can follow.
+
+    Streams live in the process that runs the crew; subscribers that land on
+    another worker process fall back to the final report in the store.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._streams: Dict[str, dict] = {}
+
+    def _get(self, session_id: str, create: bool = False) -> Optional[dict]:
+        with self._lock:
+            self._prune()
+            stream = self._streams.get(session_id)
+            if stream is None and create:
+                stream = {"events": [], "done": False, "run": 0, "updated": time.time(), "cond": threading.Condition()}
+                self._streams[session_id] = stream
+            return stream
+
+    def open(self, session_id: str):
+        """Start a fresh run on the session's stream; current subscribers follow it from the start."""
+        stream = self._get(session_id, create=True)
+        with stream["cond"]:
+            stream["events"] = []
+            stream["done"] = False
+            stream["run"] += 1
+            stream["updated"] = time.time()
+            stream["cond"].notify_all()
+
+    def publish(self, session_id: str, event: str, data: dict, done: bool = False):
+        stream = self._get(session_id, create=True)
+        with stream["cond"]:
+            stream["events"].append((event, data))
+            stream["done"] = stream["done"] or done
+            stream["updated"] = time.time()
+            stream["cond"].notify_all()
+
+    def active(self, session_id: str) -> bool:
+        """True if a crew run for the session has published events in this process."""
+        stream = self._get(session_id)
+        return stream is not None and (bool(stream["events"]) or stream["run"] > 0)
+
+    def subscribe(self, session_id: str) -> Iterator[Optional[Tuple[str, dict]]]:
+        """Yield (event, data) from the start of the stream until it is done.
+
+        Yields None after KEEPALIVE_INTERVAL seconds without events.
+        """
+        stream = self._get(session_id, create=True)
+        index = 0
+        run = stream["run"]
+        while True:
+            with stream["cond"]:
+                if index >= len(stream["events"]) and not stream["done"] and run == stream["run"]:
+                    stream["cond"].wait(KEEPALIVE_INTERVAL)
+                if run != stream["run"]:
+                    run, index = stream["run"], 0
+                events = stream["events"][index:]
+                done = stream["done"]
+            index += len(events)
+
+            if not events and not done:
+                yield None
+            for event in events:
+                yield event
+            if done and index >= len(stream["events"]):
+                return
+
+    def _prune(self):
+        """Drop finished or never-started streams idle for STREAM_TTL. Caller holds the lock."""
+        cutoff = time.time() - STREAM_TTL
+        stale = [k for k, s in self._streams.items() if (s["done"] or not s["events"]) and s["updated"] < cutoff]
+        for session_id in stale:
+            del self._streams[session_id]
+
+
+def format_sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
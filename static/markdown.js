@@ -0,0 +1,153 @@
+// Minimal markdown renderer for the crew's reports, served from here so the
+// analysis page loads no third-party script. The report is model output and may
+// contain anything: all text is escaped, raw HTML is shown as text, and links or
+// images with unsafe URLs are reduced to their text.
+// Covers what the report prompts produce: headings, paragraphs, bullet and
+// numbered lists (nested by indentation), block quotes, code, rules, tables,
+// links, images, bold, italic and inline code.
+
+function escapeHtml(text) {
+    return text.replace(/&/g, "&amp;").replace(/</g, "&lt;").replace(/>/g, "&gt;").replace(/"/g, "&quot;");
+}
+
+// Only web and mail links; rejects javascript:, data: and the like
+function isSafeUrl(href) {
+    try {
+        return ["http:", "https:", "mailto:"].includes(new URL(href, document.baseURI).protocol);
+    } catch (e) {
+        return false;
+    }
+}
+
+// Code spans, images and links are rendered from the raw text and swapped for
+// placeholders, so escaping and emphasis never touch their HTML
+function renderInline(text) {
+    const tokens = [];
+    const hold = html => `\u0000${tokens.push(html) - 1}\u0000`;
+    text = text.replace(/\u0000/g, "")
+    .replace(/(`+)([^`]|[^`][\s\S]*?[^`])\1(?!`)/g, (match, ticks, code) => hold(`<code>${escapeHtml(code.trim())}</code>`))
+    .replace(/!\[([^\]]*)\]\(\s*<?((?:[^\s()<>]|\([^\s()]*\))*)>?(?:\s+"([^"]*)")?\s*\)/g, (match, alt, href, title) => hold(
+        isSafeUrl(href)
+            ? `<img src="${escapeHtml(href)}" alt="${escapeHtml(alt)}"${title ? ` title="${escapeHtml(title)}"` : ""}>`
+            : escapeHtml(alt)))
+    .replace(/\[([^\]]+)\]\(\s*<?((?:[^\s()<>]|\([^\s()]*\))*)>?(?:\s+"([^"]*)")?\s*\)/g, (match, label, href, title) => hold(
+        isSafeUrl(href)
+            ? `<a href="${escapeHtml(href)}"${title ? ` title="${escapeHtml(title)}"` : ""}>${renderInline(label)}</a>`
+            : renderInline(label)));
+    return escapeHtml(text)
+    .replace(/(\*\*|__)(?=\S)([\s\S]*?\S)\1/g, "<strong>$2</strong>")
+    .replace(/\*(?=\S)([\s\S]*?\S)\*/g, "<em>$1</em>")
+    .replace(/(^|[^\w])_(?=\S)([\s\S]*?\S)_(?!\w)/g, "$1<em>$2</em>")
+    .replace(/~~(?=\S)([\s\S]*?\S)~~/g, "<del>$1</del>")
+    .replace(/ {2,}\n/g, "<br>\n")
+    .replace(/\u0000(\d+)\u0000/g, (match, i) => tokens[i]);
+}
+
+function tableCells(line) {
+    return line.trim().replace(/^\|/, "").replace(/\|$/, "").split("|").map(cell => cell.trim());
+}
+
+const LIST_ITEM = /^(\s*)([-*+]|\d+[.)])\s+(.*)$/;
+
+// Nested lists by indentation: each item opens a deeper list, continues the current
+// one, or closes lists until it finds its level
+function renderList(lines) {
+    let html = "";
+    const open = [];
+    for (const line of lines) {
+        const item = line.match(LIST_ITEM);
+        if (!item) {
+            // A continuation line belongs to the item above it
+            html += " " + renderInline(line.trim());
+            continue;
+        }
+        const indent = item[1].replace(/\t/g, "    ").length;
+        const tag = /\d/.test(item[2]) ? "ol" : "ul";
+        while (open.length && indent < open[open.length - 1].indent) {
+            html += `</li></${open.pop().tag}>`;
+        }
+        if (open.length && indent === open[open.length - 1].indent && tag !== open[open.length - 1].tag) {
+            html += `</li></${open.pop().tag}>`;
+        }
+        const top = open[open.length - 1];
+        if (!top || indent > top.indent) {
+            const start = tag === "ol" && parseInt(item[2], 10) !== 1 ? ` start="${parseInt(item[2], 10)}"` : "";
+            html += `<${tag}${start}>`;
+            open.push({indent, tag});
+        } else {
+            html += "</li>";
+        }
+        html += `<li>${renderInline(item[3])}`;
+    }
+    while (open.length) {
+        html += `</li></${open.pop().tag}>`;
+    }
+    return html;
+}
+
+function renderMarkdown(markdown) {
+    const lines = markdown.replace(/\r\n?/g, "\n").split("\n");
+    const blocks = [];
+    let i = 0;
+    const isBlank = line => !line.trim();
+    while (i < lines.length) {
+        const line = lines[i];
+        let match;
+        if (isBlank(line)) {
+            i++;
+        } else if ((match = line.match(/^\s*(```|~~~)/))) {
+            const code = [];
+            for (i++; i < lines.length && !lines[i].trim().startsWith(match[1]); i++) {
+                code.push(lines[i]);
+            }
+            i++;
+            blocks.push(`<pre><code>${escapeHtml(code.join("\n"))}</code></pre>`);
+        } else if ((match = line.match(/^\s{0,3}(#{1,6})\s+(.*?)\s*#*\s*$/))) {
+            blocks.push(`<h${match[1].length}>${renderInline(match[2])}</h${match[1].length}>`);
+            i++;
+        } else if (/^\s{0,3}([-*_])(\s*\1){2,}\s*$/.test(line)) {
+            blocks.push("<hr>");
+            i++;
+        } else if (/^\s{0,3}>/.test(line)) {
+            const quote = [];
+            for (; i < lines.length && /^\s{0,3}>/.test(lines[i]); i++) {
+                quote.push(lines[i].replace(/^\s{0,3}>\s?/, ""));
+            }
+            blocks.push(`<blockquote>${renderMarkdown(quote.join("\n"))}</blockquote>`);
+        } else if (line.includes("|") && /^\s*\|?\s*:?-+:?\s*(\|\s*:?-+:?\s*)*\|?\s*$/.test(lines[i + 1] || "")) {
+            const head = tableCells(line);
+            let html = `<table><thead><tr>${head.map(cell => `<th>${renderInline(cell)}</th>`).join("")}</tr></thead><tbody>`;
+            for (i += 2; i < lines.length && !isBlank(lines[i]) && lines[i].includes("|"); i++) {
+                html += `<tr>${tableCells(lines[i]).map(cell => `<td>${renderInline(cell)}</td>`).join("")}</tr>`;
+            }
+            blocks.push(html + "</tbody></table>");
+        } else if (LIST_ITEM.test(line)) {
+            const items = [];
+            // Blank lines between items keep the list going
+            for (; i < lines.length; i++) {
+                if (isBlank(lines[i])) {
+                    if (i + 1 < lines.length && (LIST_ITEM.test(lines[i + 1]) || /^\s+\S/.test(lines[i + 1]))) {
+                        continue;
+                    }
+                    break;
+                }
+                // A flush-left line after a blank one ends the list
+                if (!LIST_ITEM.test(lines[i]) && !/^\s/.test(lines[i]) && isBlank(lines[i - 1])) {
+                    break;
+                }
+                items.push(lines[i]);
+            }
+            blocks.push(renderList(items));
+        } else {
+            const paragraph = [];
+            for (; i < lines.length && !isBlank(lines[i]); i++) {
+                if (paragraph.length && /^\s{0,3}(#{1,6}\s|```|~~~|>)|^(\s*)([-*+]|\d+[.)])\s+/.test(lines[i])) {
+                    break;
+                }
+                paragraph.push(lines[i]);
+            }
+            blocks.push(`<p>${renderInline(paragraph.join("\n"))}</p>`);
+        }
+    }
+    return blocks.join("\n");
+}
@@ -9,15 +9,51 @@ let calibrationComplete = false;
 let heatmapVisible = true;
 let heatmapInstance;
 let currentImageIndex = 0;
-const uiImages = [
-    "/static/ui_images/image1.png",
-    "/static/ui_images/image2.png",
-    "/static/ui_images/image3.png" 
-];
+// Filled from the study definition (config/studies.yaml); ?study=<id> picks the study
+let study = null;
+let uiImages = [];
 const heatmaps = {};
+// Successful uploads, to tell whether the participant leaves mid-batch
+let uploadCount = 0;
 
-// randomize the uiImages array 
-uiImages.sort(() => Math.random() - 0.5);
+// "gaze" posts the raw gaze points and lets the server render the heatmap;
+// "canvas" uploads the heatmap.js canvas and UI image as PNGs
+const UPLOAD_MODE = "gaze";
+
+// Stream gaze to the server while it is recorded, so a crashed tab loses nothing
+// and saving needs no upload. Without a live connection, saving uploads as before.
+const LIVE_STREAMING = true;
+// Samples per binary frame, and the longest a sample waits before it is sent
+const LIVE_FRAME_SAMPLES = 256;
+const LIVE_FLUSH_MS = 500;
+let liveSocket = null;
+// Packed x, y, t (ms) per sample; Float32Array is little-endian on every platform browsers run on
+const liveFrame = new Float32Array(LIVE_FRAME_SAMPLES * 3);
+let liveSamples = 0;
+
+// One ID per participant session so the server keeps their analyses separate
+let sessionId = sessionStorage.getItem("sessionId");
+if (!sessionId) {
+    sessionId = crypto.randomUUID().replace(/-/g, "");
+    sessionStorage.setItem("sessionId", sessionId);
+}
+
+// Load the study's images, shuffled per participant if the study asks for it
+function loadStudy() {
+    const studyId = new URLSearchParams(window.location.search).get("study");
+    return fetch("http://127.0.0.1:5000/studies")
+    .then(response => response.json())
+    .then(data => {
+        study = data.studies.find(s => s.id === (studyId || data.default));
+        if (!study) {
+            throw new Error(`Unknown study: ${studyId || data.default}`);
+        }
+        uiImages = study.images.map(image => `/static/ui_images/${image}`);
+        if (study.randomize) {
+            uiImages.sort(() => Math.random() - 0.5);
+        }
+    });
+}
 
 // Debugging: Check if WebGazer is loaded
 if (typeof webgazer === "undefined") {
@@ -29,7 +65,16 @@ if (typeof webgazer === "undefined") {
 window.onload = function () {
     startTracking();
     const imgElement = document.getElementById("current-ui");
-    imgElement.src = uiImages[0]; 
+    loadStudy()
+    .then(() => {
+        imgElement.onload = startLiveImage;
+        imgElement.src = uiImages[0];
+        openLiveSocket();
+    })
+    .catch(error => {
+        console.error("Error loading study:", error);
+        alert("Error: Unable to load the study. Please try again later.");
+    });
     document.getElementById("start-calibration").addEventListener("click", startCalibration);
     document.getElementById("toggle-heatmap").addEventListener("click", toggleHeatmap);
     document.getElementById("save-heatmap").addEventListener("click", saveHeatmapLocally);
@@ -124,6 +169,9 @@ function startTracking() {
             
             // Only record points within image bounds
             if (x >= 0 && x <= rect.width && y >= 0 && y <= rect.height) {
+                // The server weights each sample by the time since the previous one, as below
+                addLiveSample(x, y, clock);
+
                 // Initialize lastTime if not set
                 if (!lastTime) {
                     lastTime = clock;
@@ -138,6 +186,7 @@ function startTracking() {
                         value: duration / 100 // Convert duration to seconds (or adjust as needed)
                     };
                     heatmapInstance.addData(point);
+                    gazeData.push([point.x, point.y, point.value, clock]);
                 }
 
                 // Update lastGaze and lastTime
@@ -148,6 +197,64 @@ function startTracking() {
     }).begin();
 }
 
+// Open the live gaze stream; it (re)starts the current image once connected
+function openLiveSocket() {
+    if (!LIVE_STREAMING || typeof WebSocket === "undefined") return;
+    liveSocket = new WebSocket("ws://127.0.0.1:5000/live/ws");
+    liveSocket.binaryType = "arraybuffer";
+    liveSocket.onopen = startLiveImage;
+    liveSocket.onmessage = (event) => {
+        const message = JSON.parse(event.data);
+        if (message.type === "queued") {
+            uploadCount++;
+            alert("Heatmap saved successfully! Analysis is running in the background.");
+            pollJob(message.job_id);
+        } else if (message.type === "error") {
+            console.error("Live gaze error:", message.error);
+        }
+    };
+    // The server may not support live streaming; saving then falls back to uploads
+    liveSocket.onclose = () => { liveSocket = null; };
+}
+
+function liveConnected() {
+    return liveSocket !== null && liveSocket.readyState === WebSocket.OPEN;
+}
+
+// Tell the server which image the following samples belong to
+function startLiveImage() {
+    if (!liveConnected() || !uiImages.length) return;
+    flushLiveFrame();
+    const rect = document.getElementById("current-ui").getBoundingClientRect();
+    const message = {
+        type: "start",
+        session_id: sessionId,
+        ui_image_id: uiImages[currentImageIndex].split("/").pop(),
+        study_id: study.id
+    };
+    if (rect.width > 0 && rect.height > 0) {
+        message.display = [rect.width, rect.height];
+    }
+    liveSocket.send(JSON.stringify(message));
+}
+
+function addLiveSample(x, y, t) {
+    if (!liveConnected()) return;
+    liveFrame.set([x, y, t], liveSamples * 3);
+    liveSamples++;
+    if (liveSamples === LIVE_FRAME_SAMPLES) {
+        flushLiveFrame();
+    }
+}
+
+function flushLiveFrame() {
+    if (liveSamples > 0 && liveConnected()) {
+        liveSocket.send(liveFrame.slice(0, liveSamples * 3).buffer);
+    }
+    liveSamples = 0;
+}
+setInterval(flushLiveFrame, LIVE_FLUSH_MS);
+
 // 4. Add heatmap reset when changing images
 function loadUIImage(index) {
     if (index < 0 || index >= uiImages.length) return;
@@ -164,8 +271,10 @@ function loadUIImage(index) {
             });
         }
         heatmaps[currentImageIndex] = [];
+        gazeData = [];
         lastGaze = null; 
         lastTime = null; 
+        startLiveImage();
     };
     imgElement.src = uiImages[currentImageIndex];
 }
@@ -187,6 +296,17 @@ function toggleHeatmap() {
 
 // Save Heatmap Locally
 function saveHeatmapLocally() {
+    if (UPLOAD_MODE === "gaze") {
+        if (liveConnected()) {
+            // The server already holds this image's gaze
+            flushLiveFrame();
+            liveSocket.send(JSON.stringify({ type: "analyze" }));
+        } else {
+            uploadGazeData();
+        }
+        return;
+    }
+
     const heatmapCanvas = document.querySelector("#homepage canvas");
     if (!heatmapCanvas) {
         console.error("Heatmap canvas not found.");
@@ -234,6 +354,9 @@ function saveHeatmapLocally() {
             // Append the heatmap and UI image Blob to FormData
             formData.append("heatmap", heatmapBlob, "heatmap.png");
             formData.append("ui_image", blob, `Dashboard${currentImageIndex + 1}.png`);
+            formData.append("session_id", sessionId);
+            formData.append("ui_image_id", uiImages[currentImageIndex].split("/").pop());
+            formData.append("study_id", study.id);
 
             // Send the FormData to the backend
             uploadHeatmap(formData);
@@ -242,11 +365,27 @@ function saveHeatmapLocally() {
 }
 
 
+// Send the recorded gaze points for the current UI image
+function uploadGazeData() {
+    const imgElement = document.getElementById("current-ui");
+    const rect = imgElement.getBoundingClientRect();
+    const payload = {
+        session_id: sessionId,
+        ui_image_id: uiImages[currentImageIndex].split("/").pop(),
+        study_id: study.id,
+        display: [rect.width, rect.height],
+        gaze: gazeData
+    };
+
+    uploadHeatmap(JSON.stringify(payload), { "Content-Type": "application/json" });
+}
+
 // Upload Heatmap to Backend
-function uploadHeatmap(formData) {
+function uploadHeatmap(body, headers = {}) {
     fetch("http://127.0.0.1:5000/upload_heatmap", {
         method: "POST",
-        body: formData
+        headers: headers,
+        body: body
     })
     .then(response => {
         if (!response.ok) {
@@ -259,7 +398,9 @@ function uploadHeatmap(formData) {
         if (data.error) {
             alert("Error: " + data.error);
         } else {
-            alert("Heatmap saved successfully!");
+            uploadCount++;
+            alert("Heatmap saved successfully! Analysis is running in the background.");
+            pollJob(data.job_id);
         }
     })
     .catch(error => {
@@ -267,3 +408,38 @@ function uploadHeatmap(formData) {
         alert("Error: Unable to upload heatmap. Please try again later.");
     });
 }
+
+// A participant leaving before finishing a batch still gets a report on the images they saw
+window.addEventListener("pagehide", () => {
+    flushLiveFrame();
+    if (study && uploadCount % study.size !== 0) {
+        const formData = new FormData();
+        formData.append("study_id", study.id);
+        navigator.sendBeacon(`http://127.0.0.1:5000/sessions/${sessionId}/finish`, formData);
+    }
+});
+
+// Poll an analysis job until it finishes
+let analysisOpened = false;
+function pollJob(jobId, interval = 2000) {
+    fetch(`http://127.0.0.1:5000/jobs/${jobId}/result`)
+    .then(response => response.json().then(data => ({ status: response.status, data })))
+    .then(({ status, data }) => {
+        if (status === 202) {
+            console.log(`Job ${jobId}: ${data.stage}`);
+            // The crew has started on the final report; follow it live
+            if (data.stage === "synthesizing" && !analysisOpened) {
+                analysisOpened = true;
+                window.open(`http://127.0.0.1:5000/analysis?session_id=${sessionId}`, "_blank");
+            }
+            setTimeout(() => pollJob(jobId, interval), interval);
+        } else if (data.error) {
+            console.error(`Job ${jobId} failed:`, data.details || data.error);
+        } else {
+            console.log(`Job ${jobId} finished:`, data);
+        }
+    })
+    .catch(error => {
+        console.error("Error polling analysis job:", error);
+    });
+}
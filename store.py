@@ -0,0 +1,192 @@
+import json
+import os
+import threading
+import time
+from abc import ABC, abstractmethod
+from contextlib import closing
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from db import connect, create, transaction
+
+# "sqlite" is safe across gunicorn worker processes, "memory" only within one process
+ANALYSIS_STORE = os.getenv("ANALYSIS_STORE", "sqlite")
+ANALYSIS_DB = Path(os.getenv("ANALYSIS_DB", "output/analysis.db"))
+
+
+class AnalysisStore(ABC):
+    """Per-session analysis state plus job records shared by all workers."""
+
+    @abstractmethod
+    def add_analysis(self, session_id: str, report: str, image: str, batch_size: int) -> Optional[Dict[str, List[str]]]:
+        """Append one analysis for the session.
+
+        Once the session holds batch_size analyses they are removed and
+        returned as {"reports": [...], "images": [...]}; otherwise returns None.
+        The append and the check happen atomically, so exactly one caller
+        receives each batch.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def take_analyses(self, session_id: str) -> Optional[Dict[str, List[str]]]:
+        """Remove and return the session's analyses that haven't made a full batch yet, or None if there are none."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def set_final_report(self, session_id: str, report: str):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_final_report(self, session_id: str) -> Optional[str]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def save_job(self, job: dict):
+        raise NotImplementedError
+
+    @abstractmethod
+    def load_job(self, job_id: str) -> Optional[dict]:
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_jobs_before(self, cutoff: float):
+        raise NotImplementedError
+
+
+class MemoryStore(AnalysisStore):
+    """In-process store guarded by a lock. Use with a single server process."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sessions: Dict[str, Dict[str, list]] = {}
+        self._final_reports: Dict[str, str] = {}
+        self._jobs: Dict[str, dict] = {}
+
+    def add_analysis(self, session_id, report, image, batch_size):
+        with self._lock:
+            session = self._sessions.setdefault(session_id, {"reports": [], "images": []})
+            session["reports"].append(report)
+            session["images"].append(image)
+            if len(session["reports"]) < batch_size:
+                return None
+            return self._sessions.pop(session_id)
+
+    def take_analyses(self, session_id):
+        with self._lock:
+            return self._sessions.pop(session_id, None)
+
+    def set_final_report(self, session_id, report):
+        with self._lock:
+            self._final_reports[session_id] = report
+
+    def get_final_report(self, session_id):
+        with self._lock:
+            return self._final_reports.get(session_id)
+
+    def save_job(self, job):
+        with self._lock:
+            self._jobs[job["id"]] = dict(job)
+
+    def load_job(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job else None
+
+    def delete_jobs_before(self, cutoff):
+        with self._lock:
+            for job_id in [k for k, job in self._jobs.items() if job["updated"] < cutoff]:
+                del self._jobs[job_id]
+
+
+class SQLiteStore(AnalysisStore):
+    """SQLite-backed store; safe to share between threads and worker processes."""
+
+    def __init__(self, path: Path = ANALYSIS_DB):
+        self.path = Path(path)
+        create(self.path, """
+            CREATE TABLE IF NOT EXISTS session_analyses (
+                seq INTEGER PRIMARY KEY AUTOINCREMENT,
+                session_id TEXT NOT NULL,
+                report TEXT NOT NULL,
+                image TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_session_analyses_session
+                ON session_analyses (session_id);
+            CREATE TABLE IF NOT EXISTS final_reports (
+                session_id TEXT PRIMARY KEY,
+                report TEXT NOT NULL,
+                updated REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                updated REAL NOT NULL
+            );
+        """)
+
+    def add_analysis(self, session_id, report, image, batch_size):
+        # The transaction takes the write lock up front so concurrent
+        # workers cannot both see the batch as complete
+        with transaction(self.path) as conn:
+            conn.execute(
+                "INSERT INTO session_analyses (session_id, report, image) VALUES (?, ?, ?)",
+                (session_id, report, image),
+            )
+            rows = conn.execute(
+                "SELECT report, image FROM session_analyses WHERE session_id = ? ORDER BY seq",
+                (session_id,),
+            ).fetchall()
+            batch = None
+            if len(rows) >= batch_size:
+                conn.execute("DELETE FROM session_analyses WHERE session_id = ?", (session_id,))
+                batch = {"reports": [r[0] for r in rows], "images": [r[1] for r in rows]}
+        return batch
+
+    def take_analyses(self, session_id):
+        with transaction(self.path) as conn:
+            rows = conn.execute(
+                "SELECT report, image FROM session_analyses WHERE session_id = ? ORDER BY seq",
+                (session_id,),
+            ).fetchall()
+            conn.execute("DELETE FROM session_analyses WHERE session_id = ?", (session_id,))
+        return {"reports": [r[0] for r in rows], "images": [r[1] for r in rows]} if rows else None
+
+    def set_final_report(self, session_id, report):
+        with closing(connect(self.path)) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO final_reports (session_id, report, updated) VALUES (?, ?, ?)",
+                (session_id, report, time.time()),
+            )
+
+    def get_final_report(self, session_id):
+        with closing(connect(self.path)) as conn:
+            row = conn.execute(
+                "SELECT report FROM final_reports WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def save_job(self, job):
+        with closing(connect(self.path)) as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO jobs (id, data, updated) VALUES (?, ?, ?)",
+                (job["id"], json.dumps(job), job["updated"]),
+            )
+
+    def load_job(self, job_id):
+        with closing(connect(self.path)) as conn:
+            row = conn.execute("SELECT data FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def delete_jobs_before(self, cutoff):
+        with closing(connect(self.path)) as conn:
+            conn.execute("DELETE FROM jobs WHERE updated < ?", (cutoff,))
+
+
+def get_store(kind: str = ANALYSIS_STORE) -> AnalysisStore:
+    """Build the store selected by the ANALYSIS_STORE environment variable."""
+    if kind == "memory":
+        return MemoryStore()
+    if kind == "sqlite":
+        return SQLiteStore()
+    raise ValueError(f"Unknown ANALYSIS_STORE backend: {kind}")
@@ -0,0 +1,179 @@
+"""Minimal local stand-in for the OpenAI chat completions API.
+
+Usage:
+    python stub_openai.py [--port 8001] [--latency 0.5] [--rate-limit-every 0]
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 OPENAI_API_KEY=stub python app.py
+
+Structured-output requests (response_format json_schema) get the smallest JSON
+document that satisfies the schema; plain requests get a short markdown reply.
+"""
+import argparse
+import itertools
+import json
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+def minimal_instance(schema: dict, defs: dict):
+    """Smallest value matching a JSON schema (required fields only)."""
+    if "$ref" in schema:
+        return minimal_instance(defs[schema["$ref"].split("/")[-1]], defs)
+    for key in ("anyOf", "oneOf", "allOf"):
+        if key in schema:
+            return minimal_instance(schema[key][0], defs)
+    if "default" in schema:
+        return schema["default"]
+    if "enum" in schema:
+        return schema["enum"][0]
+
+    kind = schema.get("type", "object")
+    if isinstance(kind, list):
+        kind = kind[0]
+    if kind == "object":
+        properties = schema.get("properties", {})
+        return {name: minimal_instance(properties[name], defs) for name in schema.get("required", properties)}
+    if kind == "array":
+        return []
+    if kind == "integer":
+        return 1
+    if kind == "number":
+        return 1.0
+    if kind == "boolean":
+        return True
+    if kind == "null":
+        return None
+    return "stub"
+
+
+def count_tokens(content) -> int:
+    """Rough prompt token count: 4 characters per token, a flat 765 per image."""
+    if isinstance(content, str):
+        return len(content) // 4
+    tokens = 0
+    for part in content or []:
+        tokens += 765 if part.get("type") == "image_url" else len(part.get("text", "")) // 4
+    return tokens
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    latency = 0.0
+    rate_limit_every = 0
+    counter = itertools.count(1)
+    lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status: int, body: dict, headers: dict = None):
+        payload = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+        if not self.path.endswith("/chat/completions"):
+            self._send(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+
+        with self.lock:
+            n = next(self.counter)
+        if self.rate_limit_every and n % self.rate_limit_every == 0:
+            self._send(429, {"error": {"message": "Rate limit reached (stub)", "type": "rate_limit_error"}},
+                       {"Retry-After": "0.1"})
+            return
+
+        time.sleep(self.latency)
+
+        response_format = body.get("response_format") or {}
+        if response_format.get("type") == "json_schema":
+            schema = response_format["json_schema"]["schema"]
+            content = json.dumps(minimal_instance(schema, schema.get("$defs", {})))
+        else:
+            content = "## Stub report\n\nNo issues found.\n\n---\n\n## Image 2\n\n---\n\n## Image 3"
+
+        prompt_tokens = sum(count_tokens(message.get("content")) for message in body.get("messages", []))
+        completion_tokens = len(content) // 4
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        if body.get("stream"):
+            self._stream(body, content, usage)
+            return
+
+        self._send(200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content, "refusal": None},
+                "finish_reason": "stop",
+            }],
+            "usage": usage,
+        })
+
+    def _stream(self, body: dict, content: str, usage: dict):
+        """Send the reply as chat.completion.chunk server-sent events, a few words at a time."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+
+        base = {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": body.get("model", "gpt-4o"),
+        }
+        words = content.split(" ")
+        pieces = [" ".join(words[i:i + 4]) + (" " if i + 4 < len(words) else "") for i in range(0, len(words), 4)]
+        for i, piece in enumerate(pieces):
+            delta = {"content": piece}
+            if i == 0:
+                delta["role"] = "assistant"
+            chunk = dict(base, choices=[{"index": 0, "delta": delta, "finish_reason": None}])
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        final = dict(base, choices=[{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        if (body.get("stream_options") or {}).get("include_usage"):
+            final["usage"] = usage
+        self.wfile.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode("utf-8"))
+        self.wfile.flush()
+
+
+def serve(port: int = 8001, latency: float = 0.0, rate_limit_every: int = 0) -> ThreadingHTTPServer:
+    """Start the stub on a background thread and return the server."""
+    StubHandler.latency = latency
+    StubHandler.rate_limit_every = rate_limit_every
+    server = ThreadingHTTPServer(("127.0.0.1", port), StubHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local stub of the OpenAI chat completions API.")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before each reply")
+    parser.add_argument("--rate-limit-every", type=int, default=0, help="Answer every Nth request with a 429")
+    args = parser.parse_args()
+
+    server = serve(args.port, args.latency, args.rate_limit_every)
+    print(f"Stub OpenAI API on http://127.0.0.1:{args.port}/v1")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
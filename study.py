@@ -0,0 +1,127 @@
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from typing import Callable, Dict, List, Literal, Optional
+
+import yaml
+from pydantic import BaseModel, Field
+
+from heatmap import ui_image_path
+from metrics import note, span
+
+STUDIES_CONFIG = Path(os.getenv("STUDIES_CONFIG", "config/studies.yaml"))
+# Study used when an upload or page doesn't name one
+DEFAULT_STUDY = os.getenv("STUDY", "default")
+# Group crews (and merge steps) run at once in hierarchical synthesis
+SYNTHESIS_CONCURRENCY = int(os.getenv("SYNTHESIS_CONCURRENCY", "4"))
+
+
+class Study(BaseModel):
+    """One study: the UI images each participant sees and how their analyses are synthesized."""
+
+    id: str
+    title: str = ""
+    images: List[str] = Field(min_length=1)
+    randomize: bool = True
+    batch_size: Optional[int] = Field(default=None, ge=1)
+    synthesis: Literal["flat", "hierarchical"] = "flat"
+    group_size: int = Field(default=5, ge=2)
+
+    @property
+    def size(self) -> int:
+        """Analyses per crew run."""
+        return self.batch_size or len(self.images)
+
+
+@lru_cache(maxsize=None)
+def _load_studies(path: str, mtime: float) -> Dict[str, Study]:
+    with open(path, encoding="utf-8") as file:
+        content = yaml.safe_load(file) or {}
+    studies = {study_id: Study(id=study_id, **config) for study_id, config in content.items()}
+    for study in studies.values():
+        for image_id in study.images:
+            ui_image_path(image_id)
+    return studies
+
+
+def load_studies(path: Path = STUDIES_CONFIG) -> Dict[str, Study]:
+    """All studies in the config file, re-read when it changes."""
+    return _load_studies(str(path), os.path.getmtime(path))
+
+
+def get_study(study_id: str = None) -> Study:
+    """The named study (default: DEFAULT_STUDY); raises KeyError for an unknown ID."""
+    study_id = study_id or DEFAULT_STUDY
+    studies = load_studies()
+    if study_id not in studies:
+        raise KeyError(f"Unknown study: {study_id}")
+    return studies[study_id]
+
+
+def _chunks(items: List[str], size: int) -> List[List[str]]:
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+def _map(pool: ThreadPoolExecutor, fn: Callable, items: list) -> list:
+    # Each call runs in a copy of this thread's context, so its spans land in the current job's trace
+    futures = [pool.submit(contextvars.copy_context().run, fn, item) for item in items]
+    return [future.result() for future in futures]
+
+
+def _image_recommendations(result, first_image: int) -> list:
+    # The per-image tasks come first, in image order; their number is their position, not the model's guess
+    return [
+        output.pydantic.model_copy(update={"image_number": n})
+        for n, output in enumerate(getattr(result, "tasks_output", [])[:-1], first_image)
+        if getattr(output, "pydantic", None) is not None
+    ]
+
+
+def synthesize(reports: List[str], study: Study, on_chunk: Callable[[str, str], None] = None,
+               recommendations: list = None) -> str:
+    """The crew's markdown report over a batch of per-image analyses.
+
+    Flat synthesis (or a batch no larger than one group) is a single crew run.
+    Hierarchical synthesis runs one crew per group of group_size images,
+    concurrently, so each crew's prompts and run time stay the same however
+    large the study; the group reports are then merged into a study summary,
+    summarizing summaries in groups again while there are more than
+    group_size of them. The report is the groups' per-image sections in image
+    order followed by the summary.
+
+    If a recommendations list is passed, the parsed ImageRecommendations of
+    every image are appended to it.
+    """
+    from crew import UIEvalCrew
+
+    group_size = study.group_size
+    if study.synthesis == "flat" or len(reports) <= group_size:
+        result = UIEvalCrew().kickoff_reports(reports, on_chunk)
+        if recommendations is not None:
+            recommendations.extend(_image_recommendations(result, 1))
+        return result.raw
+
+    starts = range(0, len(reports), group_size)
+    note(synthesis_groups=len(starts))
+    with ThreadPoolExecutor(max_workers=SYNTHESIS_CONCURRENCY) as pool:
+        with span("synthesis_groups"):
+            results = _map(
+                pool,
+                lambda start: UIEvalCrew().kickoff_reports(reports[start:start + group_size], on_chunk, start + 1),
+                starts,
+            )
+        sections = [result.raw for result in results]
+        if recommendations is not None:
+            for start, result in zip(starts, results):
+                recommendations.extend(_image_recommendations(result, start + 1))
+
+        with span("synthesis_merge"):
+            summaries = sections
+            while len(summaries) > group_size:
+                summaries = _map(pool, lambda group: UIEvalCrew().kickoff_summary(group, on_chunk).raw,
+                                 _chunks(summaries, group_size))
+            summary = UIEvalCrew().kickoff_summary(summaries, on_chunk).raw
+
+    return "\n\n---\n\n".join(section.strip() for section in [*sections, summary])
@@ -0,0 +1,40 @@
+import threading
+
+import numpy as np
+
+from aggregate import HeatmapAggregator
+
+
+def test_participants_have_equal_weight_and_empty_maps_are_skipped(tmp_path):
+    aggregator = HeatmapAggregator(tmp_path)
+    short, long = np.zeros((10, 10), np.float32), np.zeros((10, 10), np.float32)
+    short[1, 1] = 1
+    long[8, 8] = 50
+    assert aggregator.add_density("image1.png", short) == 1
+    assert aggregator.add_density("image1.png", long) == 2
+    assert aggregator.add_density("image1.png", np.zeros((10, 10), np.float32)) == 2
+    result = aggregator.aggregate("image1.png")
+    assert result[1, 1] == result[8, 8] == 1.0
+    assert aggregator.stats("image1.png")["participants"] == 2
+
+
+def test_stats_never_sees_a_partial_sidecar(tmp_path):
+    aggregator = HeatmapAggregator(tmp_path)
+    density = np.ones((20, 20), np.float32)
+    aggregator.add_density("image1.png", density)
+    errors = []
+
+    def read():
+        for _ in range(500):
+            try:
+                assert aggregator.stats("image1.png")["participants"] >= 1
+            except Exception as e:
+                errors.append(e)
+
+    reader = threading.Thread(target=read)
+    reader.start()
+    for _ in range(200):
+        aggregator.add_density("image1.png", density)
+    reader.join()
+    assert not errors
+    assert not list(tmp_path.glob("*.tmp"))
@@ -0,0 +1,29 @@
+from artifacts import ArtifactStore
+
+
+def store_with(tmp_path, count, **kwargs):
+    store = ArtifactStore(tmp_path, tmp_path / "artifacts.db", **kwargs)
+    paths = [store.put("heatmap", bytes([i]) * 100) for i in range(count)]
+    store.flush()
+    return store, paths
+
+
+def test_eviction_is_off_by_default(tmp_path):
+    store, paths = store_with(tmp_path, 3, retention_days=0, max_bytes=0)
+    assert store.evict(now=1e12) == 0
+    assert all((tmp_path / path).exists() for path in paths)
+
+
+def test_retention_skips_referenced_artifacts(tmp_path):
+    store, paths = store_with(tmp_path, 3, retention_days=1, referenced=lambda candidates: {paths[0]})
+    assert store.evict(now=1e12) == 2
+    assert [p for p in paths if (tmp_path / p).exists()] == [paths[0]]
+    assert [a["path"] for a in store.find()] == [paths[0]]
+
+
+def test_size_cap_evicts_least_recently_used(tmp_path):
+    store, paths = store_with(tmp_path, 3, max_bytes=250)
+    # Serving the oldest artifact makes it the most recently used
+    store.touch(paths[0], now=1e12)
+    assert store.evict() == 1
+    assert [p for p in paths if (tmp_path / p).exists()] == [paths[0], paths[2]]
@@ -0,0 +1,29 @@
+import numpy as np
+
+from cache import AnalysisCache
+
+
+def blend(noise=0):
+    image = np.tile(np.linspace(0, 255, 64, dtype=np.uint8), (48, 1))
+    image = np.dstack([image, image[::-1], image])
+    image[0, 0] = noise
+    return image
+
+
+def test_near_matches_are_found_on_disk_after_a_restart(tmp_path):
+    cache = AnalysisCache(tmp_path, max_entries=1, phash_distance=4)
+    assert cache.get_or_compute(blend(), "prompt", "v1", lambda: "first") == ("first", False)
+
+    restarted = AnalysisCache(tmp_path, max_entries=1, phash_distance=4)
+    assert restarted.get_or_compute(blend(noise=7), "prompt", "v1", lambda: "second") == ("first", True)
+    # Another scope never reuses it
+    assert restarted.get_or_compute(blend(noise=7), "other", "v1", lambda: "third") == ("third", False)
+
+
+def test_evicted_entries_leave_the_phash_index(tmp_path):
+    cache = AnalysisCache(tmp_path, max_entries=1, max_disk_entries=1, phash_distance=4)
+    cache.get_or_compute(blend(), "prompt", "v1", lambda: "first")
+    cache.get_or_compute(blend(), "other", "v1", lambda: "other")
+
+    restarted = AnalysisCache(tmp_path, max_entries=1, phash_distance=4)
+    assert restarted.get_or_compute(blend(noise=7), "prompt", "v1", lambda: "second") == ("second", False)
@@ -0,0 +1,39 @@
+import cv2
+import numpy as np
+import pytest
+
+from contrast import analyze_contrast, contrast_ratio, relative_luminance
+
+
+def test_wcag_reference_ratios():
+    white, black = relative_luminance(np.array([[255, 255, 255], [0, 0, 0]], dtype=np.uint8))
+    assert white == pytest.approx(1.0)
+    assert black == pytest.approx(0.0)
+    assert contrast_ratio(white, black) == pytest.approx(21.0)
+    # #767676 on white is the lightest grey that passes AA for normal text (4.54:1)
+    grey = relative_luminance(np.array([0x76, 0x76, 0x76], dtype=np.uint8))
+    assert contrast_ratio(grey, white) == pytest.approx(4.54, abs=0.01)
+
+
+def screenshot(foreground, background):
+    image = np.full((120, 400, 3), background, dtype=np.uint8)
+    cv2.putText(image, "Sign up today", (20, 70), cv2.FONT_HERSHEY_SIMPLEX, 1.0, foreground, 2, cv2.LINE_AA)
+    return image
+
+
+def test_low_contrast_text_fails_aa():
+    report = analyze_contrast(screenshot((170, 170, 170), (255, 255, 255)))
+    assert report["regions"] >= 1
+    assert report["fails_aa"] >= 1
+    assert report["min_ratio"] < 4.5
+
+
+def test_high_contrast_text_passes():
+    report = analyze_contrast(screenshot((0, 0, 0), (255, 255, 255)))
+    assert report["regions"] >= 1
+    assert report["fails_aa"] == 0
+    assert report["min_ratio"] > 10
+
+
+def test_blank_image_has_no_regions():
+    assert analyze_contrast(np.full((50, 50, 3), 255, dtype=np.uint8))["regions"] == 0
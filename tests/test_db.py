@@ -0,0 +1,19 @@
+from contextlib import closing
+
+import pytest
+
+from db import connect, create, transaction
+
+
+def test_transaction_commits_or_rolls_back(tmp_path):
+    path = tmp_path / "sub" / "test.db"
+    create(path, "CREATE TABLE t (v INTEGER);")
+    with transaction(path) as conn:
+        conn.execute("INSERT INTO t VALUES (1)")
+    with pytest.raises(RuntimeError):
+        with transaction(path) as conn:
+            conn.execute("INSERT INTO t VALUES (2)")
+            raise RuntimeError("fail")
+    with closing(connect(path)) as conn:
+        assert conn.execute("SELECT v FROM t").fetchall() == [(1,)]
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
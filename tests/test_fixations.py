@@ -0,0 +1,103 @@
+import numpy as np
+import pytest
+
+from fixations import aoi_metrics, detect_fixations_idt, detect_fixations_ivt, detect_saccades, gaze_metrics
+
+# Sampled every 10 ms: 300 ms at (100, 100), a 50 ms saccade, 300 ms at (400, 400)
+STEP_MS = 10.0
+
+
+def gaze(*segments):
+    """x, y, t samples for (x, y, sample count) segments, back to back."""
+    points = np.concatenate([np.tile([x, y], (n, 1)) for x, y, n in segments])
+    t = np.arange(len(points)) * STEP_MS
+    return np.column_stack([points, t])
+
+
+def saccade(start, end, n=5):
+    """Samples moving fast from start to end (exclusive of both)."""
+    steps = np.linspace(0, 1, n + 2)[1:-1]
+    return [(start[0] + (end[0] - start[0]) * s, start[1] + (end[1] - start[1]) * s, 1) for s in steps]
+
+
+def two_fixations():
+    return gaze((100, 100, 30), *saccade((100, 100), (400, 400)), (400, 400, 30))
+
+
+@pytest.mark.parametrize("detect", [detect_fixations_ivt, detect_fixations_idt])
+def test_centroids_exclude_saccade_samples(detect):
+    fixations = detect(two_fixations())
+    assert len(fixations) == 2
+    np.testing.assert_allclose(fixations[:, :2], [[100, 100], [400, 400]])
+
+
+@pytest.mark.parametrize("detect", [detect_fixations_ivt, detect_fixations_idt])
+def test_short_fixations_are_dropped(detect):
+    samples = gaze((100, 100, 5), *saccade((100, 100), (400, 400)), (400, 400, 30))
+    fixations = detect(samples, min_duration=100.0)
+    np.testing.assert_allclose(fixations[:, :2], [[400, 400]])
+
+
+def reference_idt_windows(samples, dispersion_threshold, min_duration):
+    """Textbook I-DT, one sample at a time: (start, end) of each fixation window."""
+    x, y, t = samples.T
+    windows, i = [], 0
+    while i < len(t):
+        j = np.searchsorted(t, t[i] + min_duration)
+        if j >= len(t):
+            break
+        if np.ptp(x[i:j + 1]) + np.ptp(y[i:j + 1]) > dispersion_threshold:
+            i += 1
+            continue
+        while j + 1 < len(t) and np.ptp(x[i:j + 2]) + np.ptp(y[i:j + 2]) <= dispersion_threshold:
+            j += 1
+        windows.append((t[i], t[j]))
+        i = j + 1
+    return [(start, end) for start, end in windows if end - start >= min_duration]
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_idt_matches_reference(seed):
+    rng = np.random.default_rng(seed)
+    # Jittered dwells at random points, sampled every 10 ms
+    centers = rng.uniform(0, 1000, (40, 2))
+    points = np.concatenate([c + rng.normal(0, 10, (rng.integers(2, 40), 2)) for c in centers])
+    samples = np.column_stack([points, np.arange(len(points)) * STEP_MS])
+    fixations = detect_fixations_idt(samples, dispersion_threshold=60.0, min_duration=100.0)
+    assert len(fixations) > 0
+    np.testing.assert_array_equal(fixations[:, 2:4], reference_idt_windows(samples, 60.0, 100.0))
+
+
+def test_saccade_between_fixations():
+    saccades = detect_saccades(detect_fixations_ivt(two_fixations()))
+    np.testing.assert_allclose(saccades[:, 0], [np.hypot(300, 300)])
+
+
+def test_aoi_metrics():
+    fixations = detect_fixations_ivt(gaze(
+        (100, 100, 30), *saccade((100, 100), (400, 400)), (400, 400, 30), *saccade((400, 400), (100, 100)),
+        (100, 100, 30),
+    ))
+    aois = {"a": (0, 0, 200, 200), "b": (300, 300, 200, 200), "c": (600, 600, 10, 10)}
+    metrics = aoi_metrics(fixations, aois, session_start=0.0)
+    assert metrics["a"]["fixations"] == 2
+    assert metrics["a"]["revisits"] == 1
+    assert metrics["a"]["time_to_first_fixation_ms"] == 0.0
+    assert metrics["b"]["time_to_first_fixation_ms"] == pytest.approx(fixations[1, 2])
+    assert metrics["b"]["dwell_ms"] == pytest.approx(fixations[1, 4], abs=0.1)
+    assert metrics["c"] == {"dwell_ms": 0.0, "fixations": 0, "time_to_first_fixation_ms": None, "revisits": 0}
+
+
+def test_gaze_metrics():
+    metrics = gaze_metrics(two_fixations(), {"a": (0, 0, 200, 200)})
+    assert metrics["fixation_count"] == 2
+    assert metrics["saccade_count"] == 1
+    assert metrics["aois"]["a"]["fixations"] == 1
+
+
+def test_no_fixations():
+    samples = gaze(*saccade((0, 0), (900, 900), n=20))
+    metrics = gaze_metrics(samples, {"a": (0, 0, 200, 200)})
+    assert metrics["fixation_count"] == 0
+    assert metrics["aois"]["a"] == {"dwell_ms": 0.0, "fixations": 0, "time_to_first_fixation_ms": None, "revisits": 0}
+    assert gaze_metrics(np.empty((0, 3)), {"a": (0, 0, 1, 1)})["aois"]["a"]["fixations"] == 0
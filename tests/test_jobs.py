@@ -0,0 +1,79 @@
+import threading
+
+import pytest
+
+from jobs import JobQueue, QueueFullError
+from store import MemoryStore
+
+
+class FlakyStore(MemoryStore):
+    """A store whose writes fail while failing is set."""
+
+    def __init__(self):
+        super().__init__()
+        self.failing = False
+
+    def save_job(self, job):
+        if self.failing:
+            raise RuntimeError("database is locked")
+        super().save_job(job)
+
+
+def wait_idle(queue):
+    for _ in range(200):
+        if not queue.pending():
+            return
+        threading.Event().wait(0.01)
+    raise AssertionError("jobs still pending")
+
+
+def test_store_error_on_submit_releases_the_slot():
+    store = FlakyStore()
+    queue = JobQueue(store, max_workers=1, max_pending=1)
+    store.failing = True
+    for _ in range(3):
+        with pytest.raises(RuntimeError):
+            queue.submit(lambda progress: None)
+    assert queue.pending() == 0
+    store.failing = False
+    job_id = queue.submit(lambda progress: "ok")
+    wait_idle(queue)
+    assert queue.get(job_id)["result"] == "ok"
+
+
+def test_store_error_while_running_releases_the_slot():
+    store = FlakyStore()
+    queue = JobQueue(store, max_workers=1, max_pending=1)
+    release = threading.Event()
+
+    def fail_store(progress):
+        store.failing = True
+        release.set()
+        return "lost"
+
+    job_id = queue.submit(fail_store)
+    release.wait(1)
+    wait_idle(queue)
+    store.failing = False
+    assert queue.get(job_id)["status"] == "running"
+    assert queue.submit(lambda progress: None)
+
+
+def test_failed_job_is_marked_and_queue_is_bounded():
+    queue = JobQueue(MemoryStore(), max_workers=1, max_pending=1)
+    started = threading.Event()
+    release = threading.Event()
+
+    def blocked(progress):
+        started.set()
+        release.wait(1)
+        raise ValueError("bad image")
+
+    job_id = queue.submit(blocked)
+    started.wait(1)
+    with pytest.raises(QueueFullError):
+        queue.submit(lambda progress: None)
+    release.set()
+    wait_idle(queue)
+    job = queue.get(job_id)
+    assert (job["status"], job["error"]) == ("failed", "bad image")
@@ -0,0 +1,54 @@
+import numpy as np
+import pytest
+
+from live import GazeRing, LiveGaze, LiveSession, decode_frame
+
+
+def samples(n, start=0):
+    return np.arange(start * 4, (start + n) * 4, dtype=np.float32).reshape(n, 4)
+
+
+def test_ring_keeps_newest_samples_in_order():
+    ring = GazeRing(10)
+    ring.append(samples(7))
+    assert ring.size == 7
+    np.testing.assert_array_equal(ring.points(), samples(7))
+    ring.append(samples(7, 7))
+    assert ring.size == 10
+    np.testing.assert_array_equal(ring.points(), samples(10, 4))
+
+
+def test_ring_append_larger_than_capacity():
+    ring = GazeRing(5)
+    ring.append(samples(3))
+    ring.append(samples(12, 3))
+    np.testing.assert_array_equal(ring.points(), samples(5, 10))
+
+
+def test_decode_frame_rejects_bad_frames():
+    frame = np.array([[1, 2, 3], [4, 5, 6]], dtype="<f4")
+    np.testing.assert_array_equal(decode_frame(frame.tobytes()), frame)
+    with pytest.raises(ValueError):
+        decode_frame(b"\0" * 13)
+    with pytest.raises(ValueError):
+        decode_frame(np.array([[1, np.nan, 3]], dtype="<f4").tobytes())
+
+
+def test_session_grid_weights_samples_by_duration():
+    session = LiveSession("s", "image1.png", (100, 200), display_size=(400, 200))
+    t = np.arange(10, dtype=np.float32) * 50
+    session.add(np.column_stack([np.full(10, 300), np.full(10, 100), t]).astype(np.float32))
+    # Display (300, 100) is image (150, 50); the first sample has no duration
+    assert session.grid.sum() == pytest.approx(9 * 50 / 100)
+    assert session.grid[50 // 8, 150 // 8] == session.grid.max()
+    assert session.gaze_points().shape == (10, 4)
+
+
+def test_end_drops_session():
+    live = LiveGaze()
+    live.start("s", "image1.png", (100, 200))
+    live.add("s", np.array([[1, 2, 3]], dtype="<f4").tobytes())
+    live.end("s")
+    assert live.get("s") is None
+    with pytest.raises(KeyError):
+        live.add("s", b"")
@@ -0,0 +1,47 @@
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from store import AnalysisStore, MemoryStore, SQLiteStore
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    return MemoryStore() if request.param == "memory" else SQLiteStore(tmp_path / "analysis.db")
+
+
+def test_incomplete_backend_fails_at_instantiation():
+    class Partial(AnalysisStore):
+        def add_analysis(self, session_id, report, image, batch_size):
+            return None
+
+    with pytest.raises(TypeError):
+        Partial()
+
+
+def test_batch_is_returned_once_full(store):
+    assert store.add_analysis("s", "r1", "i1", 3) is None
+    assert store.add_analysis("s", "r2", "i2", 3) is None
+    assert store.add_analysis("s", "r3", "i3", 3) == {"reports": ["r1", "r2", "r3"], "images": ["i1", "i2", "i3"]}
+    assert store.take_analyses("s") is None
+
+
+def test_take_analyses_returns_partial_batch(store):
+    store.add_analysis("s", "r1", "i1", 3)
+    assert store.take_analyses("s") == {"reports": ["r1"], "images": ["i1"]}
+    assert store.take_analyses("s") is None
+
+
+def test_concurrent_adds_hand_out_each_batch_once(store):
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        batches = list(pool.map(lambda i: store.add_analysis("s", f"r{i}", f"i{i}", 3), range(30)))
+    full = [batch for batch in batches if batch]
+    assert len(full) == 10
+    assert sorted(r for batch in full for r in batch["reports"]) == sorted(f"r{i}" for i in range(30))
+
+
+def test_jobs_round_trip_and_expire(store):
+    store.save_job({"id": "j", "status": "done", "updated": 10.0})
+    assert store.load_job("j")["status"] == "done"
+    store.delete_jobs_before(20.0)
+    assert store.load_job("j") is None
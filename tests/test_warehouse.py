@@ -0,0 +1,42 @@
+import json
+
+import pytest
+
+import warehouse
+from warehouse import Warehouse
+
+ANALYSIS = {
+    "visual_clarity_weaknesses": [
+        {"issue": "Low contrast banner text", "location": "top", "severity": "Critical", "impact": "unreadable"},
+    ],
+    "accessibility": [{"issue": "Small tap targets", "location": "footer", "severity": "minor", "impact": "misses"}],
+}
+
+
+@pytest.fixture
+def store(tmp_path):
+    return Warehouse(tmp_path / "warehouse.db")
+
+
+def test_findings_are_normalized_and_searchable(store):
+    store.add_analysis("s1", json.dumps(ANALYSIS), image_id="image1.png")
+    store.add_analysis("s2", json.dumps(ANALYSIS), image_id="image2.png")
+    found = store.findings(text="contrast", severity="high", image_id="image2.png")
+    assert [(f["session_id"], f["severity_text"]) for f in found] == [("s2", "Critical")]
+    counts = store.counts(["kind", "severity"])
+    assert {(c["kind"], c["severity"], c["findings"]) for c in counts} == {("weakness", "high", 2),
+                                                                            ("accessibility", "low", 2)}
+    with pytest.raises(ValueError):
+        store.counts(["data"])
+
+
+def test_export_schema_allows_values_after_null_row_groups(store, tmp_path, monkeypatch):
+    pq = pytest.importorskip("pyarrow.parquet")
+    monkeypatch.setattr(warehouse, "EXPORT_BATCH_ROWS", 1)
+    store.add_analysis("s1", json.dumps(ANALYSIS))
+    store.add_analysis("s1", json.dumps(ANALYSIS), image_id="image1.png", contrast={"min_ratio": 2.5, "fails_aa": 1})
+    assert store.export_parquet(tmp_path / "export")["analyses"] == 2
+    table = pq.read_table(tmp_path / "export" / "analyses.parquet")
+    assert table.column("image_id").to_pylist() == [None, "image1.png"]
+    assert table.column("contrast_min_ratio").to_pylist() == [None, 2.5]
+    assert pq.read_table(tmp_path / "export" / "recommendations.parquet").num_rows == 0
@@ -0,0 +1,419 @@
+"""Structured, indexed store of every analysis and crew recommendation.
+
+Each vision analysis (APIAnalysis) and per-image crew result
+(ImageRecommendations) is broken into rows: one per analysis, one per
+finding (weakness, accessibility issue, strength, fixation or ignored area)
+with a normalized severity, and one per AOI attention share. Findings have
+an FTS5 index on their text, so questions such as "high-severity contrast
+issues on image2 across all sessions" are answered by an indexed query
+instead of grepping reports or calling the LLM again.
+
+Usage:
+    python warehouse.py findings [--image image2.png] [--severity high] [--kind accessibility] [--text contrast]
+    python warehouse.py counts --by image_id severity [filters as above]
+    python warehouse.py export DIRECTORY      (Parquet, needs pyarrow)
+    python warehouse.py ingest CHECKPOINT     (analyses from a batch.py checkpoint)
+"""
+import argparse
+import json
+import os
+import re
+import sqlite3
+import sys
+import time
+from contextlib import closing
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Set
+
+from db import connect, create, transaction
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet export is unavailable; the SQLite store works without it
+    pa = pq = None
+
+# Record every analysis and crew result in the warehouse
+WAREHOUSE = os.getenv("WAREHOUSE", "1") == "1"
+WAREHOUSE_DB = Path(os.getenv("WAREHOUSE_DB", "output/warehouse.db"))
+
+# Rows per Parquet row group on export
+EXPORT_BATCH_ROWS = 50_000
+# SQLite column type -> Arrow type alias for the export schema
+_ARROW_TYPES = {"INTEGER": "int64", "REAL": "float64", "TEXT": "string"}
+
+# Columns a query may filter or group findings by
+FINDING_FILTERS = ("session_id", "study_id", "image_id", "kind", "severity", "source")
+
+# Leading severity word -> normalized severity
+_SEVERITIES = {"critical": "high", "high": "high", "severe": "high", "major": "high",
+               "medium": "medium", "moderate": "medium", "low": "low", "minor": "low"}
+_SEVERITY_PATTERN = re.compile(r"\b(" + "|".join(_SEVERITIES) + r")\b", re.IGNORECASE)
+_WCAG_LEVEL_PATTERN = re.compile(r"\b(AAA|AA)\b|\blevel\s+(A)\b", re.IGNORECASE)
+
+
+def normalize_severity(text: Optional[str]) -> Optional[str]:
+    """'High - directly blocks checkout' -> 'high'; None if no severity word is found near the start."""
+    match = _SEVERITY_PATTERN.search((text or "")[:40])
+    return _SEVERITIES[match.group(1).lower()] if match else None
+
+
+def wcag_level(text: Optional[str]) -> Optional[str]:
+    """The first WCAG conformance level (A, AA, AAA) an evaluation names, or None."""
+    match = _WCAG_LEVEL_PATTERN.search(text or "")
+    return (match.group(1) or match.group(2)).upper() if match else None
+
+
+def _join(*parts: Optional[str]) -> str:
+    return "\n".join(part.strip() for part in parts if part and part.strip())
+
+
+def analysis_findings(analysis: dict) -> List[dict]:
+    """Findings of an APIAnalysis dict: kind, title, location, severity, detail."""
+    findings = []
+    for item in analysis.get("visual_clarity_weaknesses", []):
+        findings.append({"kind": "weakness", "title": item.get("issue"), "location": item.get("location"),
+                         "severity": item.get("severity"),
+                         "detail": _join(item.get("impact"), item.get("heatmap_correlation"))})
+    for item in analysis.get("accessibility", []):
+        findings.append({"kind": "accessibility", "title": item.get("issue"), "location": item.get("location"),
+                         "severity": item.get("severity"), "detail": _join(item.get("impact"))})
+    for kind, key in (("strength", "visual_clarity_strengths"), ("fixation", "primary_fixation_areas")):
+        for item in analysis.get(key, []):
+            findings.append({"kind": kind, "title": item.get("area"), "location": None, "severity": None,
+                             "detail": _join(item.get("reason"), item.get("alignment_with_goals"),
+                                             item.get("heatmap_correlation"))})
+    for item in analysis.get("ignored_areas", []):
+        findings.append({"kind": "ignored", "title": item.get("area"), "location": None, "severity": None,
+                         "detail": _join(item.get("reason"), item.get("critical_to_task"))})
+    return findings
+
+
+def recommendation_findings(recommendations: dict) -> List[dict]:
+    """Findings of an ImageRecommendations dict."""
+    findings = []
+    for item in recommendations.get("weaknesses", []):
+        findings.append({"kind": "crew_weakness", "title": item.get("weakness"), "location": None,
+                         "severity": item.get("severity"),
+                         "detail": _join(item.get("reason"), item.get("impact"), item.get("recommendations"),
+                                         item.get("heatmap_correlation"))})
+    for item in recommendations.get("strengths", []):
+        findings.append({"kind": "crew_strength", "title": item.get("strength"), "location": None, "severity": None,
+                         "detail": _join(item.get("heatmap_correlation"))})
+    return findings
+
+
+class Warehouse:
+    """SQLite warehouse of analyses, crew recommendations, findings and AOI attention."""
+
+    def __init__(self, path: Path = WAREHOUSE_DB):
+        self.path = Path(path)
+        create(self.path, """
+            CREATE TABLE IF NOT EXISTS analyses (
+                id INTEGER PRIMARY KEY,
+                session_id TEXT NOT NULL,
+                study_id TEXT,
+                image_id TEXT,
+                heatmap TEXT,
+                source TEXT NOT NULL,
+                wcag_level TEXT,
+                contrast_min_ratio REAL,
+                contrast_fails_aa INTEGER,
+                data TEXT NOT NULL,
+                created REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_analyses_image ON analyses (image_id, created);
+            CREATE INDEX IF NOT EXISTS idx_analyses_session ON analyses (session_id, heatmap);
+            CREATE TABLE IF NOT EXISTS recommendations (
+                id INTEGER PRIMARY KEY,
+                session_id TEXT NOT NULL,
+                study_id TEXT,
+                image_id TEXT,
+                image_number INTEGER,
+                heatmap TEXT,
+                report TEXT,
+                wcag_level TEXT,
+                data TEXT NOT NULL,
+                created REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_recommendations_image ON recommendations (image_id, created);
+            CREATE TABLE IF NOT EXISTS findings (
+                id INTEGER PRIMARY KEY,
+                source TEXT NOT NULL,
+                parent_id INTEGER NOT NULL,
+                session_id TEXT NOT NULL,
+                study_id TEXT,
+                image_id TEXT,
+                kind TEXT NOT NULL,
+                title TEXT,
+                location TEXT,
+                severity TEXT,
+                severity_text TEXT,
+                detail TEXT,
+                created REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_findings_image ON findings (image_id, severity, kind);
+            CREATE INDEX IF NOT EXISTS idx_findings_kind ON findings (kind, severity);
+            CREATE INDEX IF NOT EXISTS idx_findings_session ON findings (session_id);
+            CREATE INDEX IF NOT EXISTS idx_findings_study ON findings (study_id, image_id);
+            CREATE VIRTUAL TABLE IF NOT EXISTS findings_fts USING fts5 (
+                title, location, detail, content='findings', content_rowid='id'
+            );
+            CREATE TABLE IF NOT EXISTS aoi_attention (
+                analysis_id INTEGER NOT NULL,
+                session_id TEXT NOT NULL,
+                image_id TEXT,
+                aoi TEXT NOT NULL,
+                x INTEGER, y INTEGER, w INTEGER, h INTEGER,
+                share REAL NOT NULL,
+                density REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_aoi_attention_image ON aoi_attention (image_id, aoi);
+        """)
+
+    @staticmethod
+    def _insert_findings(conn: sqlite3.Connection, source: str, parent_id: int, findings: List[dict],
+                         session_id: str, study_id: Optional[str], image_id: Optional[str], now: float):
+        for finding in findings:
+            cursor = conn.execute(
+                "INSERT INTO findings (source, parent_id, session_id, study_id, image_id, kind, title, location, "
+                "severity, severity_text, detail, created) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (source, parent_id, session_id, study_id, image_id, finding["kind"], finding["title"],
+                 finding["location"], normalize_severity(finding["severity"]), finding["severity"],
+                 finding["detail"], now),
+            )
+            conn.execute("INSERT INTO findings_fts (rowid, title, location, detail) VALUES (?, ?, ?, ?)",
+                         (cursor.lastrowid, finding["title"], finding["location"], finding["detail"]))
+
+    def add_analysis(self, session_id: str, analysis: str, image_id: str = None, study_id: str = None,
+                     heatmap: str = None, source: str = "upload", aois: Dict[str, dict] = None,
+                     contrast: dict = None) -> int:
+        """Record one vision analysis (APIAnalysis JSON) with its findings and AOI attention; returns its ID."""
+        data = json.loads(analysis)
+        now = time.time()
+        with transaction(self.path) as conn:
+            analysis_id = conn.execute(
+                "INSERT INTO analyses (session_id, study_id, image_id, heatmap, source, wcag_level, "
+                "contrast_min_ratio, contrast_fails_aa, data, created) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (session_id, study_id, image_id, heatmap, source, wcag_level(data.get("overall_wcag_standards")),
+                 contrast["min_ratio"] if contrast else None, contrast["fails_aa"] if contrast else None,
+                 analysis, now),
+            ).lastrowid
+            self._insert_findings(conn, "vision", analysis_id, analysis_findings(data),
+                                  session_id, study_id, image_id, now)
+            conn.executemany(
+                "INSERT INTO aoi_attention (analysis_id, session_id, image_id, aoi, x, y, w, h, share, density) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [(analysis_id, session_id, image_id, name, *aoi["box"], aoi["share"], aoi["density"])
+                 for name, aoi in (aois or {}).items()],
+            )
+        return analysis_id
+
+    def add_recommendations(self, session_id: str, recommendations: Iterable, heatmaps: List[str],
+                            study_id: str = None, report: str = None) -> int:
+        """Record the crew's per-image ImageRecommendations of one report; returns how many were recorded.
+
+        heatmaps are the batch's heatmap paths in image order; each result's
+        image_number picks its heatmap, through which it is matched to the
+        analysis (and so the UI image) it came from.
+        """
+        now = time.time()
+        count = 0
+        with transaction(self.path) as conn:
+            for item in recommendations:
+                data = item.model_dump() if hasattr(item, "model_dump") else dict(item)
+                number = data.get("image_number")
+                heatmap = heatmaps[number - 1] if isinstance(number, int) and 0 < number <= len(heatmaps) else None
+                row = conn.execute(
+                    "SELECT image_id FROM analyses WHERE session_id = ? AND heatmap = ? ORDER BY id DESC LIMIT 1",
+                    (session_id, heatmap),
+                ).fetchone() if heatmap else None
+                image_id = row[0] if row else None
+                recommendation_id = conn.execute(
+                    "INSERT INTO recommendations (session_id, study_id, image_id, image_number, heatmap, report, "
+                    "wcag_level, data, created) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (session_id, study_id, image_id, number, heatmap, report,
+                     wcag_level(data.get("wcag_standards")), json.dumps(data), now),
+                ).lastrowid
+                self._insert_findings(conn, "crew", recommendation_id, recommendation_findings(data),
+                                      session_id, study_id, image_id, now)
+                count += 1
+        return count
+
+    @staticmethod
+    def _where(text: str = None, since: float = None, **filters) -> tuple:
+        clauses, params = [], []
+        for column in FINDING_FILTERS:
+            value = filters.get(column)
+            if value:
+                clauses.append(f"f.{column} = ?")
+                params.append(value)
+        if since:
+            clauses.append("f.created >= ?")
+            params.append(since)
+        join = ""
+        if text:
+            join = " JOIN findings_fts ON findings_fts.rowid = f.id"
+            clauses.append("findings_fts MATCH ?")
+            params.append(text)
+        return join, (" WHERE " + " AND ".join(clauses) if clauses else ""), params
+
+    def findings(self, text: str = None, since: float = None, limit: int = 100, **filters) -> List[dict]:
+        """Findings matching the filters (FINDING_FILTERS columns, an FTS5 text query, a created-since time), newest first."""
+        join, where, params = self._where(text, since, **filters)
+        query = ("SELECT f.id, f.source, f.session_id, f.study_id, f.image_id, f.kind, f.title, f.location, "
+                 f"f.severity, f.severity_text, f.detail, f.created FROM findings f{join}{where} "
+                 "ORDER BY f.created DESC, f.id DESC LIMIT ?")
+        with closing(connect(self.path)) as conn:
+            conn.row_factory = sqlite3.Row
+            return [dict(row) for row in conn.execute(query, (*params, limit))]
+
+    def counts(self, by: Iterable[str] = ("image_id", "severity"), text: str = None, since: float = None,
+               **filters) -> List[dict]:
+        """Finding counts grouped by FINDING_FILTERS columns, largest first."""
+        by = list(by)
+        unknown = [column for column in by if column not in FINDING_FILTERS]
+        if unknown or not by:
+            raise ValueError(f"Can only group by {', '.join(FINDING_FILTERS)}")
+        join, where, params = self._where(text, since, **filters)
+        columns = ", ".join(f"f.{column}" for column in by)
+        query = (f"SELECT {columns}, COUNT(*) AS findings, COUNT(DISTINCT f.session_id) AS sessions "
+                 f"FROM findings f{join}{where} GROUP BY {columns} ORDER BY findings DESC")
+        with closing(connect(self.path)) as conn:
+            conn.row_factory = sqlite3.Row
+            return [dict(row) for row in conn.execute(query, params)]
+
+    def aoi_attention(self, image_id: str) -> List[dict]:
+        """Mean attention share and density per AOI name on an image, over all recorded analyses."""
+        with closing(connect(self.path)) as conn:
+            conn.row_factory = sqlite3.Row
+            return [dict(row) for row in conn.execute(
+                "SELECT aoi, COUNT(*) AS analyses, AVG(share) AS mean_share, AVG(density) AS mean_density "
+                "FROM aoi_attention WHERE image_id = ? GROUP BY aoi ORDER BY mean_share DESC", (image_id,))]
+
+    def referenced(self, paths: Iterable[str]) -> Set[str]:
+        """The artifact store paths among paths that recorded analyses or recommendations point at.
+
+        Heatmaps are recorded by their artifact path, reports by their absolute
+        path; artifact file names are content hashes, so reports match by name.
+        """
+        paths = list(paths)
+        found = set()
+        with closing(connect(self.path)) as conn:
+            for start in range(0, len(paths), 500):
+                chunk = paths[start:start + 500]
+                marks = ", ".join("?" * len(chunk))
+                found.update(row[0] for row in conn.execute(
+                    f"SELECT heatmap FROM analyses WHERE heatmap IN ({marks}) "
+                    f"UNION SELECT heatmap FROM recommendations WHERE heatmap IN ({marks})", chunk * 2))
+            reports = {Path(row[0]).name for row in conn.execute(
+                "SELECT DISTINCT report FROM recommendations WHERE report IS NOT NULL")}
+        found.update(path for path in paths if Path(path).name in reports)
+        return found
+
+    def export_parquet(self, directory: Path) -> Dict[str, int]:
+        """Write every table to <directory>/<table>.parquet for bulk analytics; returns rows per table."""
+        if pa is None:
+            raise RuntimeError("Parquet export needs pyarrow (pip install pyarrow)")
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        rows = {}
+        with closing(connect(self.path)) as conn:
+            for table in ("analyses", "recommendations", "findings", "aoi_attention"):
+                # The schema comes from the table, not the data: a column that is all NULL in
+                # the first row group would otherwise be typed null and reject later values
+                columns = conn.execute(f"PRAGMA table_info({table})").fetchall()
+                schema = pa.schema([(name, pa.type_for_alias(_ARROW_TYPES[kind]), not notnull)
+                                    for _, name, kind, notnull, _, _ in columns])
+                cursor = conn.execute(f"SELECT {', '.join(schema.names)} FROM {table}")
+                rows[table] = 0
+                # Stream in row groups so large warehouses aren't loaded at once
+                with pq.ParquetWriter(directory / f"{table}.parquet", schema) as writer:
+                    while True:
+                        batch = cursor.fetchmany(EXPORT_BATCH_ROWS)
+                        if not batch:
+                            break
+                        writer.write_table(pa.Table.from_pylist([dict(zip(schema.names, row)) for row in batch],
+                                                                schema=schema))
+                        rows[table] += len(batch)
+        return rows
+
+
+def get_warehouse() -> Optional[Warehouse]:
+    """The warehouse, or None when WAREHOUSE is off."""
+    return Warehouse() if WAREHOUSE else None
+
+
+def ingest_checkpoint(warehouse: Warehouse, path: Path) -> int:
+    """Record the analyses of a batch.py checkpoint that aren't in the warehouse yet; returns how many."""
+    with closing(connect(warehouse.path)) as conn:
+        known = {row[0] for row in conn.execute("SELECT heatmap FROM analyses WHERE source = 'batch'")}
+    count = 0
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            if record.get("type") != "analysis" or record.get("heatmap") in known:
+                continue
+            warehouse.add_analysis(record["session"], record["analysis"], image_id=record.get("image_id"),
+                                   heatmap=record.get("heatmap"), source="batch", aois=record.get("aois"),
+                                   contrast=record.get("contrast"))
+            known.add(record.get("heatmap"))
+            count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the results warehouse.")
+    parser.add_argument("--db", type=Path, default=WAREHOUSE_DB)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_filters(command):
+        command.add_argument("--image", dest="image_id")
+        command.add_argument("--session", dest="session_id")
+        command.add_argument("--study", dest="study_id")
+        command.add_argument("--kind", help="weakness, accessibility, strength, fixation, ignored, crew_weakness, crew_strength")
+        command.add_argument("--severity", choices=["high", "medium", "low"])
+        command.add_argument("--source", choices=["vision", "crew"])
+        command.add_argument("--text", help="FTS5 query over title, location and detail, e.g. 'contrast OR legib*'")
+        command.add_argument("--since-days", type=float)
+
+    findings = commands.add_parser("findings", help="List matching findings as JSON lines")
+    add_filters(findings)
+    findings.add_argument("--limit", type=int, default=100)
+    counts = commands.add_parser("counts", help="Count matching findings per group")
+    add_filters(counts)
+    counts.add_argument("--by", nargs="+", default=["image_id", "severity"], choices=FINDING_FILTERS)
+    aois = commands.add_parser("aois", help="Mean attention per AOI of an image")
+    aois.add_argument("image_id")
+    export = commands.add_parser("export", help="Export every table to Parquet")
+    export.add_argument("directory", type=Path)
+    ingest = commands.add_parser("ingest", help="Record the analyses of a batch.py checkpoint")
+    ingest.add_argument("checkpoint", type=Path)
+    args = parser.parse_args()
+
+    warehouse = Warehouse(args.db)
+    started = time.perf_counter()
+    if args.command in ("findings", "counts"):
+        filters = {column: getattr(args, column) for column in FINDING_FILTERS}
+        since = time.time() - args.since_days * 86400 if args.since_days else None
+        if args.command == "findings":
+            rows = warehouse.findings(args.text, since, args.limit, **filters)
+        else:
+            rows = warehouse.counts(args.by, args.text, since, **filters)
+        for row in rows:
+            print(json.dumps(row))
+        print(f"{len(rows)} rows in {(time.perf_counter() - started) * 1000:.1f} ms", file=sys.stderr)
+    elif args.command == "aois":
+        for row in warehouse.aoi_attention(args.image_id):
+            print(json.dumps(row))
+    elif args.command == "export":
+        print(json.dumps(warehouse.export_parquet(args.directory)))
+    elif args.command == "ingest":
+        print(f"{ingest_checkpoint(warehouse, args.checkpoint)} analyses recorded")
+
+
+if __name__ == "__main__":
+    main()